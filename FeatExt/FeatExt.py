@@ -8,124 +8,638 @@ __author__ = 'Yorgos'
 import os
 import sys
 import argparse
+import array
+import ast
 import math
 import codecs
-from datetime import datetime
 import collections
-import statistics
+import concurrent.futures
+import contextlib
+import cProfile
+import functools
+import hashlib
+import importlib
+import io
+import itertools
+import json
+import struct
+import tempfile
 from math import log2
+from types import SimpleNamespace
 import glob
 import re
+import shutil
 import configparser
-
-import sympy
-
-try:
-    import nltk
-except ImportError:
-    print(ImportError)
-    exit('Error importing module: NLTK ')
+import logging
+import logging.handlers
+import mmap
+import multiprocessing
+import operator
+import pstats
+import time
+import zipfile
 
 # Define global variables and Constants
 div0 = 'Div/0!'
 missing = 'Missing!'
+# Define how many type frequencies are significant
+#TODO: parameterize this
+type_freqs_num = 30
+# Parameters of the length-robust lexical diversity measures: window of MATTR, type-token ratio threshold of MTLD
+# factors, and sample size of HD-D, in words
+mattr_window = 50
+mtld_threshold = 0.72
+hdd_sample = 42
 
 #-------------------
 #Helper functions
 #-------------------
 
-# Print for debugging purposes only
+# Print for debugging purposes only, unless in quiet mode
+verbose = True
 def debug_print(message):
     """Print for debugging purposes only."""
-    print('Debug: {!s}'.format(message)[:240]) # truncate message because damned IDLE can't handle long output!!! (I wasted several hours to figure it out!)
+    if verbose:
+        print('Debug: {!s}'.format(message)[:240]) # truncate message because damned IDLE can't handle long output!!! (I wasted several hours to figure it out!)
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Let through only the first few occurrences of each identical log message, and count the rest.
+
+    Per-text messages, e.g. about an unknown feature, would otherwise repeat for every text of the corpus.
+    At most max_messages distinct messages are counted; beyond that, the messages that were not suppressed
+    are forgotten, and if that is not enough, the suppressed occurrences are summed up per level only.
+    """
+
+    def __init__(self, max_repeats=5, max_messages=10000):
+        super().__init__()
+        self.max_repeats = max_repeats
+        self.max_messages = max_messages
+        self.counts = collections.Counter()
+        # Suppressed occurrences of messages that are no longer counted individually, per level
+        self.folded = collections.Counter()
+        # The same record is filtered once by every handler, but must be counted only once
+        self.last_record = None
+        self.last_result = True
+
+    def filter(self, record):
+        if record is not self.last_record:
+            key = (record.levelno, record.getMessage())
+            if key not in self.counts and len(self.counts) >= self.max_messages:
+                self.prune()
+            self.counts[key] += 1
+            self.last_record = record
+            self.last_result = self.counts[key] <= self.max_repeats
+        return self.last_result
+
+    def prune(self):
+        """
+        Make room for new messages to count.
+        """
+        self.counts = collections.Counter({key: count for key, count in self.counts.items()
+                                           if count > self.max_repeats})
+        if len(self.counts) > self.max_messages // 2:
+            for (level, message), count in self.counts.items():
+                self.folded[level] += count - self.max_repeats
+            self.counts.clear()
+
+    def suppressed(self):
+        """
+        @return: a list of (level, message, number of suppressed occurrences) tuples; message is None for
+                 the occurrences summed up per level
+        """
+        return ([(level, message, count - self.max_repeats)
+                 for (level, message), count in self.counts.items() if count > self.max_repeats] +
+                [(level, None, count) for level, count in self.folded.items()])
+
+
+# Logger of the program. Configured by init_log; in worker processes by init_worker_log.
+logger = logging.getLogger('FeatExt')
+# Queue of log records from worker processes, and listener forwarding them to the handlers of the main process
+log_queue = None
+log_listener = None
+
+
+def init_log(log_filename, level=logging.INFO, quiet=False, max_bytes=1000000, backup_count=3):
+    """
+    Initialize logging to the log file, and to standard output unless quiet.
+
+    Log records are buffered in memory and written to the file in batches, or at once for errors.
+    The log file is rotated when it grows beyond max_bytes. Log records of worker processes are sent
+    through log_queue and written by the main process only.
 
+    @rtype:    nothing
+    @param log_filename: the path of the log file
+    @param level: the lowest level of messages to log
+    @param quiet: if True, do not print log messages to standard output, except for errors
+    @param max_bytes: size of log file that triggers rotation
+    @param backup_count: number of rotated log files to keep
+    """
+    global log_listener, log_queue
+
+    formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
+    repeat_filter = RepeatFilter()
+
+    file_handler = logging.handlers.RotatingFileHandler(log_filename, maxBytes=max_bytes,
+                                                        backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    buffer_handler = logging.handlers.MemoryHandler(1000, flushLevel=logging.ERROR, target=file_handler)
+    buffer_handler.addFilter(repeat_filter)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(logging.ERROR if quiet else logging.NOTSET)
+    console_handler.addFilter(repeat_filter)
+
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(buffer_handler)
+    logger.addHandler(console_handler)
+
+    log_queue = multiprocessing.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, buffer_handler, console_handler,
+                                                  respect_handler_level=True)
+    log_listener.start()
+
+    logger.info('---STARTING PROGRAM---')
+
+
+def init_worker_log(queue, level):
+    """
+    Initialize logging in a worker process: send all log records to the main process through a queue.
+
+    @param queue: the log queue of the main process
+    @param level: the lowest level of messages to log
+    """
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(queue))
+
+
+def close_log():
+    """
+    Write a summary of suppressed repeated messages, flush and close the log.
+    """
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+    for handler in list(logger.handlers):
+        for log_filter in handler.filters:
+            if isinstance(log_filter, RepeatFilter):
+                for level, message, count in log_filter.suppressed():
+                    if message is None:
+                        summary = 'Suppressed {0} more occurrences of {1} messages'.format(
+                            count, logging.getLevelName(level))
+                    else:
+                        summary = 'Suppressed {0} more occurrences of {1} message: {2}'.format(
+                            count, logging.getLevelName(level), message)
+                    record = logging.LogRecord(logger.name, logging.INFO, '', 0, summary, None, None)
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+        handler.flush()
+        handler.close()
+        logger.removeHandler(handler)
 
 
-def merge_dicts_ord(*dicts):
+# Print to log file
+def write_log(message, level=logging.INFO):
     """
-    Given any number of dicts consisting of ordered dicts, shallow copy and merge into a new dict,
-    precedence goes to key value pairs in latter dicts.
+    Write to log file.
 
-    @rtype : a merged dictionary
-    @param *dicts: an arbitrary number of dictionaries to be merged
+    Arguments:  message: log message
+                level: log level of the message
+    Returns:    nothing
     """
+    logger.log(level, message)
+
+class FeatureTimer:
+    """
+    Accumulate the wall-clock and CPU time spent on each feature and on each processing stage.
+
+    Timings are kept per (family, name) pair, where family is a feature family (grammar, syntax, phrase, meta)
+    or 'stage' for reading, parsing and writing. Quantities shared by several features of a family, e.g. the
+    sentences of a text, are timed under their own names, once per text.
+
+    Texts read one batch of sentences at a time (see stream_text_features) add each batch to the running state of
+    every family, timed as 'state update' of the family. That is where most of the time of a family goes: the
+    timings of its features cover only their computation from the state, once per text. State updates are also
+    part of the time of the stage that reads the data.
+    """
+
+    def __init__(self, cprofile=False):
+        """
+        @param cprofile: True to also profile feature extraction in worker processes with cProfile
+        """
+        # keys: (family, name), values: [calls, wall-clock time, CPU time]
+        self.timings = {}
+        self.cprofile = cprofile
+
+    def add(self, family, name, wall, cpu, calls=1):
+        """
+        Add time spent on a feature or stage.
+
+        @param family: the feature family, or 'stage'
+        @param name: the feature or stage name
+        @param wall: wall-clock time in seconds
+        @param cpu: CPU time of the process in seconds
+        @param calls: number of calls the time was spent on
+        """
+        timing = self.timings.setdefault((family, name), [0, 0.0, 0.0])
+        timing[0] += calls
+        timing[1] += wall
+        timing[2] += cpu
+
+    def merge(self, timings):
+        """
+        Add timings collected elsewhere, e.g. in a worker process.
+
+        @param timings: a dictionary (keys: (family, name)) of [calls, wall-clock time, CPU time]
+        """
+        for (family, name), (calls, wall, cpu) in timings.items():
+            self.add(family, name, wall, cpu, calls)
+
+    @contextlib.contextmanager
+    def time(self, family, name):
+        """
+        Time the code of a with statement.
+
+        @param family: the feature family, or 'stage'
+        @param name: the feature or stage name
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(family, name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def write_report(self, filename, sep=','):
+        """
+        Write the timings to a CSV file, most time consuming first.
 
-    result = {}
-    for dictionary in dicts:
-        for key, value in dictionary.items():
-            result.setdefault(key, collections.OrderedDict())
-            result[key].update(value)
-    return result
+        @param filename: the name of the report file, with path
+        @param sep: CSV separator
+        """
+        with codecs.open(filename, "w", "utf-8") as report_file:
+            report_file.write(sep.join(['family', 'name', 'calls', 'wall_s', 'cpu_s', 'wall_ms_per_call']) + '\n')
+            for (family, name), (calls, wall, cpu) in sorted(self.timings.items(), key=lambda x: x[1][1],
+                                                             reverse=True):
+                report_file.write(sep.join([family, name, str(calls), '{0:.6f}'.format(wall), '{0:.6f}'.format(cpu),
+                                            '{0:.4f}'.format(1000 * wall / calls)]) + '\n')
 
 
-def init_log(log_filename):
+# The timer of the run, None unless profiling
+timer = None
+no_timing = contextlib.nullcontext()
+
+def timed(family, name):
     """
-    Initialize the log file.
+    Time the code of a with statement, if profiling.
 
-    @rtype:    nothing
-    @param log_filename: the path of the log file
+    @param family: the feature family, or 'stage'
+    @param name: the feature or stage name
+    @return: a context manager
     """
+    return no_timing if timer is None else timer.time(family, name)
 
-    # Limit the size of log file.
-    too_big_file = 10000
-    if os.path.isfile(log_filename):
-        if os.path.getsize(log_filename) > too_big_file:
-            with  codecs.open(log_filename, 'r', "utf-8") as f:
-                data = f.read()
-                f.close()
-            with  codecs.open(log_filename, 'w', "utf-8") as f:
-                f.write(data[-too_big_file:])
-                f.close()
-    with  codecs.open(log_filename, 'a', "utf-8") as f:
-        f.write( '\n[' + str(datetime.now()) + '] ---STARTING PROGRAM---\n')
-        f.close()
 
+def feature_columns(feature_lists):
+    """
+    Build the list of output columns from the configured feature lists, before any feature is extracted.
 
-# Print to log file
-def write_log(message):
+    Features producing several values are expanded (FreqT: Freq001, Freq002, ...).
+
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @return: a list of column names, in feature list order
     """
-    Write to log file.
+    columns = collections.OrderedDict()
+    for features_list in feature_lists.values():
+        for feature in features_list:
+            columns.update((x, None) for x in feature_output_columns(feature))
+    return list(columns)
 
-    Arguments:  message: log message
-    Returns:    nothing
-    Globals:    log_filename
-    """
-    global log_filename
-    with  codecs.open(log_filename, "a", "utf-8") as f:
-        f.write( '[' + str(datetime.now()) + '] ' + str(message) + '\n')
-    f.close()
-    # Print to standard output too, for debugging purposes. Should be removed when coding is finished
-    debug_print('LOG: {0}'.format(message))
-    return
-
-# Write Feature data to output file
-def write_results(filename, results, feature_list, sep = ','):
-    """
-    Write feature data to a CSV file.
-
-    Arguments:  filename: the name of the output file, with path
-                    results:    a dictionary (keys: text ids) of
-                                ordered dictionaries (key: feature names) of features
-                    feature_list: list of feature names as strings (obsolete)
-                    sep: CSV separator
-    One row of features for each file is written to output file in CSV format.
-    """
-    # Open output file for writing
-    with  codecs.open(filename, "w", "utf-8") as output_file:
-        # Write header row to output file
-        output_file.write('text_id')
-        for feature_label in list(results.values())[0].keys():  # Iterate through keys of first record in results
-            output_file.write('{0}{1}'.format(sep, feature_label))
-        output_file.write('\n')
-        # Write feature data, one row for each text
-        for text_id in results.keys():  # Iterate through text ids
-            # Write text id
-            output_file.write(text_id)
-            # Write features
-            for feature in results[text_id].keys():
-                output_file.write(sep + str(results[text_id][feature]))
-            output_file.write('\n')
-    output_file.close()
+
+class CsvResultsWriter:
+    """
+    Write feature data to a CSV file one row at a time, as soon as the features of each text are extracted.
+
+    The header row is written up front from a fixed list of columns. Cells of features that could not be
+    extracted for a text are written as missing.
+    """
+
+    def __init__(self, filename, columns, sep=','):
+        """
+        Open the output file and write the header row.
+
+        @param filename: the name of the output file, with path
+        @param columns: list of feature names
+        @param sep: CSV separator
+        """
+        self.columns = columns
+        self.sep = sep
+        self.output_file = codecs.open(filename, "w", "utf-8")
+        self.output_file.write(sep.join(['text_id'] + columns) + '\n')
+        self.output_file.flush()
+
+    def write(self, text_id, features):
+        """
+        Write a row of features.
+
+        @param text_id: the text id
+        @param features: an ordered dictionary (key: feature names) of features
+        """
+        self.output_file.write(self.sep.join([text_id] + [str(features.get(x, missing)) for x in self.columns]) + '\n')
+        # Flush each row, so that a failing run keeps the rows written so far
+        self.output_file.flush()
+
+    def close(self):
+        self.output_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_npy(archive, name, descr, shape, data):
+    """
+    Write an array in NumPy .npy format to a zip archive, e.g. a NumPy .npz file.
+
+    @param archive: an open zipfile.ZipFile
+    @param name: the name of the array file in the archive
+    @param descr: the NumPy type description of the array, e.g. '<f8'
+    @param shape: the shape of the array, a tuple
+    @param data: a binary file object, positioned at the start of the array data, or bytes
+    """
+    header = "{{'descr': '{0}', 'fortran_order': False, 'shape': {1}, }}".format(descr, repr(shape))
+    # The header is padded with spaces, and ends with a newline, so that the array data is aligned to 64 bytes
+    header += ' ' * (-(len(header) + 11) % 64) + '\n'
+    with archive.open(name, 'w', force_zip64=True) as npy_file:
+        npy_file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        if isinstance(data, bytes):
+            npy_file.write(data)
+        else:
+            shutil.copyfileobj(data, npy_file)
+
+
+class NpzWriter:
+    """
+    Write feature data to a NumPy .npz file, holding the arrays:
+        values:   texts x columns, float64. Cells that are not numbers (division by zero, missing) are NaN.
+        status:   texts x columns, int8. 0 for numbers, 1 for division by zero, 2 for missing cells.
+        columns:  the feature names.
+        text_ids: the text ids.
+
+    Rows are stored in temporary files as soon as the features of each text are extracted, and the .npz file is
+    written when closed. NumPy is not needed to write the file. Load it with numpy.load(filename).
+    """
+
+    status_codes = {div0: 1, missing: 2}
+
+    def __init__(self, filename, columns, sep=','):
+        """
+        @param filename: the name of the output file, with path
+        @param columns: list of feature names
+        @param sep: not used, for the same interface as CsvResultsWriter
+        """
+        self.filename = filename
+        self.columns = columns
+        self.text_ids = []
+        self.values_file = tempfile.TemporaryFile()
+        self.status_file = tempfile.TemporaryFile()
+
+    def write(self, text_id, features):
+        """
+        Write a row of features.
+
+        @param text_id: the text id
+        @param features: an ordered dictionary (key: feature names) of features
+        """
+        values = array.array('d')
+        status = array.array('b')
+        for column in self.columns:
+            value = features.get(column, missing)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values.append(value)
+                status.append(0)
+            else:
+                values.append(math.nan)
+                status.append(self.status_codes.get(value, self.status_codes[missing]))
+        if sys.byteorder != 'little':
+            values.byteswap()
+        values.tofile(self.values_file)
+        status.tofile(self.status_file)
+        self.text_ids.append(text_id)
+
+    def close(self):
+        """
+        Write the .npz file.
+        """
+        shape = (len(self.text_ids), len(self.columns))
+        # Write to a temporary file first, so that an output file is never left half-written
+        temp_file = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, descr, data_file in [('values.npy', '<f8', self.values_file),
+                                           ('status.npy', '|i1', self.status_file)]:
+                data_file.seek(0)
+                write_npy(archive, name, descr, shape, data_file)
+                data_file.close()
+            for name, strings in [('columns.npy', self.columns), ('text_ids.npy', self.text_ids)]:
+                length = max([len(x) for x in strings] + [1])
+                write_npy(archive, name, '<U{0}'.format(length), (len(strings),),
+                          ''.join(x.ljust(length, '\0') for x in strings).encode('utf-32-le'))
+        os.replace(temp_file, self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetResultsWriter:
+    """
+    Write feature data to a Parquet file, with a float64 column for each feature, NaN for cells that are not
+    numbers, and an int8 status column for each feature (named <feature>_status): 0 for numbers, 1 for division
+    by zero, 2 for missing cells. Needs pyarrow.
+
+    Rows are written in row groups, as soon as the features of enough texts are extracted.
+    """
+
+    def __init__(self, filename, columns, sep=',', row_group_size=1000):
+        """
+        @param filename: the name of the output file, with path
+        @param columns: list of feature names
+        @param sep: not used, for the same interface as CsvResultsWriter
+        @param row_group_size: number of rows of each row group
+        """
+        # Imported here, so that loading pyarrow slows down only the runs that write Parquet files
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError('pyarrow is needed to write Parquet files. Please install it, or choose another '
+                              'format.') from error
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([('text_id', pyarrow.string())] +
+                                     [(x, pyarrow.float64()) for x in columns] +
+                                     [(x + '_status', pyarrow.int8()) for x in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+        self.rows = collections.OrderedDict((x, []) for x in self.schema.names)
+
+    def write(self, text_id, features):
+        """
+        Write a row of features.
+
+        @param text_id: the text id
+        @param features: an ordered dictionary (key: feature names) of features
+        """
+        self.rows['text_id'].append(text_id)
+        for column in self.columns:
+            value = features.get(column, missing)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.rows[column].append(float(value))
+                self.rows[column + '_status'].append(0)
+            else:
+                self.rows[column].append(math.nan)
+                self.rows[column + '_status'].append(NpzWriter.status_codes.get(value, NpzWriter.status_codes[missing]))
+        if len(self.rows['text_id']) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows written so far as a row group.
+        """
+        if self.rows['text_id']:
+            self.writer.write_table(self.pyarrow.Table.from_pydict(self.rows, schema=self.schema))
+            for values in self.rows.values():
+                del values[:]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Output formats: name -> (writer class, output file name ending)
+output_formats = collections.OrderedDict([('csv', (CsvResultsWriter, '_all.csv')),
+                                          ('npz', (NpzWriter, '_all.npz')),
+                                          ('parquet', (ParquetResultsWriter, '_all.parquet'))])
+
+
+class StatisticsWriter:
+    """
+    Compute statistics of each feature over the corpus as the features of each text are extracted, and write them
+    to a CSV file: count of numeric values, mean, variance, min, max, and counts of division by zero and of missing
+    values (also counting values that are not numbers).
+
+    Means and variances are updated with Welford's algorithm, which is numerically stable, so that no values
+    have to be kept in memory. Variance is the sample variance.
+    """
+
+    def __init__(self, filename, columns, sep=','):
+        """
+        @param filename: the name of the statistics file, with path
+        @param columns: list of feature names
+        @param sep: CSV separator
+        """
+        self.filename = filename
+        self.columns = columns
+        self.sep = sep
+        # keys: feature names, values: [count, mean, sum of squared differences from the mean, min, max, div0, missing]
+        self.statistics = collections.OrderedDict((x, [0, 0.0, 0.0, math.inf, -math.inf, 0, 0]) for x in columns)
+
+    def write(self, text_id, features):
+        """
+        Update the statistics with the features of a text.
+
+        @param text_id: the text id
+        @param features: an ordered dictionary (key: feature names) of features
+        """
+        for column, stats in self.statistics.items():
+            value = features.get(column, missing)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                stats[0] += 1
+                delta = value - stats[1]
+                stats[1] += delta / stats[0]
+                stats[2] += delta * (value - stats[1])
+                stats[3] = min(stats[3], value)
+                stats[4] = max(stats[4], value)
+            elif value == div0:
+                stats[5] += 1
+            else:
+                stats[6] += 1
+
+    def mean_std(self, column):
+        """
+        @param column: the feature name
+        @return: a tuple of the mean and the sample standard deviation of a feature, None for each that is undefined
+        """
+        count, mean, m2 = self.statistics[column][:3]
+        return (mean if count > 0 else None), (math.sqrt(m2 / (count - 1)) if count > 1 else None)
+
+    def close(self):
+        """
+        Write the statistics to the statistics file.
+        """
+        with codecs.open(self.filename, "w", "utf-8") as stats_file:
+            stats_file.write(self.sep.join(['feature', 'count', 'mean', 'variance', 'min', 'max', 'div0', 'missing'])
+                             + '\n')
+            for column, (count, mean, m2, minimum, maximum, div0s, missings) in self.statistics.items():
+                values = [count, mean, m2 / (count - 1) if count > 1 else missing, minimum, maximum]
+                if count == 0:
+                    values = [count, missing, missing, missing, missing]
+                stats_file.write(self.sep.join([column] + [str(x) for x in values + [div0s, missings]]) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def normalise_results(input_filename, output_filename, statistics, sep=','):
+    """
+    Write the z-scores of the features of a CSV file of features, reading and writing one row at a time.
+
+    Exact z-scores need the mean and standard deviation of each feature over the whole corpus, so they are
+    computed in a pass over the output file after all texts have been extracted.
+
+    @param input_filename: the name of the CSV file of features, with path
+    @param output_filename: the name of the CSV file of z-scores, with path
+    @param statistics: the StatisticsWriter of the features of the input file
+    @param sep: CSV separator
+    """
+    with codecs.open(input_filename, "r", "utf-8") as input_file, \
+            codecs.open(output_filename, "w", "utf-8") as output_file:
+        header = input_file.readline()
+        output_file.write(header)
+        moments = [statistics.mean_std(x) if x in statistics.statistics else (None, None)
+                   for x in header.rstrip('\r\n').split(sep)]
+        for line in input_file:
+            row = line.rstrip('\r\n').split(sep)
+            for i, (mean, std) in enumerate(moments):
+                if mean is None or i >= len(row):
+                    continue
+                try:
+                    value = float(row[i])
+                except ValueError:
+                    # Division by zero, missing etc. are written as they are
+                    continue
+                row[i] = str((value - mean) / std) if std else div0
+            output_file.write(sep.join(row) + '\n')
 
 
 def get_basenames(path, file_extension):
@@ -137,7 +651,7 @@ def get_basenames(path, file_extension):
     @param data_path: the directory where files reside
     @param file_extension: type of files to collect file names
     """
-    files = glob.glob(path + '\\*.' + file_extension)
+    files = glob.glob(os.path.join(path, '*.' + file_extension))
     stems = [ os.path.splitext( os.path.split(file)[1] )[0] for file in files]
     # debug_print('Stems: {0}'.format(str(stems)))
     return stems
@@ -148,47 +662,146 @@ def get_basenames(path, file_extension):
 #-------------------
 
 
-# Extract tuples of data from file containing tabbed data
-def extract_data_from_tabbed_file(file, separator='\t'):
+def parse_tabbed_lines(lines, separator='\t'):
     """
-    Extract lists of data from file containing tabbed data.
+    Extract lists of data from lines of tabbed data.
 
-    Arguments:  file: string containing the name of the file
-                separator: separates the tabbed data in the file
+    Arguments:  lines: an iterable of lines, each ending with a newline
+                separator: separates the tabbed data in the lines
     @rtype : A list of lists of strings
     """
-
     list_of_lists = []
-    with codecs.open(file, 'rU', 'utf-8') as f:
-        for line in f:
-            # Skip empty lines
-            if len(line) < 3 : continue # too small line, considered empty
-            #if line == '\r\n': continue #empty line contains only a CR and a LF. ATTN:this is an empirical observation!
-                                         #problem: '\r\n' seems to be system or editor dependent.
-            line_data = line[:-1].split(separator)
-            list_of_lists.append(line_data)
-    f.close()
-    #debug_print(['extract_data_from_tabbed_file', (os.path.basename(file), list_of_lists)])
-    return (os.path.basename(file), list_of_lists)
+    for line in lines:
+        # Skip empty lines
+        if len(line) < 3 : continue # too small line, considered empty
+        #if line == '\r\n': continue #empty line contains only a CR and a LF. ATTN:this is an empirical observation!
+                                     #problem: '\r\n' seems to be system or editor dependent.
+        line_data = line[:-1].split(separator)
+        list_of_lists.append(line_data)
+    return list_of_lists
 
 
-# Extract tuples of data from  many files containing tabbed data
-def extract_data_from_many_files(files, separator='\t'):
+def iter_batches(items, size):
     """
-    Extract tuples of data from  many files containing tabbed data.
+    Group the items of an iterable in lists of up to size items, lazily.
 
-    Arguments:  files: a list of files
-                separator: separates the tabbed data in the file
-    Returns: A list of tuples
+    @param items: an iterable
+    @param size: the largest number of items of each list
+    @return: a generator of lists of items
+    """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_tabbed_rows(lines, separator='\t'):
+    """
+    Extract lists of data from lines of tabbed data lazily, one line at a time, as parse_tabbed_lines.
+
+    @param lines: an iterable of lines, each ending with a newline, e.g. an open file
+    @param separator: separates the tabbed data in the lines
+    @return: a generator of lists of strings, an empty list for each empty line
+    """
+    # Lines are parsed a block at a time, which is much faster than one at a time in a generator
+    for block in iter_batches(lines, 256):
+        # Too small lines are considered empty
+        yield from [line[:-1].split(separator) if len(line) >= 3 else [] for line in block]
+
+
+def iter_chunk_sentences(rows, text_id=''):
+    """
+    Read the sentences of chunk data lazily, one at a time, each from its (SENT row to the next (SENT row.
+
+    Rows outside sentences, between a )SENT row and the next (SENT row, are kept with the sentence before them,
+    and rows before the first (SENT row with the first sentence, so that the sentences hold all rows of the data,
+    counted as get_sentences and get_All_tokens count the whole data. Rows outside sentences are logged.
+
+    @param rows: an iterable of chunk rows, e.g. from iter_tabbed_rows
+    @param text_id: the text id, for logging
+    @return: a generator of sentences, each a list of chunk rows from (SENT to the next (SENT
+    """
+    sent = []
+    started = inside = False
+    outside = 0
+    for item in rows:
+        if not item:
+            continue
+        if item[1] == '(SENT':
+            if started:
+                yield sent
+                sent = []
+            started = inside = True
+        elif not inside:
+            outside += 1
+        elif item[1] == ')SENT':
+            inside = False
+        sent.append(item)
+    if sent:
+        yield sent
+    if outside:
+        write_log('Text: {0} has {1} rows of chunk data outside sentences. They are kept with the sentence '
+                  'before them.'.format(text_id, outside), logging.WARNING)
+
+
+def iter_conll_sentences(rows):
+    """
+    Read the sentences of conll data lazily, one at a time. Sentences end at empty lines, and, in data without
+    empty lines between sentences, before tokens of id '1', as in conll_sentences. Comment lines are left out.
+
+    @param rows: an iterable of conll rows, e.g. from iter_tabbed_rows, with an empty list for each empty line
+    @return: a generator of sentences, each a list of conll rows
     """
+    sent = []
+    for item in rows:
+        comment = item and item[0][:1] == '#'
+        if not item or comment or item[0] == '1':
+            if sent:
+                yield sent
+                sent = []
+            if not item or comment:
+                continue
+        sent.append(item)
+    if sent:
+        yield sent
 
-    data = []
-    for file in files:
-        data.append(extract_data_from_tabbed_file(file, separator))
-    return data
+
+def iter_content_lines(content, block_size=65536):
+    """
+    Decode the raw content of a file lazily, a block at a time, into lines, with universal newlines as when reading
+    the file in text mode. Unlike reading it through io.BytesIO, the content is not copied.
+
+    @param content: the bytes of the file, utf-8 encoded, or a memoryview of them
+    @param block_size: the number of bytes decoded at a time
+    @return: a generator of lines, each ending with a newline, except maybe the last
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    rest = ''
+    for start in range(0, len(content), block_size):
+        lines = (rest + decoder.decode(content[start:start + block_size])).split('\n')
+        rest = lines.pop()
+        yield from [line + '\n' for line in lines]
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+def parse_tabbed_content(content, separator='\t'):
+    """
+    Extract lists of data from the raw content of a file containing tabbed data.
+
+    Arguments:  content: the bytes of the file, utf-8 encoded, or a memoryview of them
+                separator: separates the tabbed data in the file
+    @rtype : A list of lists of strings
+    """
+    # Universal newlines, as when reading the file in text mode
+    return parse_tabbed_lines(io.StringIO(str(content, 'utf-8'), newline=None), separator)
 
 
 # Get a list of -functional- words
+@functools.lru_cache(maxsize=None)
 def func_words_list(filename):
     """
     Get a list of -functional- words.
@@ -222,28 +835,78 @@ def freq_of_freqs(list):
     Returns:    a frequency-of-frequencies list
     """
     #Create a frequency distribution list
-    fdist = nltk.FreqDist(list)
+    fdist = collections.Counter(list)
     # Create a frequencies-frequency distribution list
     freqlist = [item[1] for item in fdist.items()] # Create a list of frequencies
-    freqfreq = nltk.FreqDist(freqlist)
+    freqfreq = collections.Counter(freqlist)
     return freqfreq
 
 
+def update_count(counter, key, change):
+    """
+    Change a count of a frequency distribution, removing keys whose count drops to zero.
+
+    @param counter: a frequency distribution (collections.Counter)
+    @param key: the key whose count changes
+    @param change: the change of the count
+    @return: the new count
+    """
+    count = counter[key] + change
+    if count:
+        counter[key] = count
+    else:
+        del counter[key]
+    return count
+
+
+class StringIds(dict):
+    """
+    Integer ids of strings, e.g. of the word types, lemmas and pos tags of texts, so that the words of a text are
+    held as arrays of small integers and counted by integer keys rather than by strings.
+
+    A dictionary of strings to their ids, where a string without an id is given the next id, in order of first
+    appearance. Ids are only meaningful within a process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # The strings of the ids
+        self.strings = []
+
+    def __missing__(self, string):
+        string_id = self[string] = len(self.strings)
+        self.strings.append(string)
+        return string_id
+
+    def array(self, strings):
+        """
+        @param strings: an iterable of strings
+        @return: an array('I') of the ids of the strings
+        """
+        return array.array('I', map(self.__getitem__, strings))
+
+
+# String ids of the word types, lemmas and pos tags of the running states of all texts of the process
+string_ids = StringIds()
+
+
 def get_sentences(data):
     """
     Extract sentences from chunk data.
 
     Filter-out tokens that are not considered words (the definition of a word is important!)
     Arguments:  data
-    Returns:   a list of lists of triplets of (word, type, pos_tag)
+    Returns:   a list of lists of tuples of (word, lemma, pos_tag, type)
     """
     sents = []
+    # Words before the first sentence are left out
+    sent = []
     for item in data:
         if item[1] == '(SENT':
             sent = []
         elif item[1] == ')SENT':
             sents.append(sent)
-        elif item[1] in ['TOK', 'ABBR', 'DIG']:
+        elif item[1] in ('TOK', 'ABBR', 'DIG'):
            #Only TOK, ABBR and DIG are considered proper words!
            #TODO: Parameterise word definition in config file
            # Convert to lowercase to get word type and add it as last in the tuple
@@ -252,6 +915,19 @@ def get_sentences(data):
     return sents
 
 
+def chunk_sentence_rows(data, text_id=''):
+    """
+    Split chunk data into sentences, keeping all their rows (sentence and phrase markers included),
+    so that the features of any span of sentences can be computed from the rows of its sentences.
+    Rows outside sentences are kept with the sentence before them, see iter_chunk_sentences.
+
+    @param data: chunk data of text as a list
+    @param text_id: the text id, for logging
+    @return: a list of sentences, each a list of chunk rows from (SENT to the next (SENT
+    """
+    return list(iter_chunk_sentences(data, text_id))
+
+
 def get_All_tokens(data):
     """
     Extract all tokens from lem data.
@@ -276,13 +952,6 @@ def get_N(words):
     return len(words)
 
 
-def get_T(types):
-    """
-    count types
-    """
-    return len(set(types))
-
-
 def get_Char(words):
     """
     count text characters, excluding whitespace and punctuation
@@ -318,13 +987,6 @@ def get_SL30(sentences):
     return len([x for x in sentences if len(x) > 30])
 
 
-def get_m_ASL(words, sentences):
-    """
-    Average sentence length in words
-    """
-    return(get_N(words) / get_S(sentences))
-
-
 def get_LemT(words):
     """
     Number of different lemmas
@@ -332,703 +994,792 @@ def get_LemT(words):
     return len(set([x[1] for x in words]))
 
 
-def get_Noun(words):
-    """
-    Count Nouns
-    """
-    return len([x[1] for x in words if re.match('No', x[2])])
-
-
-def get_NoPr(words):
-    """
-    Count Proper Nouns
-    """
-    return len([x[1] for x in words if re.match('NoPr', x[2])])
+# Part-of-speech counts: feature name -> regular expression matched at the beginning of the pos tag.
+pos_count_patterns = collections.OrderedDict([
+    ('Noun', 'No'), ('NoPr', 'NoPr'), ('Dig', 'DIG'), ('RgFw', 'RgFw'), ('Verb', 'Vb'), ('Adj', 'Aj'),
+    ('Adv', 'Ad'), ('Prn', 'Pn'), ('PnPe', 'PnPe'), ('PnPe1', 'PnPe..01'), ('PnPe2', 'PnPe..02'),
+    ('PnRe', 'PnRe'), ('PnRi', 'PnRi'), ('PnIr', 'PnIr'), ('Cnj', 'Cj'), ('Prep', 'AsPp'), ('Pt', 'Pt'),
+    ('PtSj', 'PtSj'), ('PVerb', 'Vb(..){7}Pv'), ('Vb1', 'Vb(..){3}01'), ('Vb2', 'Vb(..){3}02'),
+    ('VbPr', 'Vb(..){2}Pr'), ('VbPa', 'Vb(..){2}Pa'), ('Pp', 'VbMnPp'), ('PpPv', 'VbMnPp(..){5}Pv'),
+    ('CjCo', 'CjCo'), ('CjSb', 'CjSb'), ('NoGe', 'No.*Ge'),
+])
 
+# Part-of-speech type counts: feature name -> (pos tag regular expression, index of the counted word tuple item).
+# Nouns and verbs count word types (lowercase words), adjectives and adverbs count lemmas.
+pos_type_patterns = collections.OrderedDict([
+    ('TNoun', ('No', 3)), ('TVerb', ('Vb', 3)), ('TAdj', ('Aj', 1)), ('TAdv', ('Ad', 1)),
+])
 
-def get_Dig(words):
-    """
-    Count Numbers (with digits, e.g.: 2015)
-    """
-    return len([x[1] for x in words if re.match('DIG', x[2])])
+pos_count_regexes = [(name, re.compile(pattern)) for name, pattern in pos_count_patterns.items()]
+pos_type_regexes = [(name, re.compile(pattern), item) for name, (pattern, item) in pos_type_patterns.items()]
 
 
-def get_RgFw(words):
-    """
-    Count Foreign language Words
+@functools.lru_cache(maxsize=None)
+def match_pos_patterns(tag):
     """
-    return len([x[1] for x in words if re.match('RgFw', x[2])])
+    Find the patterns of pos_count_patterns and pos_type_patterns that a pos tag matches, once per tag.
 
-
-def get_Verb(words):
-    """
-    Count Verbs
+    @param tag: a pos tag
+    @return: a tuple of the list of matching count feature names, and the list of (type feature name, index of
+             the counted word tuple item) tuples of the matching type patterns
     """
-    return len([x[1] for x in words if re.match('Vb', x[2])])
+    return ([name for name, regex in pos_count_regexes if regex.match(tag)],
+            [(name, item) for name, regex, item in pos_type_regexes if regex.match(tag)])
 
 
-def get_Adj(words):
+def count_pos(words):
     """
-    Count Adjectivs
-    """
-    return len([x[1] for x in words if re.match('Aj', x[2])])
+    Count all parts of speech and part-of-speech types of pos_count_patterns and pos_type_patterns
+    in a single pass over words.
 
+    Pos tags repeat heavily, so words are grouped by tag in one pass and every pattern is matched
+    once per distinct tag instead of once per word.
 
-def get_Adv(words):
-    """
-    Count Adverbs
+    @param words: a list of (word, lemma, pos_tag, type) tuples
+    @return: a dictionary of counts (keys: Noun, Verb, ..., TNoun, TVerb, ...)
     """
-    return len([x[1] for x in words if re.match('Ad', x[2])])
+    tag_freq = collections.Counter()
+    # Word tuples grouped by tag, needed only to count types
+    tag_words = collections.defaultdict(list)
+    for word in words:
+        tag = word[2]
+        tag_freq[tag] += 1
+        tag_words[tag].append(word)
 
-
-def get_Prn(words):
-    """
-    Count Pronouns
-    """
-    return len([x[1] for x in words if re.match('Pn', x[2])])
+    counts = dict.fromkeys(pos_count_patterns, 0)
+    type_sets = {name: set() for name in pos_type_patterns}
+    for tag, freq in tag_freq.items():
+        for name, regex in pos_count_regexes:
+            if regex.match(tag):
+                counts[name] += freq
+        for name, regex, item in pos_type_regexes:
+            if regex.match(tag):
+                type_sets[name].update(x[item] for x in tag_words[tag])
+    for name, type_set in type_sets.items():
+        counts[name] = len(type_set)
+    return counts
 
 
-def get_PnPe(words):
+def get_FuncT(types, func_words):
     """
-    Count Personal Pronouns
+    Compute how many of func_words are in data_words
+    arguments:  data_words, func_words : lists of words
+    returns:    an integer with the number of words found
     """
-    return len([x[1] for x in words if re.match('PnPe', x[2])])
+    types = set(types)
+    return len([x for x in func_words if x in types])
 
 
-def get_PnPe1(words):
-    """
-    Count Personal Pronouns in 1st person
+# Compute the frequencies of word Types
+def getFreqT(types, n=10):
     """
-    return len([x[1] for x in words if re.match('PnPe..01', x[2])])
-
+    Compute the frequencies of word Types.
 
-def get_PnPe2(words):
-    """
-    Count Personal Pronouns in 2st person
+    @param types: a list of word types
+    @param n: the n higher frequencies should be computed
+    @return: a dictionary of type frequencies (keys: Freq001, Freq002, ... Freqn)
     """
-    return len([x[1] for x in words if re.match('PnPe..02', x[2])])
+    #Get the frequency of frequencies distribution of types
+    return freqt_from_fof(freq_of_freqs(types), n)
 
 
-def get_PnRe(words):
+def freqt_from_fof(fof, n=10):
     """
-    Count PnRe pronouns
-    """
-    return len([x[1] for x in words if re.match('PnRe', x[2])])
+    Compute the frequencies of word Types from their frequency-of-frequencies distribution.
 
-def get_PnRi(words):
-    """
-    Count PnRi pronouns
+    @param fof: a frequency-of-frequencies distribution of types
+    @param n: the n higher frequencies should be computed
+    @return: a dictionary of type frequencies (keys: Freq001, Freq002, ... Freqn)
     """
-    return len([x[1] for x in words if re.match('PnRi', x[2])])
+    #Create dictionary of features from dictionary
+    f_dict = {}
+    for i in range (1, n+1):
+        f_dict['Freq' + '{:03}'.format(i)] = fof.get(i, 0)
+    return f_dict
 
 
-def get_PnIr(words):
+def yule_k(fof, n):
     """
-    Count PnIr pronouns
-    """
-    return len([x[1] for x in words if re.match('PnIr', x[2])])
-
+    Compute Yule's K from the frequency-of-frequencies distribution of types.
 
-def get_Cnj(words):
+    @param fof: a frequency-of-frequencies distribution of types
+    @param n: number of words
+    @return: Yule's K
     """
-    Count Conjunctions
-    """
-    return len([x[1] for x in words if re.match('Cj', x[2])])
+    s = 0
+    for item in fof.keys():
+        s += fof[item]*item*item
 
-def get_Prep(words):
-    """
-    Count Prepositions
-    """
-    return len([x[1] for x in words if re.match('AsPp', x[2])])
+    return 10000 * (s - n) / float(n*n)
 
 
-def get_Pt(words):
-    """
-    Count Pt
+@functools.lru_cache(maxsize=65536)
+def solve_D(n, t):
     """
-    return len([x[1] for x in words if re.match('Pt', x[2])])
+    Solve the TTR curve of the reference for D, given N words and T types:
 
+        TTR = D/N * (sqrt(1 + 2*N/D) - 1)
 
-def get_PtSj(words):
-    """
-    Count PtSj
-    """
-    return len([x[1] for x in words if re.match('PtSj', x[2])])
+    Squaring sqrt(1 + 2*N/D) = 1 + TTR*N/D gives the single positive root:
 
+        D = N * TTR^2 / (2 * (1 - TTR))
 
-def get_PVerb(words):
-    """
-    Count PVerb
-    """
-    return len([x[1] for x in words if re.match('Vb(..){7}Pv', x[2])])
-
+    This is the root sympy.solve used to find symbolically; both agree to within 1e-12 relative error.
+    Memoized on (N, T), since many texts share the same pair.
 
-def get_Vb1(words):
-    """
-    Count Verbs in 1st person
+    @param n: number of words
+    @param t: number of types
+    @return: D, or '' if there is no solution (TTR is 0 or 1)
     """
-    return len([x[1] for x in words if re.match('Vb(..){3}01', x[2])])
+    ttr = t / n
+    if not 0 < ttr < 1:
+        return ''
+    return n * ttr * ttr / (2 * (1 - ttr))
 
 
-def get_Vb2(words):
+def type_entropy(type_freqs, n):
     """
-    Count Verbs in 2nd person
-    """
-    return len([x[1] for x in words if re.match('Vb(..){3}02', x[2])])
-
+    Compute the entropy of a text from the frequency distribution of its types.
 
-def get_VbPr(words):
+    @param type_freqs: a frequency distribution of types
+    @param n: number of words
+    @return: the entropy
     """
-    Count Verbs in Present tense
-    """
-    return len([x[1] for x in words if re.match('Vb(..){2}Pr', x[2])])
+    entr = 0
+    for item in type_freqs.values():
+        prob = item / n # calculate the probability for each type
+        log_prob = log2(prob) # calculates the log-2 of probability for each type
+        entr -= prob*log_prob # accumulate entropy of each type to find the entropy of the whole text
 
+    return entr
 
-def get_VbPa(words):
-    """
-    Count Verbs in Past tense
+def fof_entropy(fof, n):
     """
-    return len([x[1] for x in words if re.match('Vb(..){2}Pa', x[2])])
-
+    Compute the entropy of a text from the frequency-of-frequencies distribution of its types:
 
-def get_Pp(words):
-    """
-    Count participles
-    """
-    return len([x[1] for x in words if re.match('VbMnPp', x[2])])
+        H = log2(N) - 1/N * sum(f * log2(f)), over the frequencies f of all types
 
+    Types of the same frequency contribute equally, so this takes one term per distinct frequency.
 
-def get_PpPv(words):
+    @param fof: a frequency-of-frequencies distribution of types
+    @param n: number of words
+    @return: the entropy, 0 if there are no words
     """
-    Count PpPv
-    """
-    return len([x[1] for x in words if re.match('VbMnPp(..){5}Pv', x[2])])
+    if not n:
+        return 0
+    return log2(n) - sum(count * freq * log2(freq) for freq, count in fof.items()) / n
+
+
+def get_MATTR(types, window=50):
+    """
+    Moving-average type-token ratio: the mean TTR of all windows of a number of consecutive words.
+    reference: Covington, McFall: Cutting the Gordian Knot: The Moving-Average Type-Token Ratio (MATTR),
+            Journal of Quantitative Linguistics 17(2), 2010
+
+    The window slides over the words one word at a time, updating a frequency distribution of the types in the
+    window with the word entering and the word leaving it, so that all windows take a single pass.
+
+    @param types: a list of word types, in text order
+    @param window: the number of words of each window
+    @return: MATTR, the TTR of the whole text if it has fewer words than the window
+    """
+    if len(types) < window:
+        return len(set(types)) / len(types)
+    type_freqs = collections.Counter(types[:window])
+    distinct = len(type_freqs)
+    total = distinct
+    for i in range(window, len(types)):
+        leaving, entering = types[i - window], types[i]
+        type_freqs[leaving] -= 1
+        if not type_freqs[leaving]:
+            distinct -= 1
+        if not type_freqs[entering]:
+            distinct += 1
+        type_freqs[entering] += 1
+        total += distinct
+    return total / ((len(types) - window + 1) * window)
 
 
-def get_CjCo(words):
+def mtld_pass(types, threshold):
     """
-    Count CjCo
-    """
-    return len([x[1] for x in words if re.match('CjCo', x[2])])
-
+    Measure MTLD in a single direction: the mean number of words of the factors of the text, each factor a span of
+    words whose TTR has fallen to the threshold. The remaining words count as a partial factor.
 
-def get_CjSb(words):
+    @param types: a list of word types, in reading order
+    @param threshold: the TTR at which a factor ends
+    @return: the mean factor length, or missing if there are no words or the TTR never falls below 1 (no word is
+             repeated)
     """
-    Count CjSb
-    """
-    return len([x[1] for x in words if re.match('CjSb', x[2])])
+    factors = 0
+    seen = set()
+    count = 0
+    for type in types:
+        count += 1
+        seen.add(type)
+        if len(seen) / count <= threshold:
+            factors += 1
+            seen = set()
+            count = 0
+    if count:
+        factors += (1 - len(seen) / count) / (1 - threshold)
+    if not factors:
+        # No words, or not even a partial factor: the factor length is unbounded
+        return missing
+    return len(types) / factors
 
 
-def get_NoGe(words):
-    """
-    Count Nouns in Genitive
+def get_MTLD(types, threshold=0.72):
     """
-    return len([x[1] for x in words if re.match('No.*Ge', x[2])])
+    Measure of textual lexical diversity, the mean of a forward and a backward pass over the words.
+    reference: McCarthy, Jarvis: MTLD, vocd-D, and HD-D: A validation study of sophisticated approaches to
+            lexical diversity assessment, Behavior Research Methods 42(2), 2010
 
-
-def get_TNoun(words):
-    """
-    Count noun types
+    @param types: a list of word types, in text order
+    @param threshold: the TTR at which a factor ends
+    @return: MTLD, or missing if the text has no words or none of them is repeated, as HD-D is missing on texts
+             without enough words
     """
-    #debug_print(['TNoun', set([x[1] for x in words if re.match('No', x[2])])])
-    return len(set([x[3] for x in words if re.match('No', x[2])]))
+    forward = mtld_pass(types, threshold)
+    if forward == missing:
+        # The backward pass sees the same words, so it has no factor either
+        return missing
+    return (forward + mtld_pass(types[::-1], threshold)) / 2
 
 
-def get_TVerb(words):
+@functools.lru_cache(maxsize=1024)
+def hdd_terms(n, sample, size):
     """
-    Count Verb types
-    """
-    return len(set([x[3] for x in words if re.match('Vb', x[2])]))
-
+    Probabilities that none of the occurrences of a type is drawn in a random sample of the words of a text, by
+    the frequency of the type: C(n - freq, sample) / C(n, sample). Each is that of the frequency before it times
+    (n - freq + 1 - sample) / (n - freq + 1), so that a table takes a single product per frequency.
 
-def get_TAdj(words):
+    @param n: number of words
+    @param sample: the number of words of the sample
+    @param size: the number of frequencies of the table, at most n + 1
+    @return: a tuple of the probabilities of frequencies 0 to size - 1
     """
-    Count Adjective types
-    """
-    return len(set([x[1] for x in words if re.match('Aj', x[2])]))
+    p_none = [1.0]
+    for freq in range(1, size):
+        p_none.append(p_none[-1] * max(n - freq + 1 - sample, 0) / (n - freq + 1))
+    return tuple(p_none)
 
 
-def get_TAdv(words):
+def hdd_from_fof(fof, n, sample=42):
     """
-    Count Adverbs
+    HD-D lexical diversity: the expected TTR of a random sample of words of the text, from the hypergeometric
+    distribution. Each type contributes the probability of being drawn at least once in the sample, divided by
+    the sample size.
+    reference: McCarthy, Jarvis: vocd: A theoretical and empirical evaluation, Language Testing 24(4), 2007
+
+    Types of the same frequency contribute equally, so the probability of not being drawn is taken once per
+    distinct frequency, from the frequency-of-frequencies distribution of types, and from a table of these
+    probabilities shared by all texts of the same number of words (see hdd_terms).
+
+    @param fof: a frequency-of-frequencies distribution of types
+    @param n: number of words
+    @param sample: the number of words of the sample
+    @return: HD-D, or missing if the text has fewer words than the sample
+    """
+    n = int(n)
+    if n < sample:
+        return missing
+    # Tables of a power of two frequencies, so that the texts (or windows) of the same number of words share them
+    p_none = hdd_terms(n, sample, min(1 << max(fof).bit_length(), n + 1))
+    return sum(count * (1 - p_none[freq]) for freq, count in fof.items()) / sample
+
+
+def get_HDD(types, sample=42):
     """
-    return len(set([x[1] for x in words if re.match('Ad', x[2])]))
-
-
-def get_FuncT(types, func_words):
-    """
-    Compute how many of func_words are in data_words
-    arguments:  data_words, func_words : lists of words
-    returns:    an integer with the number of words found
-    """
-    return len([x for x in func_words if x in types])
-
-
-# Compute the frequencies of word Types
-def getFreqT(types, n=10):
-    """
-    Compute the frequencies of word Types.
+    HD-D lexical diversity, see hdd_from_fof.
 
     @param types: a list of word types
-    @param n: the n higher frequencies should be computed
-    @return: a dictionary of type frequencies (keys: Freq001, Freq002, ... Freqn)
+    @param sample: the number of words of the sample
+    @return: HD-D, or missing if the text has fewer words than the sample
     """
-    #Get the frequency of frequencies distribution of types
-    #debug_print(['list(set', list(set([x[1] for x in words]))])
-    f_list = freq_of_freqs(types)
-    #debug_print(['f_list', f_list])
-    #Make dictionary from list
-    d = dict(f_list)
-
-    #Find the dictionary's biggest frequency
-    #max_key = sorted(d.keys(), reverse=True)[0]
-    #debug_print(['max_key', max_key])
-
-    #Create dictionary of features from dictionary
-    f_dict = {}
-    for i in range (1, n+1):
-        f_dict['Freq' + '{:03}'.format(i)] = d.get(i, 0)
-    return f_dict
+    return hdd_from_fof(freq_of_freqs(types), len(types), sample)
 
 
-def get_YuleK(types):
+def plan_features(feature_list, registry, known=frozenset()):
     """
+    Resolve a list of features into the minimal list of registry entries needed to compute them,
+    each entry after the entries it depends on.
 
-    @param types:
-    @return:
-    """
-
-    #Get the frequency of frequencies distribution of types
-    f_list = freq_of_freqs(types) #[x[1] for x in words])
-    # debug_print(['f_list', f_list])
-    s = 0
-    for item in f_list.keys():
-        s += f_list[item]*item*item
-
-    return 10000 * (s - len(types)) / float(len(types)*len(types))
-
-
-def get_D(words, types):
-    """
-    Measure D lexical diversity
-    reference: Duran, Malvern, Richards, Chipere:
-            Developmental Trends in Lexical Diversity Oxford UP 2004, p224
-    uses sympy
-
-    @param words:
-    @param types:
-    """
-    n = get_N(words)
-    t = get_T(types)
-    ttr = t/n
-    # Solve the equation as in reference
-    d = sympy.symbols('d')
-    answer = sympy.solve(d/n*(sympy.sqrt(1+2*n/d)-1)-ttr, d)
-
-    return answer[0] if answer else ''
-
+    @param feature_list: a list of features to extract
+    @param registry: a dictionary (keys: names) of (dependencies, function) tuples
+    @param known: names of entries whose values are already known, and are not computed
+    @return: a tuple of the list of entry names in computation order, and the list of unknown features
+    """
+    plan = []
+    planned = set()
+    unknown = []
+
+    def visit(name):
+        if name in planned or name in known:
+            return
+        for dependency in registry[name][0]:
+            if dependency in registry:
+                visit(dependency)
+        planned.add(name)
+        plan.append(name)
 
+    for feature in feature_list:
+        if feature in registry:
+            visit(feature)
+        else:
+            unknown.append(feature)
+    return plan, unknown
 
 
-def get_Entr(types):
+def evaluate_plan(plan, registry, values, family='grammar'):
     """
+    Compute the entries of a plan, each exactly once, skipping entries whose values are already known.
 
-    @param types:
-    """
-    # Create a frequency distribution of types
-    fdist = nltk.FreqDist(types)
-    freqlist = [item[1] for item in fdist.items()] # Create a list of frequencies
-
-    entr = 0
-    for item in freqlist:
-        prob = item / len(types) # calculate the probability for each type
-        log_prob = log2(prob) # calculates the log-2 of probability for each type
-        entr -= prob*log_prob # accumulate entropy of each type to find the entropy of the whole text
-
-    return entr
+    An entry that fails with division by zero (or a math domain error) gets the value div0, and so do all entries
+    depending on it.
 
-def get_RelEntr(types):
+    @param plan: a list of entry names in computation order, from plan_features
+    @param registry: a dictionary (keys: names) of (dependencies, function) tuples
+    @param values: a dictionary of known values (keys: entry names), e.g. the input data. Updated in place.
+    @param family: the feature family of the registry, for profiling
+    @return: values
     """
-
-    @param types:
-    @return:
-    """
-
-    max_entr = -log2(1 / len(types))
-
-    return get_Entr(types) / max_entr
+    failed = set()
+    for name in plan:
+        if name in values:
+            continue
+        dependencies, function = registry[name]
+        if failed.intersection(dependencies):
+            failed.add(name)
+            values[name] = div0
+            continue
+        try:
+            with timed(family, name):
+                values[name] = function(*[values[x] for x in dependencies])
+        # Catch division by zero error, and math domain errors of empty texts, e.g. the logarithm of no words
+        except (ZeroDivisionError, ValueError):
+            failed.add(name)
+            values[name] = div0
+    return values
+
+
+# Grammar quantities and features: name -> (names of the quantities and features it depends on, function of them).
+# The chunk data of a text is given as 'data'. Names in grammar_quantities are intermediate quantities, not output features.
+grammar_registry = collections.OrderedDict([
+    # Commonly used quantities
+    ('sentences', (('data',), get_sentences)),
+    ('words', (('sentences',), lambda sentences: [item for sublist in sentences for item in sublist])),
+    ('types', (('words',), lambda words: [x[3] for x in words])),
+    ('type_freqs', (('types',), collections.Counter)),
+    ('fof', (('type_freqs',), lambda type_freqs: collections.Counter(type_freqs.values()))),
+    ('freqt', (('fof',), lambda fof: freqt_from_fof(fof, type_freqs_num))),
+    ('entropy', (('type_freqs', 'N'), type_entropy)),
+    ('pos', (('words',), count_pos)),
+    ('func_words', ((), lambda: func_words_list(functional_words_filename))),
+    ('All_tokens', (('data',), get_All_tokens)),
+    # count words. Cast to float because it will be used later in floating point calculations
+    ('N', (('words',), lambda words: float(get_N(words)))),
+    # count types
+    ('T', (('type_freqs',), lambda type_freqs: float(len(type_freqs)))),
+    ('m_TTR', (('T', 'N'), operator.truediv)),
+    ('FreqT', (('freqt',), lambda freqt: freqt)),
+    ('m_FreqTpc', (('freqt', 'N'), lambda freqt, N: {'m_'+key+'pc': freqt[key]/N for key in freqt.keys()})),
+    ('m_DisToHapax', (('freqt',), lambda freqt: freqt['Freq002'] / freqt['Freq001'])),
+    ('Char', (('words',), get_Char)),
+    ('m_AWL', (('Char', 'N'), operator.truediv)),
+    # count sentences
+    ('S', (('sentences',), lambda sentences: float(get_S(sentences)))),
+    ('SL10', (('sentences',), get_SL10)),
+    ('m_SL10toS', (('SL10', 'S'), operator.truediv)),
+    ('SL20', (('sentences',), get_SL20)),
+    ('m_SL20toS', (('SL20', 'S'), operator.truediv)),
+    ('SL30', (('sentences',), get_SL30)),
+    ('m_SL30toS', (('SL30', 'S'), operator.truediv)),
+    ('m_ASL', (('N', 'S'), operator.truediv)),
+    ('LemT', (('words',), get_LemT)),
+    ('m_TTRLem', (('LemT', 'N'), operator.truediv)),
+])
+grammar_quantities = frozenset(['sentences', 'words', 'types', 'type_freqs', 'fof', 'freqt', 'entropy', 'pos',
+                                'func_words'])
+# Part-of-speech counts, all computed in a single pass by count_pos
+grammar_registry.update((name, (('pos',), operator.itemgetter(name))) for name in pos_count_patterns)
+grammar_registry.update((name, (('pos',), operator.itemgetter(name))) for name in pos_type_patterns)
+# count verbs. Cast to float, as N, T and S
+grammar_registry['Verb'] = (('pos',), lambda pos: float(pos['Verb']))
+grammar_registry.update([
+    ('m_NounToN', (('Noun', 'N'), operator.truediv)),
+    ('m_NoPrToN', (('NoPr', 'N'), operator.truediv)),
+    ('m_DigToN', (('Dig', 'N'), operator.truediv)),
+    ('m_RgFwToN', (('RgFw', 'N'), operator.truediv)),
+    ('m_VerbToN', (('Verb', 'N'), operator.truediv)),
+    ('m_VerbToS', (('Verb', 'S'), operator.truediv)),
+    ('m_NounToVerb', (('Noun', 'Verb'), operator.truediv)),
+    ('m_AdjToN', (('Adj', 'N'), operator.truediv)),
+    ('m_AdjToNoun', (('Adj', 'Noun'), operator.truediv)),
+    ('m_AdjToS', (('Adj', 'S'), operator.truediv)),
+    ('m_AdvToN', (('Adv', 'N'), operator.truediv)),
+    ('m_AdvToVerb', (('Adv', 'Verb'), operator.truediv)),
+    ('m_AdvToS', (('Adv', 'S'), operator.truediv)),
+    ('m_PrnToN', (('Prn', 'N'), operator.truediv)),
+    ('m_PrnToNoun', (('Prn', 'Noun'), operator.truediv)),
+    ('m_PrnToS', (('Prn', 'S'), operator.truediv)),
+    ('m_PnPeToPrn', (('PnPe', 'Prn'), operator.truediv)),
+    ('m_PnPeToN', (('PnPe', 'N'), operator.truediv)),
+    ('m_PnPe1ToN', (('PnPe1', 'N'), operator.truediv)),
+    ('m_PnPe2ToN', (('PnPe2', 'N'), operator.truediv)),
+    ('m_PnReToPrn', (('PnRe', 'Prn'), operator.truediv)),
+    ('m_PnReToN', (('PnRe', 'N'), operator.truediv)),
+    ('m_PnRiToPrn', (('PnRi', 'Prn'), operator.truediv)),
+    ('m_PnRiToN', (('PnRi', 'N'), operator.truediv)),
+    ('m_PnReRiToPrn', (('PnRe', 'PnRi', 'Prn'), lambda PnRe, PnRi, Prn: (PnRe + PnRi) / Prn)),
+    ('m_PnReRiToN', (('PnRe', 'PnRi', 'N'), lambda PnRe, PnRi, N: (PnRe + PnRi) / N)),
+    ('m_PnIrToPrn', (('PnIr', 'Prn'), operator.truediv)),
+    ('m_PnIrToN', (('PnIr', 'N'), operator.truediv)),
+    ('m_CnjToS', (('Cnj', 'S'), operator.truediv)),
+    ('m_PrepToS', (('Prep', 'S'), operator.truediv)),
+    ('m_PtToS', (('Pt', 'S'), operator.truediv)),
+    ('m_PtSjToS', (('PtSj', 'S'), operator.truediv)),
+    ('m_PtSjToVerb', (('PtSj', 'Verb'), operator.truediv)),
+    ('m_PVerbToVerb', (('PVerb', 'Verb'), operator.truediv)),
+    ('m_PVerbToS', (('PVerb', 'S'), operator.truediv)),
+    ('m_Vb1ToVerb', (('Vb1', 'Verb'), operator.truediv)),
+    ('m_Vb2ToVerb', (('Vb2', 'Verb'), operator.truediv)),
+    ('m_VbPrToVerb', (('VbPr', 'Verb'), operator.truediv)),
+    ('m_VbPaToVerb', (('VbPa', 'Verb'), operator.truediv)),
+    ('m_PpToS', (('Pp', 'S'), operator.truediv)),
+    ('m_PpPvToS', (('PpPv', 'S'), operator.truediv)),
+    ('m_AdjPpPvToS', (('Adj', 'PpPv', 'S'), lambda Adj, PpPv, S: (Adj + PpPv) / S)),
+    ('m_AdjPpPvToNoun', (('Adj', 'PpPv', 'Noun'), lambda Adj, PpPv, Noun: (Adj + PpPv) / Noun)),
+    ('m_CjCoToS', (('CjCo', 'S'), operator.truediv)),
+    ('m_CjCoToN', (('CjCo', 'N'), operator.truediv)),
+    ('m_CjSbToS', (('CjSb', 'S'), operator.truediv)),
+    ('m_CjSbToN', (('CjSb', 'N'), operator.truediv)),
+    ('m_CjCoCjSbToS', (('CjCo', 'CjSb', 'S'), lambda CjCo, CjSb, S: (CjCo + CjSb) / S)),
+    ('m_CjCoCjSbToN', (('CjCo', 'CjSb', 'N'), lambda CjCo, CjSb, N: (CjCo + CjSb) / N)),
+    ('m_NoGeToNoun', (('NoGe', 'Noun'), operator.truediv)),
+    ('FuncT', (('type_freqs', 'func_words'), get_FuncT)),
+    ('m_TNounToN', (('TNoun', 'N'), operator.truediv)),
+    ('m_TNounToNoun', (('TNoun', 'Noun'), operator.truediv)),
+    ('m_TNounToNlex', (('TNoun', 'N', 'FuncT'), lambda TNoun, N, FuncT: TNoun / (N - FuncT))),
+    ('m_SqTNoun', (('TNoun', 'Noun'), lambda TNoun, Noun: (TNoun^2) / Noun)),
+    ('m_CorTNoun', (('TNoun', 'Noun'), lambda TNoun, Noun: TNoun / math.sqrt( 2 * Noun ))),
+    ('m_TVerbToN', (('TVerb', 'N'), operator.truediv)),
+    ('m_TVerbToVerb', (('TVerb', 'Verb'), operator.truediv)),
+    ('m_TVerbToNlex', (('TVerb', 'N', 'FuncT'), lambda TVerb, N, FuncT: TVerb / (N - FuncT))),
+    ('m_SqTVerb', (('TVerb', 'Verb'), lambda TVerb, Verb: (TVerb^2) / Verb)),
+    ('m_CorTVerb', (('TVerb', 'Verb'), lambda TVerb, Verb: TVerb / math.sqrt( 2 * Verb ))),
+    ('m_TAdjToN', (('TAdj', 'N'), operator.truediv)),
+    ('m_TAdjToAdj', (('TAdj', 'Adj'), operator.truediv)),
+    ('m_TAdjToNlex', (('TAdj', 'N', 'FuncT'), lambda TAdj, N, FuncT: TAdj / (N - FuncT))),
+    ('m_SqTAdj', (('TAdj', 'Adj'), lambda TAdj, Adj: (TAdj^2) / Adj)),
+    ('m_CorTAdj', (('TAdj', 'Adj'), lambda TAdj, Adj: TAdj / math.sqrt( 2 * Adj ))),
+    ('m_TAdvToN', (('TAdv', 'N'), operator.truediv)),
+    ('m_TAdvToAdv', (('TAdv', 'Adv'), operator.truediv)),
+    ('m_TAdvToNlex', (('TAdv', 'N', 'FuncT'), lambda TAdv, N, FuncT: TAdv / (N - FuncT))),
+    ('m_SqTAdv', (('TAdv', 'Adv'), lambda TAdv, Adv: (TAdv^2) / Adv)),
+    ('m_CorTAdv', (('TAdv', 'Adv'), lambda TAdv, Adv: TAdv / math.sqrt( 2 * Adv ))),
+    ('m_AdVar', (('TAdj', 'TAdv', 'N', 'FuncT'), lambda TAdj, TAdv, N, FuncT: (TAdj + TAdv) / (N - FuncT))),
+    ('m_Density1', (('FuncT', 'N'), lambda FuncT, N: FuncT / (N - FuncT))),
+    ('m_Density2', (('FuncT', 'N'), lambda FuncT, N: (N - FuncT) / N)),
+    ('m_YuleK', (('fof', 'N'), yule_k)),
+    ('m_D', (('N', 'T'), solve_D)),
+    ('m_Entr', (('entropy',), lambda entropy: entropy)),
+    ('m_RelEntr', (('entropy', 'N'), lambda entropy, N: entropy / -log2(1 / N))),
+    ('m_Uber', (('N', 'T'), lambda N, T: (math.log10(N)*math.log10(N)) / (math.log10(N) - math.log10(T)))),
+    ('m_Herdan', (('N', 'T'), lambda N, T: math.log10(T) / math.log10(N))),
+    ('m_Guiraud', (('N', 'T'), lambda N, T: T / math.sqrt(N))),
+    # Length-robust lexical diversity
+    ('m_MATTR', (('types',), lambda types: get_MATTR(types, mattr_window))),
+    ('m_MTLD', (('types',), lambda types: get_MTLD(types, mtld_threshold))),
+    ('m_HDD', (('fof', 'N'), lambda fof, N: hdd_from_fof(fof, N, hdd_sample))),
+])
+
+
+@functools.lru_cache(maxsize=None)
+def plan_grammar_features(feature_list, known=frozenset()):
+    """
+    Plan the computation of a list of grammar features, once for all texts.
+
+    @param feature_list: a tuple of features to extract
+    @param known: names of the quantities and features whose values are already known
+    @return: a tuple of the list of registry entries in computation order, and the list of unknown features
+    """
+    # Intermediate quantities are not output features
+    registry = {name: entry for name, entry in grammar_registry.items() if name not in grammar_quantities}
+    plan, unknown = plan_features(feature_list, registry)
+    return plan_features(plan, grammar_registry, known)[0], unknown
+
+
+@functools.lru_cache(maxsize=None)
+def unavailable_grammar_features(plan, known):
+    """
+    Find the entries of a plan that cannot be computed from known values without the chunk data, e.g. features
+    of the order of words (m_MATTR, m_MTLD) computed from the running counts of a GrammarState.
+
+    @param plan: a tuple of registry entries in computation order, from plan_grammar_features
+    @param known: names of the quantities and features whose values are known
+    @return: a set of entry names
+    """
+    unavailable = set()
+    if 'data' not in known:
+        for name in plan:
+            dependencies = grammar_registry[name][0]
+            if 'data' in dependencies or unavailable.intersection(dependencies):
+                unavailable.add(name)
+    return unavailable
 
 
 def get_grammar_features(data, feature_list):
     """
     Extract grammar features as mentioned in a feature list from data.
 
+    Each quantity the requested features depend on (counts of words, types, parts of speech etc.)
+    is computed exactly once, and quantities no requested feature depends on are not computed at all.
+
     Arguments:  data
                 grammar_features_list
     Returns:    a dictionary of features
     """
-    # Create an ordered dictionary of features. Should me ordered to preserve  feature list order.
-    features = collections.OrderedDict()
-    #extract words, sentences etc. from data
-    sentences = get_sentences(data)
-    #debug_print(['sentences', sentences])
-    words = [item for sublist in sentences for item in sublist]
-    #debug_print(['words', words])
-    # build a list of types to avoid repetitive building later
-    types = [x[3] for x in words]
-    #debug_print('Sentences: {0}, Words: {1}, Types: {2}'.format( sentences, words, types ))
-
-    # get the list of functional words from file
-    func_words = func_words_list(functional_words_filename)
-    # Define how many type frequencies are significant
-    #TODO: parameterize this
-    type_freqs_num = 30
-
-    # Compute commonly used features
-    # count words
-    N = float(get_N(words)) #cast to float because it will be used later in floating point calculations
-    # count types
-    T = float(get_T(types))
-    # count sentences
-    S = float(get_S(sentences))
-    # count verbs
-    V = float(get_Verb(words))
+    return grammar_features({'data': data}, feature_list)
 
 
-    # with numpy.errstate(divide='ignore'):
+def grammar_features(values, feature_list):
+    """
+    Compute grammar features as mentioned in a feature list from known values: the chunk data of a text,
+    or quantities already computed, e.g. by a GrammarState.
+
+    @param values: a dictionary of known values (keys: registry entry names, or 'data'). Updated in place.
+    @param feature_list: a list of features to extract
+    @return: an ordered dictionary of features
+    """
+    known = frozenset(values)
+    plan, unknown = plan_grammar_features(tuple(feature_list), known)
+    # Features that cannot be computed from the known values are missing
+    values.update(dict.fromkeys(unavailable_grammar_features(tuple(plan), known), missing))
+    evaluate_plan(plan, grammar_registry, values)
+
+    # Create an ordered dictionary of features. Should me ordered to preserve  feature list order.
+    features = collections.OrderedDict()
     for feature in feature_list:
-        try:
-            if feature == 'All_tokens':
-                features[feature] = get_All_tokens(data)
-            elif feature == 'N':
-                features[feature] = N
-            elif feature == 'T':
-                features[feature] = T
-            elif feature == 'm_TTR':
-                features[feature] = T / N
-            elif feature == 'FreqT':
-                freqt = getFreqT(types, type_freqs_num)
-                features.update(sorted(freqt.items()))
-            elif feature == 'm_FreqTpc':
-                # Compute freqt only if it is not already computed, avoiding redundant computations
-                try:
-                    freqt
-                except NameError:
-                    freqt = getFreqT(types, type_freqs_num)
-                # Dictionary comprehension
-                freqtpc = {'m_'+key+'pc': freqt[key]/N for key in freqt.keys()}
-                features.update(sorted(freqtpc.items()))
-            elif feature == 'm_DisToHapax':
-                # Compute hapax and dis only if it is not already computed, avoiding redundant computations
-                try:
-                    freqt
-                except NameError:
-                    myfreqt = getFreqT(types, 2)
-                else:
-                    myfreqt = freqt
-                features[feature] = myfreqt['Freq002'] / myfreqt['Freq001']
-
-
-            elif feature == 'Char':
-                features[feature] = get_Char(words)
-            elif feature == 'm_AWL':
-                features[feature] = get_Char(words) / N
-            elif feature == 'S':
-                features[feature] = S
-            elif feature == 'SL10':
-                 features[feature] = get_SL10(sentences)
-            elif feature == 'm_SL10toS':
-                 features[feature] = (features['SL10'] if 'SL10' in features else get_SL10(sentences))/ S
-            elif feature == 'SL20':
-                 features[feature] = get_SL20(sentences)
-            elif feature == 'm_SL20toS':
-                 features[feature] = (features['SL20'] if 'SL20' in features else get_SL20(sentences))/ S
-            elif feature == 'SL30':
-                features[feature] = get_SL30(sentences)
-            elif feature == 'm_SL30toS':
-                 features[feature] = (features['SL30'] if 'SL30' in features else get_SL30(sentences))/ S
-            elif feature == 'm_ASL':
-                 features[feature] = get_m_ASL(words, sentences)
-            elif feature == 'LemT':
-                 features[feature] = get_LemT(words)
-            elif feature == 'm_TTRLem':
-                 features[feature] = (features['LemT'] if 'LemT' in features else get_LemT(words))/ N
-            elif feature == 'Noun':
-                features[feature] = get_Noun(words)
-            elif feature == 'm_NounToN':
-                 features[feature] = (features['Noun'] if 'Noun' in features else get_Noun(words))/ N
-            elif feature == 'NoPr':
-                features[feature] = get_NoPr(words)
-            elif feature == 'm_NoPrToN':
-                 features[feature] = (features['NoPr'] if 'NoPr' in features else get_NoPr(words))/ N
-            elif feature == 'Dig':
-                features[feature] = get_Dig(words)
-            elif feature == 'm_DigToN':
-                 features[feature] = (features['Dig'] if 'Dig' in features else get_Dig(words))/ N
-            elif feature == 'RgFw':
-                features[feature] = get_RgFw(words)
-            elif feature == 'm_RgFwToN':
-                 features[feature] = (features['RgFw'] if 'RgFw' in features else get_RgFw(words))/ N
-            elif feature == 'Verb':
-                features[feature] = V
-            elif feature == 'm_VerbToN':
-                features[feature] = (features['Verb'] if 'Verb' in features else get_Verb(words))/ N
-            elif feature == 'm_VerbToS':
-                features[feature] = (features['Verb'] if 'Verb' in features else get_Verb(words))/ S
-            elif feature == 'm_NounToVerb':
-                features[feature] = (features['Noun'] if 'Noun' in features else get_Noun(words)) / \
-                                    (features['Verb'] if 'Verb' in features else get_Verb(words))
-            elif feature == 'Adj':
-                features[feature] = get_Adj(words)
-            elif feature == 'm_AdjToN':
-                features[feature] = (features['Adj'] if 'Adj' in features else get_Adj(words))/ N
-            elif feature == 'm_AdjToNoun':
-                features[feature] = (features['Adj'] if 'Adj' in features else get_Adj(words))/ \
-                                    (features['Noun'] if 'Noun' in features else get_Noun(words))
-            elif feature == 'm_AdjToS':
-                features[feature] = (features['Adj'] if 'Adj' in features else get_Adj(words))/ S
-            elif feature == 'Adv':
-                features[feature] = get_Adv(words)
-            elif feature == 'm_AdvToN':
-                features[feature] = (features['Adv'] if 'Adv' in features else get_Adv(words))/ N
-            elif feature == 'm_AdvToVerb':
-                features[feature] = (features['Adv'] if 'Adv' in features else get_Adv(words))/ \
-                                    (features['Verb'] if 'Verb' in features else get_Verb(words))
-            elif feature == 'm_AdvToS':
-                features[feature] = (features['Adv'] if 'Adv' in features else get_Adv(words))/ S
-            elif feature == 'Prn':
-                features[feature] = get_Prn(words)
-            elif feature == 'm_PrnToN':
-                features[feature] = (features['Prn'] if 'Prn' in features else get_Prn(words))/ N
-            elif feature == 'm_PrnToNoun':
-                features[feature] = (features['Prn'] if 'Prn' in features else get_Prn(words))/ \
-                                     (features['Noun'] if 'Noun' in features else get_Noun(words))
-            elif feature == 'm_PrnToS':
-                features[feature] = (features['Prn'] if 'Prn' in features else get_Prn(words))/ S
-            elif feature == 'PnPe':
-                features[feature] = get_PnPe(words)
-            elif feature == 'm_PnPeToPrn':
-                features[feature] = (features['PnPe'] if 'PnPe' in features else get_PnPe(words)) / \
-                                    (features['Prn'] if 'Prn' in features else get_Prn(words))
-            elif feature == 'm_PnPeToN':
-                features[feature] = (features['PnPe'] if 'PnPe' in features else get_PnPe(words))/ N
-            elif feature == 'PnPe1':
-                features[feature] = get_PnPe1(words)
-            elif feature == 'm_PnPe1ToN':
-                features[feature] = (features['PnPe1'] if 'PnPe' in features else get_PnPe1(words))/ N
-            elif feature == 'PnPe2':
-                features[feature] = get_PnPe2(words)
-            elif feature == 'm_PnPe2ToN':
-                features[feature] = (features['PnPe2'] if 'PnPe2' in features else get_PnPe2(words))/ N
-            elif feature == 'PnRe':
-                features[feature] = get_PnRe(words)
-            elif feature == 'm_PnReToPrn':
-                features[feature] = (features['PnRe'] if 'PnRe' in features else get_PnRe(words)) / \
-                                    (features['Prn'] if 'Prn' in features else get_Prn(words))
-            elif feature == 'm_PnReToN':
-                features[feature] = (features['PnRe'] if 'PnRe' in features else get_PnRe(words))/ N
-            elif feature == 'PnRi':
-                features[feature] = get_PnRi(words)
-            elif feature == 'm_PnRiToPrn':
-                features[feature] = (features['PnRi'] if 'PnRi' in features else get_PnRi(words)) / \
-                                    (features['Prn'] if 'Prn' in features else get_Prn(words))
-            elif feature == 'm_PnRiToN':
-                features[feature] = (features['PnRi'] if 'PnRi' in features else get_PnRi(words))/ N
-            elif feature == 'm_PnReRiToPrn':
-                features[feature] = ((features['PnRe'] if 'PnRe' in features else get_PnRe(words)) + \
-                                     (features['PnRi'] if 'PnRi' in features else get_PnRi(words))) / \
-                                    (features['Prn'] if 'Prn' in features else get_Prn(words))
-            elif feature == 'm_PnReRiToN':
-                features[feature] = ((features['PnRe'] if 'PnRe' in features else get_PnRe(words)) + \
-                                     (features['PnRi'] if 'PnRi' in features else get_PnRi(words))) / N
-            elif feature == 'PnIr':
-                features[feature] = get_PnIr(words)
-            elif feature == 'm_PnIrToPrn':
-                features[feature] = (features['PnIr'] if 'PnIr' in features else get_PnIr(words)) / \
-                                    (features['Prn'] if 'Prn' in features else get_Prn(words))
-            elif feature == 'm_PnIrToN':
-                features[feature] = (features['PnIr'] if 'PnIr' in features else get_PnIr(words))/ N
-            elif feature == 'Cnj':
-                features[feature] = get_Cnj(words)
-            elif feature == 'm_CnjToS':
-                features[feature] = (features['Cnj'] if 'Cnj' in features else get_Cnj(words))/ S
-            elif feature == 'Prep':
-                features[feature] = get_Prep(words)
-            elif feature == 'm_PrepToS':
-                features[feature] = (features['Prep'] if 'Prep' in features else get_Prep(words))/ S
-            elif feature == 'Pt':
-                features[feature] = get_Pt(words)
-            elif feature == 'm_PtToS':
-                features[feature] = (features['Pt'] if 'Pt' in features else get_Pt(words))/ S
-            elif feature == 'PtSj':
-                features[feature] = get_PtSj(words)
-            elif feature == 'm_PtSjToS':
-                features[feature] = (features['PtSj'] if 'PtSj' in features else get_PtSj(words))/ S
-            elif feature == 'm_PtSjToVerb':
-                features[feature] = (features['PtSj'] if 'PtSj' in features else get_PtSj(words))/ \
-                                    (features['Verb'] if 'Verb' in features else get_Verb(words))
-            elif feature == 'PVerb':
-                features[feature] = get_PVerb(words)
-            elif feature == 'm_PVerbToVerb':
-                features[feature] = (features['PVerb'] if 'PVerb' in features else get_PVerb(words))/ V
-            elif feature == 'm_PVerbToS':
-                features[feature] = (features['PVerb'] if 'PVerb' in features else get_PVerb(words))/ S
-            elif feature == 'Vb1':
-                features[feature] = get_Vb1(words)
-            elif feature == 'm_Vb1ToVerb':
-                features[feature] = (features['Vb1'] if 'Vb1' in features else get_Vb1(words))/ V
-            elif feature == 'Vb2':
-                features[feature] = get_Vb2(words)
-            elif feature == 'm_Vb2ToVerb':
-                features[feature] = (features['Vb2'] if 'Vb2' in features else get_Vb2(words))/ V
-            elif feature == 'VbPr':
-                features[feature] = get_VbPr(words)
-            elif feature == 'm_VbPrToVerb':
-                features[feature] = (features['VbPr'] if 'VbPr' in features else get_VbPr(words))/ V
-            elif feature == 'VbPa':
-                features[feature] = get_VbPa(words)
-            elif feature == 'm_VbPaToVerb':
-                features[feature] = (features['VbPa'] if 'VbPa' in features else get_VbPa(words))/ V
-            elif feature == 'Pp':
-                features[feature] = get_Pp(words)
-            elif feature == 'm_PpToS':
-                features[feature] = (features['Pp'] if 'Pp' in features else get_Pp(words))/ S
-            elif feature == 'PpPv':
-                features[feature] = get_PpPv(words)
-            elif feature == 'm_PpPvToS':
-                features[feature] = (features['PpPv'] if 'PpPv' in features else get_PpPv(words))/ S
-            elif feature == 'm_AdjPpPvToS':
-                features[feature] = ((features['Adj'] if 'Adj' in features else get_Adj(words)) + \
-                                     (features['PpPv'] if 'PpPv' in features else get_PpPv(words))) / S
-            elif feature == 'm_AdjPpPvToNoun':
-                features[feature] = ((features['Adj'] if 'Adj' in features else get_Adj(words)) + \
-                                     (features['PpPv'] if 'PpPv' in features else get_PpPv(words))) / \
-                                    (features['Noun'] if 'Noun' in features else get_Noun(words))
-            elif feature == 'CjCo':
-                features[feature] = get_CjCo(words)
-            elif feature == 'm_CjCoToS':
-                features[feature] = (features['CjCo'] if 'CjCo' in features else get_CjCo(words))/ S
-            elif feature == 'm_CjCoToN':
-                features[feature] = (features['CjCo'] if 'CjCo' in features else get_CjCo(words))/ N
-            elif feature == 'CjSb':
-                features[feature] = get_CjSb(words)
-            elif feature == 'm_CjSbToS':
-                features[feature] = (features['CjSb'] if 'CjSb' in features else get_CjSb(words))/ S
-            elif feature == 'm_CjSbToN':
-                features[feature] = (features['CjSb'] if 'CjSb' in features else get_CjSb(words))/ N
-            elif feature == 'm_CjCoCjSbToS':
-                features[feature] = ((features['CjCo'] if 'CjCo' in features else get_CjCo(words)) + \
-                                     (features['CjSb'] if 'CjSb' in features else get_CjSb(words))) / S
-            elif feature == 'm_CjCoCjSbToN':
-                features[feature] = ((features['CjCo'] if 'CjCo' in features else get_CjCo(words)) + \
-                                     (features['CjSb'] if 'CjSb' in features else get_CjSb(words))) / N
-            elif feature == 'NoGe':
-                features[feature] = get_NoGe(words)
-            elif feature == 'm_NoGeToNoun':
-                features[feature] = ((features['NoGe'] if 'NoGe' in features else get_NoGe(words)) / \
-                                     (features['Noun'] if 'Noun' in features else get_Noun(words)))
-            elif feature == 'FuncT':
-                features[feature] = get_FuncT(types, func_words)
-            elif feature == 'TNoun':
-                features[feature] = get_TNoun(words)
-            elif feature == 'm_TNounToN':
-                features[feature] = (features['TNoun'] if 'TNoun' in features else get_TNoun(words)) / N
-            elif feature == 'm_TNounToNoun':
-                features[feature] = (features['TNoun'] if 'TNoun' in features else get_TNoun(words)) / \
-                                     (features['Noun'] if 'Noun' in features else get_Noun(words))
-            elif feature == 'm_TNounToNlex':
-                features[feature] = (features['TNoun'] if 'TNoun' in features else get_TNoun(words)) / \
-                                    (N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)))
-            elif feature == 'm_SqTNoun':
-                features[feature] = ((features['TNoun'] if 'TNoun' in features else get_TNoun(words))^2) / \
-                                     (features['Noun'] if 'Noun' in features else get_Noun(words))
-            elif feature == 'm_CorTNoun':
-                features[feature] = (features['TNoun'] if 'TNoun' in features else get_TNoun(words)) / \
-                                     math.sqrt( 2 * (features['Noun'] if 'Noun' in features else get_Noun(words)) )
-            elif feature == 'TVerb':
-                features[feature] = get_TVerb(words)
-            elif feature == 'm_TVerbToN':
-                features[feature] = (features['TVerb'] if 'TVerb' in features else get_TVerb(words)) / N
-            elif feature == 'm_TVerbToVerb':
-                features[feature] = (features['TVerb'] if 'TVerb' in features else get_TVerb(words)) / \
-                                     (features['Verb'] if 'Verb' in features else get_Verb(words))
-            elif feature == 'm_TVerbToNlex':
-                features[feature] = (features['TVerb'] if 'TVerb' in features else get_TVerb(words)) / \
-                                    (N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)))
-            elif feature == 'm_SqTVerb':
-                features[feature] = ((features['TVerb'] if 'TVerb' in features else get_TVerb(words))^2) / \
-                                     (features['Verb'] if 'Verb' in features else get_Verb(words))
-            elif feature == 'm_CorTVerb':
-                features[feature] = (features['TVerb'] if 'TVerb' in features else get_TVerb(words)) / \
-                                     math.sqrt( 2 * (features['Verb'] if 'Verb' in features else get_Verb(words)) )
-            elif feature == 'TAdj':
-                features[feature] = get_TAdj(words)
-            elif feature == 'm_TAdjToN':
-                features[feature] = (features['TAdj'] if 'TAdj' in features else get_TAdj(words)) / N
-            elif feature == 'm_TAdjToAdj':
-                features[feature] = (features['TAdj'] if 'TAdj' in features else get_TAdj(words)) / \
-                                     (features['Adj'] if 'Adj' in features else get_Adj(words))
-            elif feature == 'm_TAdjToNlex':
-                features[feature] = (features['TAdj'] if 'TAdj' in features else get_TAdj(words)) / \
-                                    (N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)))
-            elif feature == 'm_SqTAdj':
-                features[feature] = ((features['TAdj'] if 'TAdj' in features else get_TAdj(words))^2) / \
-                                     (features['Adj'] if 'Adj' in features else get_Adj(words))
-            elif feature == 'm_CorTAdj':
-                features[feature] = (features['TAdj'] if 'TAdj' in features else get_TAdj(words)) / \
-                                     math.sqrt( 2 * (features['Adj'] if 'Adj' in features else get_Adj(words)) )
-            elif feature == 'TAdv':
-                features[feature] = get_TAdv(words)
-            elif feature == 'm_TAdvToN':
-                features[feature] = (features['TAdv'] if 'TAdv' in features else get_TAdv(words)) / N
-            elif feature == 'm_TAdvToAdv':
-                features[feature] = (features['TAdv'] if 'TAdv' in features else get_TAdv(words)) / \
-                                     (features['Adv'] if 'Adv' in features else get_Adv(words))
-            elif feature == 'm_TAdvToNlex':
-                features[feature] = (features['TAdv'] if 'TAdv' in features else get_TAdv(words)) / \
-                                    (N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)))
-            elif feature == 'm_SqTAdv':
-                features[feature] = ((features['TAdv'] if 'TAdv' in features else get_TAdv(words))^2) / \
-                                     (features['Adv'] if 'Adv' in features else get_Adv(words))
-            elif feature == 'm_CorTAdv':
-                features[feature] = (features['TAdv'] if 'TAdv' in features else get_TAdv(words)) / \
-                                     math.sqrt( 2 * (features['Adv'] if 'Adv' in features else get_Adv(words)) )
-            elif feature == 'm_AdVar':
-                features[feature] = ((features['TAdj'] if 'TAdj' in features else get_TAdj(words)) + \
-                                     (features['TAdv'] if 'TAdv' in features else get_TAdv(words))  ) / \
-                                    ( N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)) )
-            elif feature == 'm_Density1':
-                features[feature] = (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)) / \
-                                    ( N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words)))
-            elif feature == 'm_Density2':
-                features[feature] = (N - (features['FuncT'] if 'FuncT' in features else get_FuncT(types, func_words))) / N
-            elif feature == 'm_YuleK':
-                features[feature] = get_YuleK(types)
-            elif feature == 'm_D':
-                features[feature] = get_D(words, types)
-            elif feature == 'm_Entr':
-                features[feature] = get_Entr(types)
-            elif feature == 'm_RelEntr':
-                features[feature] = get_RelEntr(types)
-            elif feature == 'm_Uber':
-                lN = math.log10(N)
-                features[feature] = (lN*lN) / (lN - math.log10(T))
-            elif feature == 'm_Herdan':
-                features[feature] = math.log10(T) / math.log10(N)
-            elif feature == 'm_Guiraud':
-                features[feature] = T / math.sqrt(N)
+        if feature in unknown:
+            # Unknown feature
+            write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.', logging.WARNING)
+        elif isinstance(values[feature], dict):
+            # Features producing several values
+            features.update(sorted(values[feature].items()))
+        else:
+            features[feature] = values[feature]
+    return features
+
 
+class RunningState:
+    """
+    Base class of running states of a sequence of sentences, from which the features of a family are computed
+    without going over the sentences again.
+
+    Sentences are added and removed as summaries (see summarise), in any order, each in time proportional to its
+    length, so that the features of a changing span of sentences (e.g. a sliding window, or a text being edited)
+    are kept up to date. States only hold integer counts, so features do not drift however many updates.
+    """
+
+    def add(self, summary):
+        """
+        @param summary: the summary of sentences (see summarise) to add
+        """
+        self.update(summary, 1)
+
+    def remove(self, summary):
+        """
+        @param summary: the summary of sentences (see summarise), added before, to remove
+        """
+        self.update(summary, -1)
+
+
+# The summary of chunk rows added to or removed from a GrammarState: the offsets of the sentences in the words,
+# the string ids (see string_ids) of the types, lemmas and pos tags of the words, as arrays in text order, the
+# number of characters of the words, and the number of tokens of the rows
+GrammarSummary = collections.namedtuple('GrammarSummary', ['offsets', 'types', 'lemmas', 'tags', 'chars', 'all_tokens'])
+
+
+class GrammarState(RunningState):
+    """
+    Running counts of the chunk data of a sequence of sentences: words, characters, the sentence length histogram,
+    the type frequencies and their frequency-of-frequencies spectrum, lemmas and part-of-speech counts.
+
+    Types and lemmas are counted by their string ids (see string_ids).
+    """
+
+    def __init__(self, func_words=()):
+        """
+        @param func_words: a list of functional words
+        """
+        self.func_words = collections.Counter(string_ids.array(func_words))
+        self.sentences = 0
+        self.all_tokens = 0
+        self.words = 0
+        self.chars = 0
+        # Sentence length histogram
+        self.lengths = collections.Counter()
+        self.type_freqs = collections.Counter()
+        self.fof = collections.Counter()
+        self.lemma_freqs = collections.Counter()
+        self.func_types = 0
+        self.pos = dict.fromkeys(pos_count_patterns, 0)
+        # Frequency distributions of the counted items (types or lemmas) of each part-of-speech type feature
+        self.pos_items = {name: collections.Counter() for name in pos_type_patterns}
+
+    @staticmethod
+    def summarise(rows):
+        """
+        Summarise chunk rows, e.g. of a single sentence, to be added to or removed from a state.
+
+        The columns of the words are read from the rows in a single pass, without building a tuple per word, and
+        hold the words of the sentences exactly as get_sentences gives them.
+
+        @param rows: chunk rows, as a list of tuples
+        @return: a GrammarSummary of the sentences of the rows (see get_sentences)
+        """
+        word_rows = []
+        # The word positions of the start of the rows and of each (SENT, and for each )SENT the index in starts of
+        # the (SENT it closes. As in get_sentences, a sentence holds the words from its (SENT up to the next (SENT,
+        # and the words before the first (SENT are in a sentence only if a )SENT comes before it
+        starts = [0]
+        ends = []
+        for row in rows:
+            kind = row[1]
+            if kind in ('TOK', 'ABBR', 'DIG'):
+                word_rows.append(row)
+            elif kind == '(SENT':
+                starts.append(len(word_rows))
+            elif kind == ')SENT':
+                ends.append(len(starts) - 1)
+        starts.append(len(word_rows))
+        spans = [(starts[i], starts[i + 1]) for i in ends]
+        # Each sentence starts where the one before it ends, unless some words are in no sentence or in several
+        bounds = [0] + [position for span in spans for position in span] + [len(word_rows)]
+        if bounds[::2] != bounds[1::2]:
+            word_rows = [row for start, end in spans for row in word_rows[start:end]]
+        offsets = array.array('I', [0])
+        offsets.extend(itertools.accumulate(end - start for start, end in spans))
+        words = list(map(operator.itemgetter(2), word_rows))
+        return GrammarSummary(offsets, string_ids.array(map(str.lower, words)),
+                              string_ids.array(map(operator.itemgetter(3), word_rows)),
+                              string_ids.array(map(operator.itemgetter(4), word_rows)),
+                              sum(map(len, words)), get_All_tokens(rows))
+
+    def update(self, summary, sign):
+        """
+        Add (sign 1) or remove (sign -1) the counts of a summary of chunk rows.
+        """
+        offsets = summary.offsets
+        self.sentences += sign * (len(offsets) - 1)
+        self.all_tokens += sign * summary.all_tokens
+        self.words += sign * len(summary.types)
+        self.chars += sign * summary.chars
+        for i in range(1, len(offsets)):
+            update_count(self.lengths, offsets[i] - offsets[i - 1], sign)
+        type_freqs, fof, func_words = self.type_freqs, self.fof, self.func_words
+        for type, count in collections.Counter(summary.types).items():
+            # Move the type from the frequency of frequencies of its old frequency to its new one
+            freq = type_freqs[type]
+            if not freq:
+                # A type appearing
+                self.func_types += func_words[type]
+            elif fof[freq] == 1:
+                del fof[freq]
             else:
-                # Unknown feature
-                write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.')
-            """ dummy elif
-            if feature == '':
-                features[feature] = get_()
-            """
-        # Catch division by zero error
-        except ZeroDivisionError:
-            features[feature] = div0
-    return features
+                fof[freq] -= 1
+            freq += sign * count
+            if freq:
+                type_freqs[type] = freq
+                fof[freq] += 1
+            else:
+                # A type disappearing
+                del type_freqs[type]
+                self.func_types -= func_words[type]
+        if sign > 0:
+            self.lemma_freqs.update(summary.lemmas)
+        else:
+            for lemma in summary.lemmas:
+                update_count(self.lemma_freqs, lemma, sign)
+
+        # Part-of-speech counts, matched once per distinct tag
+        tag_patterns = {}
+        for tag, count in collections.Counter(summary.tags).items():
+            count_names, type_patterns = match_pos_patterns(string_ids.strings[tag])
+            for name in count_names:
+                self.pos[name] += sign * count
+            if type_patterns:
+                tag_patterns[tag] = type_patterns
+        if tag_patterns:
+            for tag, lemma, type in zip(summary.tags, summary.lemmas, summary.types):
+                for name, item in tag_patterns.get(tag, ()):
+                    # The word tuple item (see get_sentences) counted: the lemma (1) or the type (3)
+                    if sign > 0:
+                        self.pos_items[name][lemma if item == 1 else type] += 1
+                    else:
+                        update_count(self.pos_items[name], lemma if item == 1 else type, sign)
+
+    def merge(self, other):
+        """
+        Add the counts of another state, e.g. of another part of the text, in time proportional to its number
+        of distinct types, lemmas and lengths rather than of words.
+
+        @param other: a GrammarState, of the same functional words
+        """
+        self.sentences += other.sentences
+        self.all_tokens += other.all_tokens
+        self.words += other.words
+        self.chars += other.chars
+        for length, count in other.lengths.items():
+            update_count(self.lengths, length, count)
+        for type, count in other.type_freqs.items():
+            freq = self.type_freqs[type]
+            if freq:
+                update_count(self.fof, freq, -1)
+            else:
+                self.func_types += self.func_words[type]
+            update_count(self.fof, update_count(self.type_freqs, type, count), 1)
+        for lemma, count in other.lemma_freqs.items():
+            update_count(self.lemma_freqs, lemma, count)
+        for name, count in other.pos.items():
+            self.pos[name] += count
+        for name, items in other.pos_items.items():
+            for item, count in items.items():
+                update_count(self.pos_items[name], item, count)
+
+    def quantities(self, spectrum=True):
+        """
+        @param spectrum: give the running frequency-of-frequencies spectrum of types, and the entropy computed from
+                         it. If not, the grammar registry computes both from the type frequencies, in time
+                         proportional to the number of types, exactly as get_grammar_features computes them.
+        @return: a dictionary of the grammar quantities and features (keys: registry entry names) the counts
+                 give directly, to compute all other grammar features from
+        """
+        pos = dict(self.pos)
+        pos.update((name, len(items)) for name, items in self.pos_items.items())
+        values = {'type_freqs': self.type_freqs, 'pos': pos, 'FuncT': self.func_types,
+                  'All_tokens': self.all_tokens, 'N': float(self.words), 'Char': self.chars,
+                  'S': float(self.sentences), 'LemT': len(self.lemma_freqs),
+                  'SL10': sum(count for length, count in self.lengths.items() if length > 10),
+                  'SL20': sum(count for length, count in self.lengths.items() if length > 20),
+                  'SL30': sum(count for length, count in self.lengths.items() if length > 30)}
+        if spectrum:
+            values.update(fof=self.fof, entropy=fof_entropy(self.fof, self.words))
+        return values
+
+    def features(self, feature_list, types=None, spectrum=True):
+        """
+        @param feature_list: a list of features to extract
+        @param types: the string ids of the word types of the sentences added, in text order, to compute features
+                      of the order of words too (m_MATTR, m_MTLD). These features are missing if not given.
+        @param spectrum: use the running frequency-of-frequencies spectrum of types, see quantities
+        @return: an ordered dictionary of the grammar features of the sentences added
+        """
+        values = self.quantities(spectrum)
+        if types is not None:
+            # A list is scanned faster than an array
+            values['types'] = types.tolist()
+        return grammar_features(values, feature_list)
 
 
 def conll_sentences(data):
@@ -1086,32 +1837,6 @@ def heads_count(sentences):
     return all_count
 
 
-def get_HeadsSum( sentences ):
-    """
-    Sum heads for a list of sentences
-
-    @param sentences: a list of sentences. Each sentence is itself a list
-    @return: an integer containing the sum of all heads in all sentences
-    """
-
-    return sum( heads_count( sentences ) )
-    
-
-
-def get_HeadsAv( sentences ):
-    """
-    Compute average num of heads for a list of sentences
-
-    @param sentences: a list of sentences. Each sentence is itself a list
-    @return: an integer containing the average of all heads in all sentences
-    """
-
-    #return get_HeadsSum(sentences) / float(len(sentences))
-    #debug_print('Diairesh: {0}, Mean: {1}'.format(get_HeadsSum(sentences) / float(len(sentences)), statistics.mean(heads_count(sentences) ) ))
-    c = heads_count(sentences)
-    return statistics.mean( c ) if len(c) > 0 else 0
-
-
 def sentence_leaves(sentence):
     """
 
@@ -1123,153 +1848,184 @@ def sentence_leaves(sentence):
     return leaves
 
 
-def leaves_count( sentences ):
-    """
-    Count leaves for each of a list of conll sentences
-
-    @rtype :  a list of integers, containing the count of leaves for each sentence
-    @param sentences: a list of sentences. Each sentence is itself a list
-    """
-
-    all_count =[]
-
-    for sent in sentences:
-        # make a list with the leaf nodes (i.e. not heads) in the sentence
-        #heads = set([x[6] for x in sent])
-        #leaves = [x for x in sent if x[0] not in heads]
-        all_count.append(len(sentence_leaves(sent)))
-
-    return all_count
-
-
-def get_LeavesSum(sentences):
-    """
-    Sum leaves for a list of sentences
-
-    @param sentences: a list of sentences. Each sentence is itself a list
-    @return: an integer containing the sum of all leaves in all sentences
-    """
-
-    return sum(leaves_count(sentences))
-
-
-
-def get_LeavesAv(sentences):
-    """
-    Compute average num of leaves for a list of sentences
-
-    @param sentences: a list of sentences. Each sentence is itself a list
-    @return: an integer containing the average of all leqaves in all sentences
-    """
-    c = leaves_count(sentences)
-    return statistics.mean( c ) if len(c) > 0 else 0
-
-
-def get_DepDist(text_data):
-    """
-    Compute the mean of dependency distances for each sentence in a text
-
-    @param text_data: text_data: data of text as a list
-    @return: integer, the mean of dependency distances
-    """
-
-    #find dependency distance for each token
-    token_depdist = [abs(int(token[0])-int(token[6])) for token in text_data]
-
-    return statistics.mean(token_depdist) if len(token_depdist)>0 else 0
-
-
-def find_node_depth(node, sentence):
-    #debug_print(node[6])
-    node_id = int(node[6])
-    #debug_print(node_id)
-    #debug_print(sentence)
-    if node_id == 0:
-        return 1
-    elif node_id == int(node[0]): # !!! self-referencing node, it will loop, so break recursion
-        write_log('ALERT! self-referencing node: {0} in sentence: {1}'.format(node_id, sentence))
+def sentence_depths(sentence, text_id=''):
+    """
+    Compute the depth of every node of a conll sentence tree, iteratively and in linear time.
+
+    Each node walks up towards the root only until it meets a node of already known depth,
+    then the depths of the nodes on its path are filled in on the way back.
+    Nodes directly under the root (head '0') have depth 1.
+
+    @param sentence: a conll sentence as a list of nodes
+    @param text_id: the text id, for logging
+    @return: a list of node depths, or None (logged as an error) if the tree has a cycle or a head that is not in
+             the sentence
+    """
+    index = {node[0]: i for i, node in enumerate(sentence)}
+    depths = [0] * len(sentence)  # 0: not computed yet
+    for i in range(len(sentence)):
+        path = []
+        on_path = set()
+        j = i
+        while True:
+            if depths[j]:
+                depth = depths[j]
+                break
+            if j in on_path:
+                write_log('Invalid dependency tree in text: {0}, cycle of nodes: {1} in sentence: {2}'.format(
+                    text_id, [sentence[x][0] for x in path[path.index(j):]], sentence), logging.ERROR)
+                return None
+            path.append(j)
+            on_path.add(j)
+            head = sentence[j][6]
+            if head == '0':
+                depth = 0
+                break
+            if head not in index:
+                write_log('Invalid dependency tree in text: {0}, head: {1} of node: {2} not found in sentence: {3}'
+                          .format(text_id, head, sentence[j][0], sentence), logging.ERROR)
+                return None
+            j = index[head]
+        for j in reversed(path):
+            depth += 1
+            depths[j] = depth
+    return depths
+
+
+def count_mean(total, count):
+    """
+    Compute the mean of integers from their sum and count, as statistics.mean does: an integer if exact.
+
+    @param total: the sum of the integers
+    @param count: the number of the integers
+    @return: the mean, 0 if there are no integers
+    """
+    if not count:
         return 0
-    else:
-        return 1 + int( find_node_depth(sentence[node_id - 1], sentence) )
-
-
-def get_DepHeight(sentences):
-    """
-
-    @param sentences:
-    """
-    sent_depth =[]
-    for sent in sentences:
-        tree_depths =[]
-        for node in sentence_leaves(sent):
-            tree_depths.append( find_node_depth(node, sent) )
-        sent_depth.append( max(tree_depths) )
-    return statistics.mean(sent_depth) if len(sent_depth) > 0 else 0
-
-
-def get_DepWidth(sentences):
-
-    dep_width =[]
-    for sent in sentences:
-        list = [int(x[6]) for x in sent]
-        #Create a frequency distribution list
-        fdist = nltk.FreqDist(list)
-        dep_width += fdist
-        #debug_print('dep_width list: {0}'.format(dep_width))
-
-    return statistics.mean(dep_width) if len(dep_width) > 0 else 0
+    return total // count if total % count == 0 else total / count
+
+
+class SyntaxState(RunningState):
+    """
+    Running sums of the conll data of a sequence of sentences: the frequencies of syntax ids, and the sums of the
+    tree statistics (heads, leaves, heights, widths, dependency distances) of the sentences.
+    """
+
+    # Sums of a summary, after the frequency distribution of syntax ids
+    sum_names = ['trees', 'tokens', 'dep_dist', 'heads', 'leaves', 'height', 'height_count', 'width', 'width_count']
+
+    def __init__(self):
+        self.syntax_ids = collections.Counter()
+        self.sums = dict.fromkeys(self.sum_names, 0)
+
+    @staticmethod
+    def summarise(sentences, text_id=''):
+        """
+        Summarise conll sentences, e.g. a single sentence, to be added to or removed from a state.
+
+        @param sentences: a list of conll sentences (see conll_sentences)
+        @param text_id: the text id, for logging
+        @return: a tuple of the frequency distribution of syntax ids (8th column) and the dictionary of sums
+                 (keys: sum_names) of the sentences
+        """
+        syntax_ids = collections.Counter()
+        sums = dict.fromkeys(SyntaxState.sum_names, 0)
+        sums['trees'] = len(sentences)
+        for sent in sentences:
+            syntax_ids.update(x[7] for x in sent)
+            sums['tokens'] += len(sent)
+            # Dependency distance of each token
+            sums['dep_dist'] += sum(abs(int(token[0]) - int(token[6])) for token in sent)
+            sums['heads'] += heads_count([sent])[0]
+            sums['leaves'] += len(sentence_leaves(sent))
+            # Sentences whose trees are invalid (logged by sentence_depths) are left out of DepHeight
+            depths = sentence_depths(sent, text_id)
+            if depths:
+                sums['height'] += max(depths)
+                sums['height_count'] += 1
+            # Distinct heads of the sentence. DepWidth is their mean over all sentences.
+            heads = set(int(x[6]) for x in sent)
+            sums['width'] += sum(heads)
+            sums['width_count'] += len(heads)
+        return syntax_ids, sums
+
+    def update(self, summary, sign):
+        """
+        Add (sign 1) or remove (sign -1) the sums of a summary of conll sentences.
+        """
+        syntax_ids, sums = summary
+        for syntax_id, count in syntax_ids.items():
+            update_count(self.syntax_ids, syntax_id, sign * count)
+        for name, value in sums.items():
+            self.sums[name] += sign * value
+
+    def merge(self, other):
+        """
+        Add the sums of another state, e.g. of another part of the text.
+
+        @param other: a SyntaxState
+        """
+        self.update((other.syntax_ids, other.sums), 1)
+
+    def features(self, feature_list):
+        """
+        @param feature_list: a list of features to extract
+        @return: an ordered dictionary of the syntax features of the sentences added
+        """
+        fd, sums = self.syntax_ids, self.sums
+
+        # Create an ordered dictionary of features. Should be ordered to preserve  feature list order.
+        features = collections.OrderedDict()
+        for feature in feature_list:
+            with timed('syntax', feature):
+                if feature in ['AuxS', 'Pred', 'Sb', 'Obj', 'IObj', 'Pnom', 'Atv', 'Atr', 'AuxP', 'AuxC', 'Coord',
+                               'Apos', 'AuxX', 'AuxK', 'AuxG', 'ExD', 'AuxY', 'AuxV' ]:
+                    features[feature] = fd[feature]
+                elif feature in [ 'all_Co', 'all_Ap', 'all_Pa' ]:
+                    features[feature] = sum(count for x, count in fd.items() if feature[-3:]==x[-3:])
+                elif feature == 'Trees':
+                    features[feature] = sums['trees']
+                elif feature == 'DepDist':
+                    features[feature] = count_mean(sums['dep_dist'], sums['tokens'])
+                elif feature == 'HeadsSum':
+                    features[feature] = sums['heads']
+                elif feature == 'HeadsAv':
+                    features[feature] = count_mean(sums['heads'], sums['trees'])
+                elif feature == 'LeavesSum':
+                    features[feature] = sums['leaves']
+                elif feature == 'LeavesAv':
+                    features[feature] = count_mean(sums['leaves'], sums['trees'])
+                elif feature == 'DepHeight':
+                    features[feature] = count_mean(sums['height'], sums['height_count'])
+                elif feature == 'DepWidth':
+                    features[feature] = count_mean(sums['width'], sums['width_count'])
+                else:
+                    # Unknown feature
+                    write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.',
+                              logging.WARNING)
+        return features
 
 
-def get_syntax_features(text_data, feature_list):
+def get_syntax_features(text_data, feature_list, text_id=''):
     """
     Extract syntax features from text data as mentioned in a feature list from data.
 
     @param text_data: data of text as a list of tuples
     @param feature_list: a list of features to extract
+    @param text_id: the text id, for logging
     @rtype : a dictionary of feature - value pairs
     """
 
     #extract sentences
-    sentences = conll_sentences(text_data)
+    with timed('syntax', 'sentences'):
+        sentences = conll_sentences(text_data)
 
-    # Create an ordered dictionary of features. Should be ordered to preserve  feature list order.
-    features = collections.OrderedDict()
+    # Sum up the tree statistics and syntax ids of all sentences
+    with timed('syntax', 'summary'):
+        state = SyntaxState()
+        state.add(state.summarise(sentences, text_id))
 
-    #Create a frequency distribution of 8th column of text_data containing syntax parts
-    syntax_ids = [x[7] for x in text_data]
-    # debug_print('Syntax parts: {0}'.format(syntax_ids))
-    #syntax_ids_count = len(syntax_ids) #set to '= 1' when debugging
-    # debug_print('Syntax parts count: {0}'.format(syntax_ids_count))
-    fd = nltk.FreqDist( syntax_ids )
-    # debug_print(['syntax_feat_freq', fd.most_common(100)])
-
-    for feature in feature_list:
-        if feature in ['AuxS', 'Pred', 'Sb', 'Obj', 'IObj', 'Pnom', 'Atv', 'Atr', 'AuxP', 'AuxC', 'Coord', 'Apos',\
-                       'AuxX', 'AuxK', 'AuxG', 'ExD', 'AuxY', 'AuxV' ]:
-            features[feature] = fd[feature] #/ syntax_ids_count
-        elif feature in [ 'all_Co', 'all_Ap', 'all_Pa' ]:
-            features[feature] = len( [ x for x in syntax_ids if feature[-3:]==x[-3:] ] ) #/ syntax_ids_count
-        elif feature == 'Trees':
-            features[feature] = len(sentences)
-        elif feature == 'DepDist':
-            features[feature] = get_DepDist(text_data)
-        elif feature == 'HeadsSum':
-            features[feature] = get_HeadsSum(sentences)
-        elif feature == 'HeadsAv':
-            features[feature] = get_HeadsAv(sentences)
-        elif feature == 'LeavesSum':
-            features[feature] = get_LeavesSum(sentences)
-        elif feature == 'LeavesAv':
-            features[feature] = get_LeavesAv(sentences)
-        elif feature == 'DepHeight':
-            features[feature] = get_DepHeight(sentences)
-        elif feature == 'DepWidth':
-            features[feature] = get_DepWidth(sentences)
-        else:
-            # Unknown feature
-            write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.')
-
-    return features
+    return state.features(feature_list)
 
 
 # def av_phrase_len(data, phrase_id):
@@ -1303,65 +2059,146 @@ def get_syntax_features(text_data, feature_list):
 #             into_phrase -= 1
 #         elif (item[2] == '/' + phrase_id + ']') and not into_phrase:  # Unexpected end of phrase
 #             into_phrase -= 1
-#             write_log("UNEXPECTED END-OF-PHRASE!!!")
+#             write_log("UNEXPECTED END-OF-PHRASE!!!", logging.ERROR)
 #         elif (item[1] in ['TOK', 'ABBR', 'DIG']) and into_phrase:  # Word token
 #             word_counter[into_phrase ] += 1
 #         #Check for unacceptable condition: into_phrase flag is <0
-#         if into_phrase < 0: write_log("ERORR: More phrases seem to close than open")
+#         if into_phrase < 0: write_log("More phrases seem to close than open", logging.ERROR)
 #     #debug_print("List of phrase lengths: {0}".format(len_list))
 #
 #     return (statistics.mean(len_list) if len_list!=[] else 0)
 
 
-def phrase_len_list(data, phrase_id):
+def phrase_analysis(data, open_phrases=None):
     """
-    Create a phrase length list for the given phrase
+    Count the phrases of every phrase id and create their phrase length lists, in a single pass over data.
+
+    A stack of open phrases is kept for each phrase id. The length of a phrase is the number of words
+    between its opening and closing SYN markers, nested phrases included.
 
-    @param phrase_id:
-    @param data:
-    @return: a list of integers containing all phrase lengths
+    @param data: chunk data of text as a list
+    @param open_phrases: the stacks of open phrases left by the data before, to carry phrases across parts of a
+                         text read one after the other, None if data starts a text. Updated in place: it holds
+                         the phrases data leaves open, to be given with the data after.
+    @return: a tuple of two dictionaries (keys: lowercase phrase ids, e.g. 'np_nm'):
+             phrase counts and lists of phrase lengths
     """
-    len_list = []
-    word_counter = {}
-    into_phrase = 0
-    word_counter[into_phrase] = 0
+    counts = collections.Counter()
+    len_lists = collections.defaultdict(list)
+    # Stacks of open phrases (keys: phrase ids) holding the number of words read when each phrase opened
+    if open_phrases is None:
+        open_phrases = collections.defaultdict(list)
+    word_count = 0
     for item in data:
-        if (item[2] == '[' + phrase_id) and not into_phrase:  # Beginning of phrase
-            into_phrase = 1
-            # Start counting for the new phrase
-            word_counter[into_phrase] = 0
-        elif (item[2] == '[' + phrase_id) and into_phrase: # Nested phrase
-            #debug_print("NESTED PHRASE!!!")
-            # word_counter[into_phrase] += 1  # count the whole nested sub-phrase as single entity
-            into_phrase += 1
-            word_counter[into_phrase] = 0  # start counting sub-phrase words
-        elif (item[2] == '/' + phrase_id + ']') and into_phrase:  # End of phrase
-            # Counter holds the word-count of phrase. Append it to the list of phrase word-counts
-            len_list.append(word_counter[into_phrase])
-            # add this phrase's word-count to upper-level phrase word-count
-            word_counter[into_phrase-1] += word_counter[into_phrase]
-            # Go up one phrase level
-            into_phrase -= 1
-        elif (item[2] == '/' + phrase_id + ']') and not into_phrase:  # Unexpected end of phrase
-            into_phrase -= 1
-            write_log("UNEXPECTED END-OF-PHRASE!!!")
-        elif (item[1] in ['TOK', 'ABBR', 'DIG']) and into_phrase:  # Word token
-            word_counter[into_phrase ] += 1
-        #Check for unacceptable condition: into_phrase flag is <0
-        if into_phrase < 0: write_log("ERORR: More phrases seem to close than open")
-    #debug_print("List of phrase lengths: {0}".format(len_list))
-    return len_list
-
-def list_mean(list):
-    """
-    Calculate the mean value of a list of numbers
-
-    @param list:
-
-    @return: a number indicating the mean value of the list, or None if list is empty
-    """
-
-    return statistics.mean(list) if list!=[] else 0
+        if item[1] in ['TOK', 'ABBR', 'DIG']:  # Word token
+            word_count += 1
+        elif item[1] == 'SYN':
+            marker = item[2]
+            if marker.startswith('['):  # Beginning of phrase
+                phrase_id = marker[1:]
+                counts[phrase_id] += 1
+                open_phrases[phrase_id].append(word_count)
+            elif marker.startswith('/') and marker.endswith(']'):  # End of phrase
+                phrase_id = marker[1:-1]
+                if open_phrases[phrase_id]:
+                    len_lists[phrase_id].append(word_count - open_phrases[phrase_id].pop())
+                else:  # Unexpected end of phrase
+                    write_log("More phrases seem to close than open: {0}".format(phrase_id), logging.ERROR)
+    # Phrases left open are counted from the end of data, i.e. from the start of the data after
+    for stack in open_phrases.values():
+        stack[:] = [x - word_count for x in stack]
+    return counts, len_lists
+
+
+# Phrase ids that make up features summing up several phrases
+all_phrase_ids = {
+    'Np_all': ['np_nm', 'np_ac', 'np_ge', 'np_da'],
+    'Adjp_all': ['adjp_nm', 'adjp_ac', 'adjp_ge', 'adjp_da'],
+    'Vg_all': ['vg', 'vg_s', 'vg_g'],
+    'Cl_all': ['cl', 'cl_r', 'cl_ri', 'cl_q', 'cl_o', 'cl_t', 'cl_c'],
+    # Sum-up 4 tags: Pou_np_nm, Pou_np_ac, Pou_np_ge and Pou_np_da
+    'Pou_np': ['pou_np_nm', 'pou_np_ac', 'pou_np_ge', 'pou_np_da'],
+    'Prp': ['pp'],
+}
+
+
+class PhraseState(RunningState):
+    """
+    Running counts of the phrases of the chunk data of a sequence of sentences: the number of phrases of every
+    phrase id, and the sum of their lengths.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.length_sums = collections.Counter()
+        self.length_counts = collections.Counter()
+
+    @staticmethod
+    def summarise(rows, open_phrases=None):
+        """
+        Summarise chunk rows, e.g. of a single sentence, to be added to or removed from a state.
+
+        @param rows: chunk rows, as a list of tuples
+        @param open_phrases: the stacks of phrases left open by the rows before, see phrase_analysis. Otherwise,
+                             the lengths of phrases still open at the end of the rows are left out.
+        @return: a tuple of the phrase counts and the sums of phrase lengths (keys: lowercase phrase ids), and the
+                 numbers of closed phrases (keys: lowercase phrase ids), see phrase_analysis
+        """
+        counts, len_lists = phrase_analysis(rows, open_phrases)
+        return (counts, collections.Counter({x: sum(lengths) for x, lengths in len_lists.items()}),
+                collections.Counter({x: len(lengths) for x, lengths in len_lists.items()}))
+
+    def update(self, summary, sign):
+        """
+        Add (sign 1) or remove (sign -1) the counts of a summary of chunk rows.
+        """
+        counts, length_sums, length_counts = summary
+        for phrase_id, count in counts.items():
+            update_count(self.counts, phrase_id, sign * count)
+        for phrase_id, length in length_sums.items():
+            update_count(self.length_sums, phrase_id, sign * length)
+        for phrase_id, count in length_counts.items():
+            update_count(self.length_counts, phrase_id, sign * count)
+
+    def merge(self, other):
+        """
+        Add the counts of another state, e.g. of another part of the text.
+
+        @param other: a PhraseState
+        """
+        self.update((other.counts, other.length_sums, other.length_counts), 1)
+
+    def features(self, feature_list):
+        """
+        @param feature_list: a list of features to extract
+        @return: an ordered dictionary of the phrase features of the sentences added
+        """
+        counts, length_sums, length_counts = self.counts, self.length_sums, self.length_counts
+
+        # Create an ordered dictionary of features. Should me ordered to preserve  feature list order.
+        features = collections.OrderedDict()
+        for feature in feature_list:
+            with timed('phrase', feature):
+                if feature in ['Np_nm', 'Np_ac', 'Np_ge', 'Np_da', 'Adjp_nm', 'Adjp_ac', 'Adjp_ge', 'Adjp_da', 'Advp',
+                               'Vg', 'Vg_s', 'Vg_g', 'Cl', 'Cl_r', 'Cl_ri', 'Cl_q', 'Cl_o', 'Cl_t', 'Cl_c' ]:
+                    features[feature] = counts[feature.lower()]
+                elif feature in ['Np_all', 'Adjp_all', 'Cl_all', 'Prp', 'Pou_np']:
+                    features[feature] = sum(counts[x] for x in all_phrase_ids[feature])
+                elif feature in ['L_Np_nm', 'L_Np_ac', 'L_Np_ge', 'L_Np_da', 'L_Adjp_nm', 'L_Adjp_ac', 'L_Adjp_ge',
+                                 'L_Adjp_da', 'L_Advp', 'L_Vg', 'L_Vg_s', 'L_Vg_g', 'L_Cl', 'L_Cl_r', 'L_Cl_ri',
+                                 'L_Cl_q', 'L_Cl_o', 'L_Cl_t', 'L_Cl_c']:
+                    phrase_id = feature[2:].lower()
+                    features[feature] = count_mean(length_sums[phrase_id], length_counts[phrase_id])
+                elif feature in ['L_Prp', 'L_Pou_np', 'L_Np_all', 'L_Adjp_all', 'L_Vg_all', 'L_Cl_all']:
+                    # Mean length of all phrases of the summed-up phrase ids
+                    phrase_ids = all_phrase_ids[feature[2:]]
+                    features[feature] = count_mean(sum(length_sums[x] for x in phrase_ids),
+                                                   sum(length_counts[x] for x in phrase_ids))
+                else:
+                    # Unknown feature
+                    write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.',
+                              logging.WARNING)
+        return features
 
 
 def get_phrase_features(text_data, feature_list):
@@ -1373,242 +2210,1573 @@ def get_phrase_features(text_data, feature_list):
     @rtype : a dictionary of feature - value pairs
     """
 
-    phrase_list = [x[2] for x in text_data]
-    # debug_print('Phrase list {0}'.format(phrase_list))
+    # Count phrases and measure their lengths, for all phrase ids at once
+    with timed('phrase', 'phrase_analysis'):
+        state = PhraseState()
+        state.add(state.summarise(text_data))
 
-    # Create an ordered dictionary of features. Should me ordered to preserve  feature list order.
-    features = collections.OrderedDict()
+    return state.features(feature_list)
 
 
-    for feature in feature_list:
-        if feature in ['Np_nm', 'Np_ac', 'Np_ge', 'Np_da', 'Adjp_nm', 'Adjp_ac', 'Adjp_ge', 'Adjp_da', 'Advp',
-                       'Vg', 'Vg_s', 'Vg_g', 'Cl', 'Cl_r', 'Cl_ri', 'Cl_q', 'Cl_o', 'Cl_t', 'Cl_c' ]:
-            features[feature] = phrase_list.count('[' + feature.lower())
-        elif feature == 'Np_all':
-            features[feature] = phrase_list.count('[np_nm') + phrase_list.count('[np_ac') + \
-                                phrase_list.count('[np_ge') + phrase_list.count('[np_da')
-        elif feature == 'Adjp_all':
-            features[feature] = phrase_list.count('[adjp_nm') + phrase_list.count('[adjp_ac') + \
-                                phrase_list.count('[adjp_ge') + phrase_list.count('[adjp_da')
-        elif feature == 'Cl_all':
-            features[feature] = phrase_list.count('[cl') + phrase_list.count('[cl_r') + phrase_list.count('[cl_ri') + \
-                                phrase_list.count('[cl_q') + phrase_list.count('[cl_o') + phrase_list.count('[cl_t') + \
-                                phrase_list.count('[cl_c')
-        elif feature == 'Prp':
-            features[feature] = phrase_list.count('[pp')
-        elif feature == 'Pou_np':
-            # Sum-up 3 tags: Pou_np_nm, Pou_np_ac and Pou_np_ge
-            features[feature] = phrase_list.count('[pou_np_nm') + phrase_list.count('[pou_np_ac') + \
-                                phrase_list.count('[pou_np_ge') + phrase_list.count('[pou_np_da')
-        elif feature in ['L_Np_nm', 'L_Np_ac', 'L_Np_ge', 'L_Np_da', 'L_Adjp_nm', 'L_Adjp_ac', 'L_Adjp_ge', \
-                         'L_Adjp_da', 'L_Advp', 'L_Vg', 'L_Vg_s', 'L_Vg_g', 'L_Cl', 'L_Cl_r', 'L_Cl_ri', \
-                         'L_Cl_q', 'L_Cl_o', 'L_Cl_t', 'L_Cl_c']:
-            features[feature] = list_mean(phrase_len_list( text_data, feature[2:].lower() ))
-        elif feature == 'L_Prp':
-            features[feature] = list_mean(phrase_len_list( text_data, 'pp' ))
-        elif feature == 'L_Pou_np':
-            # Mean length of 3 phrases: Pou_np_nm, Pou_np_ac and Pou_np_ge
-            features[feature] = list_mean( phrase_len_list( text_data, 'pou_np_nm') +
-                                           phrase_len_list( text_data, 'pou_np_ac') +
-                                           phrase_len_list( text_data, 'pou_np_ge') +
-                                           phrase_len_list( text_data, 'pou_np_da'))
-        elif feature in ['L_Np_all', 'L_Adjp_all']:
-            features[feature] = list_mean( phrase_len_list( text_data, feature[2:-3].lower()+'nm') +
-                                           phrase_len_list( text_data, feature[2:-3].lower()+'ac') +
-                                           phrase_len_list( text_data, feature[2:-3].lower()+'ge') +
-                                           phrase_len_list( text_data, feature[2:-3].lower()+'da'))
-        elif feature == 'L_Vg_all':
-            features[feature] = list_mean( phrase_len_list( text_data, 'vg') +
-                                           phrase_len_list( text_data, 'vg_s') +
-                                           phrase_len_list( text_data, 'vg_g'))
-        elif feature == 'L_Cl_all':
-            features[feature] = list_mean( phrase_len_list( text_data, 'cl') +
-                                           phrase_len_list( text_data, 'cl_r') +
-                                           phrase_len_list( text_data, 'cl_ri') +
-                                           phrase_len_list( text_data, 'cl_q') +
-                                           phrase_len_list( text_data, 'cl_o') +
-                                           phrase_len_list( text_data, 'cl_t') +
-                                           phrase_len_list( text_data, 'cl_c'))
-        else:
-            # Unknown feature
-            write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.')
+# The function and additional arguments called for each text in a worker process
+worker_task = None
 
-    return features
+def init_worker(settings, task=None):
+    """
+    Initialize a worker process of the process pool.
 
+    Global settings are defined in the __main__ block, which does not run in worker processes
+    started with 'spawn' (the default on Windows), so they have to be passed explicitly.
 
-def extract_grammar_features(features_list, path, text_ids):
+    @param settings: a dictionary of global variable names and values
+    @param task: a tuple of the function to call for each text and its additional arguments, passed to
+                 each worker process once rather than with each text
     """
-    Extract grammar features from files corresponding to a
-     list of text id's
+    global worker_task
+    settings = dict(settings)
+    queue, level = settings.pop('log_queue'), settings.pop('log_level')
+    if queue is not None:
+        init_worker_log(queue, level)
+    globals().update(settings)
+    worker_task = task
 
-    @rtype : object
-    @param features_list: the requested features
-    @param path: path where the data files reside
-    @param text_ids: a list of text id's
+
+def run_worker_task(text_id):
     """
+    Call the function of the worker task for a text, in a worker process.
 
-    write_log('Now extracting grammar features.')
-    write_log('grammar feature list: {0}'.format(features_list))
+    @param text_id: the text id
+    @return: the result of the function
+    """
+    function, args = worker_task
+    return function(text_id, *args)
 
-    result = {}
 
-    # Iterate  texts and extract features
-    for text_id in text_ids:
-        #Create file name from text id
-        file = os.path.join(path, text_id + '.' + chunk_file_extension)
-        #write_log('Extracting grammar features for text: {0} from file: {1}'.format(text_id, file))
-        #Check if file exists, skip if not
-        if not os.path.exists(file):
-            write_log('ERROR: could not find file {0}. Skipping.'.format(file))
-            continue
+def worker_settings():
+    """
+    Collect the global settings that feature extraction needs in worker processes.
 
-        file_data = extract_data_from_tabbed_file(file)
-        #debug_print(['file_data', file_data])
-        result[text_id] = get_grammar_features(file_data[1],grammar_features_list)
-        # result.append((
-        #     text_id,
-        #     #file_data[0], #filename
-        #     get_grammar_features(file_data[1],grammar_features_list),
-        #     ))
+    @return: a dictionary of global variable names and values
+    """
+    names = ['functional_words_filename', 'chunk_file_extension', 'conll_file_extension', 'timer',
+             'meta_feature_expressions']
+    settings = {name: globals()[name] for name in names if name in globals()}
+    settings['log_queue'] = log_queue
+    settings['log_level'] = logger.getEffectiveLevel()
+    return settings
 
-    return result
 
+# Number of texts submitted to each worker process and not yet yielded, see iter_text_results
+pending_per_worker = 2
 
-def extract_syntax_features(features_list, path, text_ids):
+def iter_text_results(function, args, text_ids, sizes, workers=1):
     """
-    Extract syntax features from files corresponding to a
-     list of text id's
+    Call function(text_id, *args) for each of a list of text id's, serially or in a pool of worker processes.
 
-    @rtype : object
-    @param features_list: the requested features
-    @param path: path where the data files reside
+    Results are always yielded in text id order. In a process pool, only the next few texts in text id order
+    (pending_per_worker per worker) are submitted at a time, and the next text is submitted as each result is
+    yielded, so that results finished ahead of their turn never pile up in memory. Among the texts submitted
+    together, larger texts are submitted first so that they do not hold up the others.
+
+    @param function: a module-level function, called with a text id and args
+    @param args: a tuple of additional arguments to function
     @param text_ids: a list of text id's
+    @param sizes: a dictionary (keys: text ids) of text sizes, used to schedule larger texts first in a process
+                  pool. None if run in this process.
+    @param workers: number of worker processes, 1 to run in this process
+    @return: a generator of (text_id, result) tuples
+    """
+    if workers > 1 and len(text_ids) > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                    initargs=(worker_settings(), (function, args))) as executor:
+            futures = {}
+            pending = iter(text_ids)
+
+            def submit(count):
+                # Schedule larger texts first
+                for text_id in sorted(itertools.islice(pending, count), key=lambda x: sizes[x], reverse=True):
+                    futures[text_id] = executor.submit(run_worker_task, text_id)
+
+            submit(pending_per_worker * workers)
+            for text_id in text_ids:
+                result = futures.pop(text_id).result()
+                # Keep the workers busy while the result is used
+                submit(1)
+                yield text_id, result
+    else:
+        for text_id in text_ids:
+            yield text_id, function(text_id, *args)
+
+
+# The default configuration file, next to this module
+default_config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'def_config.cfg')
+
+
+def read_meta_feature_expressions(config_file):
+    """
+    Read the definitions of meta-features from the [META FEATURES] section of a configuration file.
+    Meta-feature names are case sensitive.
+
+    @param config_file: the configuration file name, with path
+    @return: an ordered dictionary of meta-feature name - expression pairs, empty if the file has no such section
     """
+    config = configparser.ConfigParser(allow_no_value=True, interpolation=None)
+    config.optionxform = str
+    config.read(config_file, encoding='utf-8')
+    if not config.has_section('META FEATURES'):
+        return collections.OrderedDict()
+    return collections.OrderedDict(config['META FEATURES'])
 
-    write_log('Now extracting syntax features.')
-    write_log('Syntax feature list: {0}'.format(features_list))
 
-    result = {}
+# Meta-features: name -> expression of primary features. Expressions may use feature names, numbers, parentheses and
+# the operators + - * /. They are defined in the default configuration file. Meta-features defined in the
+# [META FEATURES] section of another configuration file are added to, or replace, these.
+meta_feature_expressions = read_meta_feature_expressions(default_config_file)
 
-    # Iterate  data files and extract features
-    for text_id in text_ids:
+meta_operators = {ast.Add, ast.Sub, ast.Mult, ast.Div, ast.UAdd, ast.USub}
+
+
+def meta_div(a, b):
+    """
+    Divide, giving NaN instead of failing on division by zero.
+
+    @return: a / b, or NaN if b is zero
+    """
+    return a / b if b else math.nan
+
+
+@functools.lru_cache(maxsize=None)
+def compile_meta_feature(expression):
+    """
+    Compile the expression of a meta-feature, once per process.
+
+    Only feature names, numbers, parentheses and the operators + - * / are allowed. Division by zero gives NaN,
+    which propagates through the rest of the expression.
+
+    @param expression: the expression, e.g. "(AuxX + AuxK + AuxG) / Char"
+    @return: a tuple of the names of the features the expression depends on, and a function of their values
+    """
+    tree = ast.parse(expression.strip(), mode='eval')
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id not in names:
+                names.append(node.id)
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                raise ValueError('Not a number: {0}'.format(ast.unparse(node)))
+        elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load)) and \
+                type(node) not in meta_operators:
+            raise ValueError('Not allowed in meta-feature expressions: {0}'.format(ast.unparse(node)
+                                                                                  if hasattr(node, 'lineno') else
+                                                                                  type(node).__name__))
+
+    class SafeDivision(ast.NodeTransformer):
+        def visit_BinOp(self, node):
+            self.generic_visit(node)
+            if isinstance(node.op, ast.Div):
+                return ast.Call(ast.Name('meta_div', ast.Load()), [node.left, node.right], [])
+            return node
+
+    body = ast.unparse(SafeDivision().visit(tree))
+    # The expression has been checked to contain only names, numbers and arithmetic
+    function = eval('lambda {0}: {1}'.format(', '.join(names), body), {'__builtins__': {}, 'meta_div': meta_div})
+    return tuple(names), function
+
+
+def get_text_meta_features(features_list, features, text_id=''):
+    """
+    Compute meta-features of a text based on its primary features.
+
+    A meta-feature is division by zero if any division in its expression is by zero, or if any feature it depends
+    on is division by zero (or not a number). It is missing, and an error is logged, if any feature it depends on
+    is missing.
+
+    @param features_list: a list of features to extract
+    @param features: an ordered dictionary (key: feature names) of the primary features of the text
+    @param text_id: the text id, for logging
+    @rtype : an ordered dictionary of feature - value pairs
+    """
+    # Create ordered dictionaries of features. Should me ordered to preserve  feature list order.
+    results = collections.OrderedDict()
+    for feature in features_list:
+        with timed('meta', feature):
+            if feature not in meta_feature_expressions:
+                # Unknown feature
+                write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.', logging.WARNING)
+                continue
+            names, function = compile_meta_feature(meta_feature_expressions[feature])
+            values = [features.get(name, missing) for name in names]
+            # Values that are not numbers (division by zero, missing) are computed as NaN, and told apart afterwards
+            value = function(*[x if isinstance(x, (int, float)) else math.nan for x in values])
+            if value != value:
+                if missing in values:
+                    write_log('Cannot compute meta-feature: {0} for text: {1}. Please make sure that all features '
+                              'required for this meta-feature have also been requested.'.format(feature, text_id),
+                              logging.ERROR)
+                    continue
+                value = div0
+            results[feature] = value
+    return results
+
+
+class CorpusReader:
+    """
+    Base class of corpus readers: reading the rows and the hash of the data of a text from its raw content.
+    """
+
+    def read_rows(self, text_id, file_extension):
+        """
+        Read the data of a text lazily, one row at a time.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data
+        @return: a generator of rows, see iter_rows, None if the data could not be found
+        """
+        content = self.read(text_id, file_extension)
+        return self.iter_rows(content) if content is not None else None
+
+    def read_digest(self, text_id, file_extension):
+        """
+        Hash the data of a text, e.g. to look up its features in the feature cache.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data
+        @return: the hash of the data, see digest, None if the data could not be found
+        """
+        content = self.read(text_id, file_extension)
+        return self.digest(content) if content is not None else None
+
+
+class TabbedCorpus(CorpusReader):
+    """
+    Base class of corpus readers of tabbed data, parsed when read.
+    """
+
+    def parse(self, content):
+        """
+        Parse the raw content of a text.
+
+        @param content: the raw content of the text, as returned by read
+        @return: the data of the text as a list of lists of strings
+        """
+        return parse_tabbed_content(content)
+
+    def iter_rows(self, content):
+        """
+        Parse the raw content of a text lazily, one line at a time.
+
+        @param content: the raw content of the text, as returned by read
+        @return: a generator of lists of strings, an empty list for each empty line
+        """
+        return iter_tabbed_rows(iter_content_lines(content))
+
+    def digest(self, content):
+        """
+        Hash the raw content of a text, e.g. to look up its features in the feature cache.
+
+        @param content: the raw content of the text, as returned by read
+        @return: the sha1 hash of the content, as a hexadecimal string
+        """
+        return hashlib.sha1(content).hexdigest()
+
+
+class DirectoryCorpus(TabbedCorpus):
+    """
+    Read the data files of texts from a corpus directory, one file per text and file extension,
+    named after the text id (e.g. 6109.chunk and 6109.conll).
+    """
+
+    def __init__(self, path):
+        """
+        @param path: path where the data files reside
+        """
+        self.path = path
+
+    def text_ids(self):
+        """
+        @return: a list of the text id's of the corpus, i.e. of the texts that have a conll file
+        """
+        return get_basenames(self.path, conll_file_extension)
+
+    def data_file(self, text_id, file_extension):
+        """
+        @param text_id: the text id
+        @param file_extension: the file extension of the data file
+        @return: the name of a data file of a text, with path, None if the file could not be found
+        """
         #Create file name from text id
-        file = os.path.join(path, text_id + '.' + conll_file_extension)
-        #write_log('Extracting syntax features for text: {0} from file: {1}'.format(text_id, file))
+        file = os.path.join(self.path, text_id + '.' + file_extension)
         #Check if file exists, skip if not
         if not os.path.exists(file):
-            write_log('ERROR: could not find file {0}. Skipping.'.format(file))
-            continue
+            write_log('Could not find file {0}. Skipping.'.format(file), logging.ERROR)
+            return None
+        return file
+
+    def read(self, text_id, file_extension):
+        """
+        Read the raw content of a data file of a text.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data file
+        @return: the file content as bytes, None if the file could not be found
+        """
+        file = self.data_file(text_id, file_extension)
+        if file is None:
+            return None
+        with open(file, 'rb') as f:
+            return f.read()
+
+    def read_rows(self, text_id, file_extension):
+        """
+        Read a data file of a text lazily, one row at a time, without holding the whole file in memory.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data file
+        @return: a generator of lists of strings, an empty list for each empty line, None if the file could not
+                 be found
+        """
+        file = self.data_file(text_id, file_extension)
+        if file is None:
+            return None
+
+        def rows():
+            # Universal newlines, as parse_tabbed_content
+            with open(file, 'r', encoding='utf-8') as f:
+                yield from iter_tabbed_rows(f)
+        return rows()
+
+    def read_digest(self, text_id, file_extension):
+        """
+        Hash a data file of a text a block at a time, without holding the whole file in memory.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data file
+        @return: the sha1 hash of the file content, as a hexadecimal string, None if the file could not be found
+        """
+        file = self.data_file(text_id, file_extension)
+        if file is None:
+            return None
+        digest = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for block in iter(functools.partial(f.read, 65536), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def size(self, text_id):
+        """
+        @param text_id: the text id
+        @return: the total size of the data files of a text in bytes
+        """
+        files = [os.path.join(self.path, text_id + '.' + x) for x in [chunk_file_extension, conll_file_extension]]
+        return sum(os.path.getsize(x) for x in files if os.path.exists(x))
+
+
+class ConcatenatedCorpus(TabbedCorpus):
+    """
+    Read the data of texts from corpus files holding many texts each, one file per file extension
+    (e.g. a chunk file and a conll file of a whole corpus).
+
+    Each text starts with a document marker line, the marker followed by the text id, as in
+    "# newdoc id = 6109". The files are memory-mapped, and an index of the position of each text is built
+    once, so that texts are accessed directly by text id, as slices of the mapped file that are never copied.
+
+    Corpus objects can be passed to worker processes: the index is passed along, and the files are mapped
+    again in each process, when first read.
+    """
+
+    def __init__(self, files, marker='# newdoc id ='):
+        """
+        Build the document index of the corpus files.
+
+        @param files: a dictionary (keys: file extensions) of corpus file names, with path
+        @param marker: the text the document marker lines start with
+        """
+        self.files = dict(files)
+        self.marker = marker
+        self.maps = {}
+        # Dictionaries (keys: file extensions) of ordered dictionaries (keys: text ids) of (start, end) offsets
+        self.index = {}
+        for file_extension, file in self.files.items():
+            self.index[file_extension] = self.index_documents(file, self.document_map(file_extension))
+            write_log('Indexed {0} texts in file {1}.'.format(len(self.index[file_extension]), file))
+
+    def document_map(self, file_extension):
+        """
+        Map a corpus file to memory, once per process.
+
+        @param file_extension: the file extension of the corpus file
+        @return: the memory-mapped file, or empty bytes for an empty file
+        """
+        if file_extension not in self.maps:
+            with open(self.files[file_extension], 'rb') as f:
+                # Empty files cannot be mapped
+                if os.fstat(f.fileno()).st_size == 0:
+                    self.maps[file_extension] = b''
+                else:
+                    self.maps[file_extension] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.maps[file_extension]
+
+    def index_documents(self, file, data):
+        """
+        Find the texts of a corpus file.
+
+        @param file: the corpus file name, for logging
+        @param data: the content of the corpus file
+        @return: an ordered dictionary (keys: text ids) of (start, end) offsets of the texts in data,
+                 not including the document marker lines
+        """
+        marker = self.marker.encode('utf-8')
+        index = collections.OrderedDict()
+        if data[:len(marker)] == marker:
+            position = 0
+        else:
+            position = data.find(b'\n' + marker)
+            position = position + 1 if position >= 0 else -1
+        while position >= 0:
+            line_end = data.find(b'\n', position)
+            if line_end < 0:
+                line_end = len(data)
+            text_id = bytes(data[position + len(marker):line_end]).decode('utf-8').strip()
+            next_marker = data.find(b'\n' + marker, line_end)
+            end = next_marker + 1 if next_marker >= 0 else len(data)
+            if text_id in index:
+                write_log('Text {0} found more than once in file {1}. Only the first one is used.'
+                          .format(text_id, file), logging.WARNING)
+            else:
+                index[text_id] = (min(line_end + 1, end), end)
+            position = end if next_marker >= 0 else -1
+        return index
+
+    def text_ids(self):
+        """
+        @return: a list of the text id's of the corpus, i.e. of the texts in the conll file
+                 (in the chunk file if there is no conll file)
+        """
+        file_extension = conll_file_extension if conll_file_extension in self.index else chunk_file_extension
+        return list(self.index.get(file_extension, []))
+
+    def read(self, text_id, file_extension):
+        """
+        Read the raw content of a text from a corpus file.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the corpus file
+        @return: a memoryview of the text in the mapped corpus file, None if the text could not be found
+        """
+        if text_id not in self.index.get(file_extension, {}):
+            write_log('Could not find text {0} in file {1}. Skipping.'
+                      .format(text_id, self.files.get(file_extension, '*.' + file_extension)), logging.ERROR)
+            return None
+        start, end = self.index[file_extension][text_id]
+        return memoryview(self.document_map(file_extension))[start:end]
+
+    def size(self, text_id):
+        """
+        @param text_id: the text id
+        @return: the total size of the data of a text in bytes
+        """
+        return sum(index[text_id][1] - index[text_id][0] for index in self.index.values() if text_id in index)
+
+    def __getstate__(self):
+        # Mapped files cannot be pickled. They are mapped again when first read.
+        state = dict(self.__dict__)
+        state['maps'] = {}
+        return state
+
+
+# A text in a compiled corpus store: the hash of its original content, its number of rows, and the offsets of its
+# arrays of row lengths and of string ids in the store, with the number of string ids
+CompiledText = collections.namedtuple('CompiledText', ['digest', 'rows', 'lengths_offset', 'ids_offset', 'ids'])
+
+
+class CompiledCorpus(CorpusReader):
+    """
+    Read the data of texts from a compiled corpus store, as written by compile_corpus.
+
+    The store holds the data of each text already parsed: the strings of all fields of all texts once, in a
+    string table, and for each text and file extension an array of the string ids of its fields and an array
+    of the number of fields of each row. Reading a text from the store needs no decoding and splitting of
+    its data. The store is memory-mapped, and can be passed to worker processes as ConcatenatedCorpus.
+
+    Store layout: the magic bytes, the offset of the header (8 bytes), the arrays of all texts, the string
+    table (strings separated by newlines, utf-8 encoded) and the header (JSON, utf-8 encoded). Arrays are
+    little-endian.
+    """
+
+    magic = b'FEATEXT1'
+    # Largest number of fields of a row, since row lengths are stored as unsigned 16-bit integers ('H')
+    max_row_fields = 0xFFFF
+
+    def __init__(self, filename):
+        """
+        Read the header of a compiled corpus store.
+
+        @param filename: the name of the store file, with path
+        """
+        self.filename = filename
+        self.store = None
+        self.strings = None
+        data = self.document_map()
+        if data[:len(self.magic)] != self.magic:
+            raise ValueError('Not a compiled corpus store: {0}'.format(filename))
+        header_offset = struct.unpack('<Q', data[len(self.magic):len(self.magic) + 8])[0]
+        header = json.loads(bytes(data[header_offset:]).decode('utf-8'))
+        self.strings_offsets = header['strings']
+        # Dictionaries (keys: file extensions) of ordered dictionaries (keys: text ids) of compiled texts
+        self.index = {file_extension: collections.OrderedDict((text_id, CompiledText(*text))
+                                                              for text_id, text in texts)
+                      for file_extension, texts in header['texts'].items()}
+        write_log('Opened compiled corpus store {0}.'.format(filename))
+
+    def document_map(self):
+        """
+        Map the store to memory, once per process.
+
+        @return: the memory-mapped store
+        """
+        if self.store is None:
+            with open(self.filename, 'rb') as f:
+                self.store = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.store
+
+    def string_table(self):
+        """
+        Load the string table of the store, once per process.
+
+        @return: a list of the strings of the store, indexed by string id
+        """
+        if self.strings is None:
+            start, end = self.strings_offsets
+            self.strings = bytes(self.document_map()[start:end]).decode('utf-8').split('\n')
+        return self.strings
+
+    def load_array(self, typecode, offset, length):
+        """
+        Load an array from the store.
+
+        @param typecode: the type code of the array
+        @param offset: the offset of the array in the store
+        @param length: the number of items of the array
+        @return: the array
+        """
+        values = array.array(typecode)
+        values.frombytes(self.document_map()[offset:offset + length * values.itemsize])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def text_ids(self):
+        """
+        @return: a list of the text id's of the corpus, i.e. of the texts compiled from conll data
+                 (from chunk data if there is no conll data)
+        """
+        file_extension = conll_file_extension if conll_file_extension in self.index else chunk_file_extension
+        return list(self.index.get(file_extension, []))
+
+    def read(self, text_id, file_extension):
+        """
+        Find a text in the store.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the original data of the text
+        @return: the compiled text, None if the text could not be found
+        """
+        if text_id not in self.index.get(file_extension, {}):
+            write_log('Could not find text {0}.{1} in compiled corpus store {2}. Skipping.'
+                      .format(text_id, file_extension, self.filename), logging.ERROR)
+            return None
+        return self.index[file_extension][text_id]
+
+    def parse(self, text):
+        """
+        Load the data of a text from the store.
+
+        @param text: a compiled text, as returned by read
+        @return: the data of the text as a list of tuples of strings
+        """
+        fields = list(map(self.string_table().__getitem__, self.load_array('I', text.ids_offset, text.ids)))
+        data = []
+        position = 0
+        for length in self.load_array('H', text.lengths_offset, text.rows):
+            data.append(tuple(fields[position:position + length]))
+            position += length
+        return data
+
+    def iter_rows(self, text):
+        """
+        Load the data of a text from the store lazily, one row at a time.
+
+        @param text: a compiled text, as returned by read
+        @return: a generator of tuples of strings. Empty lines of the original data are not kept in the store.
+        """
+        strings = self.string_table()
+        ids = self.load_array('I', text.ids_offset, text.ids)
+        position = 0
+        for length in self.load_array('H', text.lengths_offset, text.rows):
+            yield tuple(strings[x] for x in ids[position:position + length])
+            position += length
+
+    def digest(self, text):
+        """
+        @param text: a compiled text, as returned by read
+        @return: the sha1 hash of the original content of the text, as a hexadecimal string
+        """
+        return text.digest
+
+    def size(self, text_id):
+        """
+        @param text_id: the text id
+        @return: the total number of fields of the data of a text
+        """
+        return sum(index[text_id].ids for index in self.index.values() if text_id in index)
+
+    def __getstate__(self):
+        # Mapped files cannot be pickled. The store is mapped again, and its string table loaded again, when first read.
+        state = dict(self.__dict__)
+        state['store'] = None
+        state['strings'] = None
+        return state
+
+
+def compile_corpus(corpus, text_ids, filename):
+    """
+    Compile the data of the texts of a corpus to a corpus store, to be read by CompiledCorpus.
+
+    @param corpus: a corpus reader, or path where the data files reside
+    @param text_ids: a list of text id's
+    @param filename: the name of the store file, with path
+    @raise ValueError: if a row has more fields than the store can hold (CompiledCorpus.max_row_fields). No store
+                       is written then.
+    """
+    corpus = corpus_reader(corpus)
+    string_ids = {}
+    texts = collections.OrderedDict((x, []) for x in [chunk_file_extension, conll_file_extension])
+
+    def write_array(f, typecode, values):
+        values = array.array(typecode, values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        offset = f.tell()
+        values.tofile(f)
+        return offset
+
+    # Write to a temporary file first, so that a store is never left half-written
+    temp_file = '{0}.{1}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temp_file, 'wb') as f:
+            f.write(CompiledCorpus.magic + struct.pack('<Q', 0))
+            for text_id in text_ids:
+                for file_extension, content in read_text_files(corpus, text_id).items():
+                    if content is None:
+                        continue
+                    data = corpus.parse(content)
+                    lengths = [len(row) for row in data]
+                    if lengths and max(lengths) > CompiledCorpus.max_row_fields:
+                        raise ValueError('Row {0} of text {1}.{2} has {3} fields, but a compiled corpus store holds '
+                                         'rows of at most {4} fields.'.format(lengths.index(max(lengths)) + 1,
+                                                                              text_id, file_extension, max(lengths),
+                                                                              CompiledCorpus.max_row_fields))
+                    ids = [string_ids.setdefault(x, len(string_ids)) for row in data for x in row]
+                    lengths_offset = write_array(f, 'H', lengths)
+                    ids_offset = write_array(f, 'I', ids)
+                    texts[file_extension].append([text_id, [corpus.digest(content), len(data), lengths_offset,
+                                                            ids_offset, len(ids)]])
+            strings_offset = f.tell()
+            # Fields of tabbed data contain no newlines
+            f.write('\n'.join(string_ids).encode('utf-8'))
+            header_offset = f.tell()
+            f.write(json.dumps({'strings': [strings_offset, header_offset], 'texts': texts}).encode('utf-8'))
+            f.seek(len(CompiledCorpus.magic))
+            f.write(struct.pack('<Q', header_offset))
+    except BaseException:
+        os.remove(temp_file)
+        raise
+    os.replace(temp_file, filename)
+    write_log('Compiled {0} texts, with {1} distinct strings, to corpus store {2}.'
+              .format(len(text_ids), len(string_ids), filename))
+
+
+class MemoryCorpus(TabbedCorpus):
+    """
+    Read the data of texts given in memory, e.g. in a request to the extraction server.
+    """
+
+    def __init__(self, texts):
+        """
+        @param texts: a dictionary (keys: text ids) of dictionaries (keys: file extensions) of data as bytes
+        """
+        self.texts = texts
+
+    def text_ids(self):
+        """
+        @return: a list of the text id's of the corpus
+        """
+        return list(self.texts)
+
+    def read(self, text_id, file_extension):
+        """
+        Read the raw content of the data of a text.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data
+        @return: the data as bytes, None if there is no such data
+        """
+        content = self.texts.get(text_id, {}).get(file_extension)
+        if content is None:
+            write_log('No {0} data given for text {1}. Skipping.'.format(file_extension, text_id), logging.ERROR)
+        return content
+
+    def size(self, text_id):
+        """
+        @param text_id: the text id
+        @return: the total size of the data of a text in bytes
+        """
+        return sum(len(x) for x in self.texts.get(text_id, {}).values())
+
+
+# Largest number of threads reading texts ahead
+prefetch_threads = 4
+
+
+class PrefetchingCorpus(CorpusReader):
+    """
+    Read the data of texts ahead, in a bounded pool of threads, while the current text is processed, so that
+    waiting on the disk (or a network file system) overlaps with computing features.
+
+    Texts are read ahead in the order they will be processed. At most depth texts are read ahead and not
+    processed yet: a text is read ahead only when another one is taken for processing, so that reading never
+    runs further ahead of processing, nor holds more data in memory, than that. read_rows and read_digest use
+    the texts read ahead too; all other methods are those of the corpus reader read from.
+    """
 
-        file_data = extract_data_from_tabbed_file(file)
-        # debug_print(['file_data', file_data])
-        result[text_id] = get_syntax_features(file_data[1],features_list)
-        # result.append((
-        #     text_id,
-        #     #file_data[0], #filename
-        #     get_syntax_features(file_data[1],features_list),
-        #     ))
+    def __init__(self, corpus, text_ids, depth=2):
+        """
+        Start reading the first texts ahead.
 
-    return result
+        @param corpus: a corpus reader, or path where the data files reside
+        @param text_ids: a list of text id's, in the order they will be processed
+        @param depth: the largest number of texts read ahead
+        """
+        self.corpus = corpus_reader(corpus)
+        self.pending = collections.deque(text_ids)
+        self.depth = depth
+        self.executor = concurrent.futures.ThreadPoolExecutor(min(depth, prefetch_threads),
+                                                              thread_name_prefix='prefetch')
+        # Ordered dictionary (keys: text ids) of futures of texts read ahead, and the data of the current text
+        self.futures = collections.OrderedDict()
+        self.current = (None, {})
+        self.fill()
+
+    def fill(self):
+        """
+        Read texts ahead, up to depth texts.
+        """
+        while self.pending and len(self.futures) < self.depth:
+            text_id = self.pending.popleft()
+            self.futures[text_id] = self.executor.submit(self.read_text, text_id)
+
+    def read_text(self, text_id):
+        """
+        Read the data files of a text, in a thread of the pool.
+
+        @param text_id: the text id
+        @return: a dictionary (keys: file extensions) of file contents, None for files that could not be found
+        """
+        return {file_extension: self.corpus.read(text_id, file_extension)
+                for file_extension in [chunk_file_extension, conll_file_extension]}
+
+    def read(self, text_id, file_extension):
+        """
+        Read the raw content of a data file of a text, waiting for it to be read ahead if it is being read.
+        Texts not read ahead (e.g. out of order) are read directly.
+
+        @param text_id: the text id
+        @param file_extension: the file extension of the data file
+        @return: the file content, as the corpus reader read from returns it
+        """
+        if self.current[0] != text_id:
+            future = self.futures.pop(text_id, None)
+            if future is None:
+                return self.corpus.read(text_id, file_extension)
+            # Keep the data of the current text only
+            self.current = (text_id, future.result())
+            self.fill()
+        return self.current[1].get(file_extension)
+
+    def close(self):
+        """
+        Stop reading ahead, cancelling the texts not being read yet.
+        """
+        self.pending.clear()
+        self.executor.shutdown(cancel_futures=True)
+        self.futures.clear()
+        self.current = (None, {})
+
+    def __getattr__(self, name):
+        return getattr(self.corpus, name)
+
+
+def corpus_reader(corpus):
+    """
+    Get a corpus reader.
+
+    @param corpus: a corpus reader (DirectoryCorpus, ConcatenatedCorpus, CompiledCorpus), or the path of a
+                   corpus directory
+    @return: a corpus reader
+    """
+    return DirectoryCorpus(corpus) if isinstance(corpus, str) else corpus
+
+
+def read_text_files(corpus, text_id):
+    """
+    Read the raw content of the data files of a text.
+
+    @param corpus: a corpus reader, or path where the data files reside
+    @param text_id: the text id
+    @return: a dictionary (keys: file extensions) of file contents as bytes (or memoryviews of them, or
+             compiled texts), None for files that could not be found
+    """
+    corpus = corpus_reader(corpus)
+    contents = {}
+    for file_extension in [chunk_file_extension, conll_file_extension]:
+        with timed('stage', 'read ' + file_extension):
+            contents[file_extension] = corpus.read(text_id, file_extension)
+    return contents
+
+
+def read_text_data(corpus, text_id):
+    """
+    Read and parse the data files of a text, once, to be shared by all feature families.
+
+    @param corpus: a corpus reader, or path where the data files reside
+    @param text_id: the text id
+    @return: a dictionary (keys: file extensions) of file data as lists of rows of strings,
+             None for files that could not be found
+    """
+    corpus = corpus_reader(corpus)
+    return {file_extension: (corpus.parse(content) if content is not None else None)
+            for file_extension, content in read_text_files(corpus, text_id).items()}
+
+
+# Definition versions of features. Bump the version of a feature whenever its definition changes,
+# so that values of the feature stored in the feature cache are computed again.
+feature_versions = {
+    # Sentences with invalid dependency trees are left out of DepHeight
+    'DepHeight': 2,
+    # Missing instead of division by zero, or an empty value, on texts without enough words
+    'm_MTLD': 2,
+    'm_HDD': 2,
+}
+# Words outside sentences, and phrases spanning sentences, were left out of the grammar and phrase features of
+# streamed texts
+feature_versions.update((feature, feature_versions.get(feature, 1) + 1) for feature in list(grammar_registry) + [
+    prefix + name for prefix in ['', 'L_'] for name in
+    ['Np_nm', 'Np_ac', 'Np_ge', 'Np_da', 'Np_all', 'Pou_np', 'Adjp_nm', 'Adjp_ac', 'Adjp_ge', 'Adjp_da', 'Adjp_all',
+     'Advp', 'Prp', 'Vg', 'Vg_s', 'Vg_g', 'Vg_all', 'Cl', 'Cl_r', 'Cl_ri', 'Cl_q', 'Cl_o', 'Cl_t', 'Cl_c', 'Cl_all']])
+# Missing instead of division by zero on texts without words, as m_HDD
+feature_versions['m_MTLD'] += 1
+
+
+def feature_output_columns(feature):
+    """
+    List the output columns of a feature. Features producing several values are expanded
+    (FreqT: Freq001, Freq002, ...).
+
+    @param feature: a feature name
+    @return: a list of column names
+    """
+    if feature == 'FreqT':
+        return sorted(getFreqT([], type_freqs_num))
+    elif feature == 'm_FreqTpc':
+        return ['m_' + name + 'pc' for name in sorted(getFreqT([], type_freqs_num))]
+    else:
+        return [feature]
 
 
+def feature_cache_file(cache_dir, family, content_digest):
+    """
+    Build the name of the cache file of a feature family for the content of a data file.
 
+    Cache files are addressed by a hash of the data file content, and of anything else the features
+    of the family depend on, so that a changed file is never matched to stale features.
 
-def extract_phrase_features(features_list, path, text_ids):
+    @param cache_dir: the feature cache directory
+    @param family: the feature family (grammar, syntax, phrase)
+    @param content_digest: the hash of the content of the data file, as a hexadecimal string
+    @return: the cache file name, with path
     """
-    Extract phrase features from files corresponding to a
-     list of text id's
+    digest = hashlib.sha1(content_digest.encode('utf-8'))
+    digest.update('{0}:{1}'.format(family, type_freqs_num).encode('utf-8'))
+    if family == 'grammar':
+        digest.update(functional_words_digest(functional_words_filename).encode('utf-8'))
+        digest.update('{0}:{1}:{2}'.format(mattr_window, mtld_threshold, hdd_sample).encode('utf-8'))
+    key = digest.hexdigest()
+    return os.path.join(cache_dir, key[:2], key + '.json')
+
 
-    @rtype : object
+@functools.lru_cache(maxsize=None)
+def functional_words_digest(filename):
+    """
+    @param filename: the functional words file
+    @return: a hash of the content of the functional words file
+    """
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_cached_features(get_features, family, features_list, content_digest, parse, cache_dir):
+    """
+    Get features of a family for the content of a data file, computing only the features that are not
+    found in the feature cache (or have been stored with an older definition version), and storing them.
+
+    @param get_features: the feature extraction function, e.g. get_grammar_features, called with the data returned
+                         by parse and a feature list
+    @param family: the feature family (grammar, syntax, phrase)
     @param features_list: the requested features
-    @param path: path where the data files reside
-    @param text_ids: a list of text id's
+    @param content_digest: the hash of the content of the data file, as a hexadecimal string
+    @param parse: a function returning the parsed data of the data file, or anything get_features computes
+                  features from
+    @param cache_dir: the feature cache directory, None to compute all features without caching
+    @return: an ordered dictionary of feature - value pairs
+    """
+    if cache_dir is None:
+        return get_features(parse(), features_list)
+
+    cache_file = feature_cache_file(cache_dir, family, content_digest)
+    cached = {}
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except ValueError:
+            write_log('Corrupt feature cache file: {0}. Ignored.'.format(cache_file), logging.WARNING)
+
+    # Cache entries are keyed by feature name and definition version, and hold lists of (column, value) pairs
+    keys = collections.OrderedDict((feature, '{0}@{1}'.format(feature, feature_versions.get(feature, 1)))
+                                   for feature in features_list)
+    missing_features = [feature for feature, key in keys.items() if key not in cached]
+    if missing_features:
+        computed = get_features(parse(), missing_features)
+        # Drop values stored with older definition versions
+        stale = set(missing_features)
+        cached = {key: value for key, value in cached.items() if key.rsplit('@', 1)[0] not in stale}
+        for feature in missing_features:
+            cached[keys[feature]] = [[x, computed[x]] for x in feature_output_columns(feature) if x in computed]
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Write to a temporary file first, so that a cache file is never left half-written
+        temp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(cached, f)
+        os.replace(temp_file, cache_file)
+
+    features = collections.OrderedDict()
+    for key in keys.values():
+        features.update(cached[key])
+    return features
+
+
+# Number of sentences read and summarised at a time, when streaming the data of a text
+stream_batch_size = 16
+
+
+def stream_text_features(rows, file_extension, feature_lists=None, text_id=''):
     """
+    Read the data of a text one sentence at a time into the running states of the feature families computed from
+    it, so that only a few sentences of the data (stream_batch_size) are held in memory at a time, however long
+    the text. Phrases open at the end of a batch of sentences are carried over to the next batch.
 
-    write_log('Now extracting phrase features.')
-    write_log('Phrase feature list: {0}'.format(features_list))
+    The features of whole texts are computed exactly as get_grammar_features, get_syntax_features and
+    get_phrase_features compute them.
 
-    result = {}
+    @param rows: an iterable of the rows of the data, e.g. from the read_rows method of a corpus reader
+    @param file_extension: the file extension of the data: chunk data for grammar and phrase features,
+                           conll data for syntax features
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta). The word types of
+                          the text, whose number grows with its length, are kept only if its grammar features need
+                          them. None to keep them for any grammar feature.
+    @param text_id: the text id, for logging
+    @return: a dictionary (keys: feature families) of functions of a feature list, returning ordered dictionaries
+             of features
+    """
+    # Sentences are summarised a few at a time, to spread the cost of each summary
+    if file_extension == conll_file_extension:
+        syntax_state = SyntaxState()
+        for sentences in iter_batches(iter_conll_sentences(rows), stream_batch_size):
+            with timed('syntax', 'state update'):
+                syntax_state.add(SyntaxState.summarise(sentences, text_id))
+        return {'syntax': syntax_state.features}
 
-    # Iterate  texts and extract features
-    for text_id in text_ids:
-        #Create file name from text id
-        file = os.path.join(path, text_id + '.' + chunk_file_extension)
-        #write_log('Extracting phrase features for text: {0} from file: {1}'.format(text_id, file))
-        #Check if file exists, skip if not
-        if not os.path.exists(file):
-            write_log('ERROR: could not find file {0}. Skipping.'.format(file))
-            continue
+    grammar_state = GrammarState(func_words_list(functional_words_filename))
+    phrase_state = PhraseState()
+    if feature_lists is None:
+        keep_types = True
+    else:
+        plan = plan_grammar_features(tuple(feature_lists['grammar']),
+                                     frozenset(grammar_state.quantities(spectrum=False)))[0]
+        keep_types = 'types' in plan
+    # String ids of the word types in text order, for the features of the order of words
+    types = array.array('I') if keep_types else None
+    open_phrases = collections.defaultdict(list)
+    for sentences in iter_batches(iter_chunk_sentences(rows, text_id), stream_batch_size):
+        sentence_rows = [row for sentence in sentences for row in sentence]
+        with timed('grammar', 'state update'):
+            summary = GrammarState.summarise(sentence_rows)
+            grammar_state.add(summary)
+            if keep_types:
+                types.extend(summary.types)
+        with timed('phrase', 'state update'):
+            phrase_state.add(PhraseState.summarise(sentence_rows, open_phrases))
+    return {'grammar': functools.partial(grammar_state.features, types=types, spectrum=False),
+            'phrase': phrase_state.features}
+
+
+def extract_text_features(text_id, corpus, feature_lists, cache_dir=None):
+    """
+    Extract all feature families from a single text: grammar and phrase features from its chunk data,
+    syntax features from its conll data, then meta-features from all of them.
+    The data is read one sentence at a time (see stream_text_features), and only if some feature is not cached.
+
+    @param text_id: the text id
+    @param corpus: a corpus reader, or path where the data files reside
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @param cache_dir: the feature cache directory, None to compute all features without caching
+    @return: an ordered dictionary of feature - value pairs
+    """
+    corpus = corpus_reader(corpus)
+
+    # Stream each data file at most once, for all feature families, and only if some feature is not cached
+    streamed = {}
+    def stream(file_extension):
+        if file_extension not in streamed:
+            with timed('stage', 'parse ' + file_extension):
+                rows = corpus.read_rows(text_id, file_extension)
+                streamed[file_extension] = (stream_text_features(rows, file_extension, feature_lists, text_id)
+                                            if rows is not None else None)
+        return streamed[file_extension]
+
+    def parse(family, file_extension):
+        return stream(file_extension)[family]
+
+    # Hash each data file at most once, to look up its features in the feature cache
+    digests = {}
+    features = collections.OrderedDict()
+    for family, file_extension in [('grammar', chunk_file_extension), ('syntax', conll_file_extension),
+                                   ('phrase', chunk_file_extension)]:
+        if cache_dir is None:
+            content_digest = None
+            found = stream(file_extension) is not None
+        else:
+            if file_extension not in digests:
+                with timed('stage', 'read ' + file_extension):
+                    digests[file_extension] = corpus.read_digest(text_id, file_extension)
+            content_digest = digests[file_extension]
+            found = content_digest is not None
+        if found:
+            features.update(get_cached_features(lambda get_features, features_list: get_features(features_list),
+                                                family, feature_lists[family], content_digest,
+                                                functools.partial(parse, family, file_extension), cache_dir))
+    features.update(get_text_meta_features(feature_lists['meta'], features, text_id))
+    return features
 
-        file_data = extract_data_from_tabbed_file(file)
-        # debug_print(['file_data', file_data])
-        result[text_id] = get_phrase_features(file_data[1],phrase_features_list)
-        #result[text_id].update({"text_id": text_id})
-        # result.append((
-        #     text_id,
-        #     #file_data[0], #filename
-        #     get_phrase_features(file_data[1],phrase_features_list).append(text_id),
-        #     ))
-    return result
 
+class Document:
+    """
+    A text being edited, whose features are kept up to date as its sentences are inserted, removed and replaced.
+
+    The running states of its grammar, syntax and phrase features are updated with the changed sentences only,
+    so the features are computed again in time proportional to the change rather than to the length of the text,
+    and exactly as get_grammar_features, get_syntax_features and get_phrase_features compute them. Features of the
+    order of words (m_MATTR, m_MTLD) are computed only on request, see features.
+    """
+
+    def __init__(self, feature_lists, chunk_data=None, conll_data=None, text_id=''):
+        """
+        @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+        @param chunk_data: chunk data of the text as a list of tuples, None to start with an empty text
+        @param conll_data: conll data of the text as a list of tuples, None to start with an empty text
+        @param text_id: the text id, for logging
+        """
+        self.feature_lists = feature_lists
+        self.text_id = text_id
+        # Sentences as tuples of chunk rows, conll sentence, and the summaries of the grammar, phrase and syntax states
+        self.sentences = []
+        self.grammar_state = GrammarState(func_words_list(functional_words_filename))
+        self.phrase_state = PhraseState()
+        self.syntax_state = SyntaxState()
+        chunk_sents = chunk_sentence_rows(chunk_data, text_id) if chunk_data else []
+        conll_sents = conll_sentences(conll_data) if conll_data else []
+        if chunk_sents and conll_sents and len(chunk_sents) != len(conll_sents):
+            write_log('Text: {0} has {1} sentences in chunk data, but {2} in conll data. Sentences may not be '
+                      'aligned.'.format(text_id, len(chunk_sents), len(conll_sents)), logging.WARNING)
+        for chunk_rows, conll_sentence in itertools.zip_longest(chunk_sents, conll_sents):
+            self.append(chunk_rows, conll_sentence)
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def update(self, sentence, sign):
+        """
+        Add (sign 1) or remove (sign -1) a sentence to or from the running states.
+        """
+        for state, summary in zip([self.grammar_state, self.phrase_state, self.syntax_state], sentence[2:]):
+            if summary is not None:
+                state.update(summary, sign)
+
+    def insert(self, index, chunk_rows=None, conll_sentence=None):
+        """
+        Insert a sentence before the sentence at index.
+
+        @param index: the index of the sentence, as in list.insert
+        @param chunk_rows: the chunk rows of the sentence, from (SENT to )SENT, None if there is no chunk data
+        @param conll_sentence: the conll sentence as a list of nodes, None if there is no conll data
+        """
+        sentence = (chunk_rows, conll_sentence,
+                    GrammarState.summarise(chunk_rows) if chunk_rows is not None else None,
+                    PhraseState.summarise(chunk_rows) if chunk_rows is not None else None,
+                    SyntaxState.summarise([conll_sentence], self.text_id) if conll_sentence is not None else None)
+        self.sentences.insert(index, sentence)
+        self.update(sentence, 1)
+
+    def append(self, chunk_rows=None, conll_sentence=None):
+        """
+        Add a sentence at the end of the text. See insert.
+        """
+        self.insert(len(self.sentences), chunk_rows, conll_sentence)
+
+    def remove(self, index):
+        """
+        Remove the sentence at index.
+
+        @param index: the index of the sentence
+        @return: a tuple of the chunk rows and the conll sentence of the sentence removed
+        """
+        sentence = self.sentences.pop(index)
+        self.update(sentence, -1)
+        return sentence[:2]
+
+    def replace(self, index, chunk_rows=None, conll_sentence=None):
+        """
+        Replace the sentence at index, e.g. after editing it. See insert.
+
+        @return: a tuple of the chunk rows and the conll sentence of the sentence replaced
+        """
+        replaced = self.remove(index)
+        self.insert(index, chunk_rows, conll_sentence)
+        return replaced
+
+    def extend(self, other):
+        """
+        Add the sentences of another document at the end of the text, merging its running states rather than
+        adding its sentences one by one.
+
+        @param other: a Document
+        """
+        self.sentences.extend(other.sentences)
+        self.grammar_state.merge(other.grammar_state)
+        self.phrase_state.merge(other.phrase_state)
+        self.syntax_state.merge(other.syntax_state)
+
+    def features(self, text_id=None, families=('grammar', 'syntax', 'phrase'), word_order=False):
+        """
+        Compute all feature families of the text: grammar, syntax and phrase features, then meta-features.
+
+        @param text_id: the text id, for logging, if not that of the document
+        @param families: the primary feature families to compute, e.g. only those whose data are available
+        @param word_order: also compute the features of the order of words (m_MATTR, m_MTLD), in time proportional
+                           to the length of the text rather than to the change. These features are missing if not.
+        @return: an ordered dictionary of feature - value pairs
+        """
+        features = collections.OrderedDict()
+        if 'grammar' in families:
+            types = None
+            if word_order:
+                types = array.array('I')
+                for sentence in self.sentences:
+                    if sentence[2] is not None:
+                        types.extend(sentence[2].types)
+            features.update(self.grammar_state.features(self.feature_lists['grammar'], types))
+        for family, state in [('syntax', self.syntax_state), ('phrase', self.phrase_state)]:
+            if family in families:
+                features.update(state.features(self.feature_lists[family]))
+        features.update(get_text_meta_features(self.feature_lists['meta'], features,
+                                               self.text_id if text_id is None else text_id))
+        return features
+
+
+def sliding_windows(count, size, stride):
+    """
+    List the windows of a number of sentences, sliding over a text.
+
+    @param count: the number of sentences of the text
+    @param size: the number of sentences of each window
+    @param stride: the number of sentences each window starts after the previous one
+    @return: a list of (start, end) tuples of sentence indices, a single window of all sentences if there are
+             fewer than size sentences. If the stride does not reach the last sentences, the last window is the
+             last size sentences.
+    """
+    windows = [(start, min(start + size, count)) for start in range(0, max(count - size, 0) + 1, stride)]
+    if windows[-1][1] < count:
+        windows.append((count - size, count))
+    return windows
+
+
+def extract_window_features(text_id, corpus, feature_lists, size, stride):
+    """
+    Extract all feature families from every window of a number of sentences sliding over a single text.
+
+    The window is a Document: its running counts are updated with the sentences entering and leaving each window,
+    rather than computed from scratch.
+
+    @param text_id: the text id
+    @param corpus: a corpus reader, or path where the data files reside
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @param size: the number of sentences of each window
+    @param stride: the number of sentences each window starts after the previous one
+    @return: a list of (window id, features) tuples. Window ids are text_id:first-last, with sentences
+             numbered from 1
+    """
+    data = read_text_data(corpus, text_id)
+    chunk_data, conll_data = data[chunk_file_extension], data[conll_file_extension]
+    with timed('stage', 'sentences'):
+        chunk_sents = chunk_sentence_rows(chunk_data, text_id) if chunk_data is not None else []
+        conll_sents = conll_sentences(conll_data) if conll_data else []
+    if chunk_data is not None and conll_data is not None and len(chunk_sents) != len(conll_sents):
+        write_log('Text: {0} has {1} sentences in chunk data, but {2} in conll data. Windows may not be '
+                  'aligned.'.format(text_id, len(chunk_sents), len(conll_sents)), logging.WARNING)
+    sentences = list(itertools.zip_longest(chunk_sents, conll_sents))
+    # Families of features whose data are available
+    families = [family for family, file_extension in [('grammar', chunk_file_extension),
+                                                      ('syntax', conll_file_extension),
+                                                      ('phrase', chunk_file_extension)]
+                if data[file_extension] is not None]
+
+    window = Document(feature_lists, text_id=text_id)
+    results = []
+    # The window holds sentences first to added - 1
+    first = added = 0
+    for start, end in sliding_windows(len(sentences), size, stride):
+        # Slide the window: remove the sentences leaving it, add the sentences entering it
+        with timed('stage', 'slide window'):
+            while first < min(start, added):
+                window.remove(0)
+                first += 1
+            first = max(first, start)
+            for i in range(max(added, start), end):
+                window.append(*sentences[i])
+            added = max(added, end)
+
+        window_id = '{0}:{1}-{2}'.format(text_id, start + 1, end)
+        results.append((window_id, window.features(window_id, families, word_order=True)))
+    return results
+
+
+def profiled_text_features(text_id, extract, *args):
+    """
+    Extract all feature families from a single text, as extract_text_features, timing each feature and stage.
+
+    The timings are returned rather than added to the timer of the process, so that they reach the main
+    process when the text is processed in a worker process. Worker processes also profile the text with
+    cProfile, if requested.
+
+    @param text_id: the text id
+    @param extract: the extraction function, extract_text_features or extract_window_features
+    @param args: the additional arguments of the extraction function
+    @return: a tuple of the features, the timings of the text, and the cProfile
+             statistics of the text (None if not profiled)
+    """
+    global timer
+    run_timer, timer = timer, FeatureTimer()
+    profiler = cProfile.Profile() if run_timer.cprofile and multiprocessing.parent_process() is not None else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        features = extract(text_id, *args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        text_timer, timer = timer, run_timer
+    if profiler is not None:
+        profiler.create_stats()
+        return features, text_timer.timings, profiler.stats
+    return features, text_timer.timings, None
+
+
+def extract_features(feature_lists, corpus, text_ids, workers=1, cache_dir=None, profile_stats=None, window=None,
+                     prefetch=0):
+    """
+    Extract all feature families from files corresponding to a list of text id's, or from every window of
+    sentences sliding over each of them. The data files of each text are read and parsed only once.
+
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @param corpus: a corpus reader, or path where the data files reside
+    @param text_ids: a list of text id's
+    @param workers: number of worker processes, 1 to extract in this process
+    @param cache_dir: the feature cache directory, None to compute all features without caching
+    @param profile_stats: a pstats.Stats object to add the cProfile statistics of worker processes to, if profiling
+    @param window: a tuple of the number of sentences of each window and the stride of the windows, None to
+                   extract the features of whole texts. Windows are not cached.
+    @param prefetch: number of texts to read ahead while extracting features in this process (see
+                     PrefetchingCorpus), 0 to read each text when it is processed
+    @return: a generator of (text_id, features) tuples, in text id order, or (window id, features) tuples of
+             the windows of each text
+    """
+    write_log('Now extracting features.')
+    for family, features_list in feature_lists.items():
+        write_log('{0} feature list: {1}'.format(family.capitalize(), features_list))
+
+    corpus = corpus_reader(corpus)
+    # Text sizes are only needed to schedule texts in a process pool, and take file system calls for each text
+    sizes = None
+    if workers > 1 and len(text_ids) > 1:
+        sizes = {text_id: corpus.size(text_id) for text_id in text_ids}
+    if prefetch and workers > 1 and len(text_ids) > 1:
+        write_log('Texts are not read ahead by worker processes, which already read texts in parallel.')
+    elif prefetch:
+        corpus = PrefetchingCorpus(corpus, text_ids, prefetch)
+
+    if window is None:
+        extract, args = extract_text_features, (corpus, feature_lists, cache_dir)
+    else:
+        extract, args = extract_window_features, (corpus, feature_lists) + tuple(window)
+    if timer is None:
+        results = iter_text_results(extract, args, text_ids, sizes, workers)
+    else:
+        results = iter_profiled_results(iter_text_results(profiled_text_features, (extract,) + args,
+                                                          text_ids, sizes, workers), profile_stats)
+    if isinstance(corpus, PrefetchingCorpus):
+        results = closing_results(results, corpus)
+    if window is None:
+        return results
+    return ((window_id, features) for text_id, windows in results for window_id, features in windows)
 
 
-def get_meta_features(features_list, text_features):
+def closing_results(results, resource):
     """
-    Compute meta-features based on primary features.
+    Yield the results of a generator, and close a resource when they are exhausted, or the generator is closed.
 
-    @param feature_list: a list of features to extract
-    @param text_features: a dictionary (keys: text ids) of ordered dictionaries (key: feature names) of primary features
-    @rtype : an ordered dictionary of feature - value pairs
-    assert: all primary features required to compute any meta-feature in features_list should be present in prim_features
+    @param results: a generator
+    @param resource: an object with a close method, e.g. a PrefetchingCorpus
+    @return: a generator of the results
     """
+    with contextlib.closing(resource):
+        yield from results
 
-    result = {}
 
-    write_log('Now extracting additional meta-features.')
-    write_log('Meta-feature list: {0}'.format(features_list))
+def iter_profiled_results(results, profile_stats=None):
+    """
+    Collect the timings and cProfile statistics of the results of profiled_text_features.
+
+    @param results: a generator of (text_id, (features, timings, cProfile statistics)) tuples
+    @param profile_stats: a pstats.Stats object to add cProfile statistics to, None to discard them
+    @return: a generator of (text_id, features) tuples
+    """
+    for text_id, (features, timings, stats) in results:
+        timer.merge(timings)
+        if stats is not None and profile_stats is not None:
+            # pstats loads statistics from any object with create_stats() and stats
+            profile_stats.add(SimpleNamespace(create_stats=lambda: None, stats=stats))
+        yield text_id, features
 
-    for text_id, features in text_features.items():  #text_features: dictionary, where: key is text_id and value is features
-        # Create an ordered dictionary of features. Should me ordered to preserve  feature list order.
-        result[text_id]= collections.OrderedDict()
-        for feature in features_list:
-            try:
-                if feature in ['m_SbToS', 'm_ObjToS',  'm_PnomToS', 'm_Np_nmToS', 'm_Np_acToS', 'm_Np_geToS', 'm_Np_daToS',
-                               'm_Np_allToS', 'm_Pou_npToS', 'm_Adjp_nmToS', 'm_Adjp_acToS', 'm_Adjp_geToS', 'm_Adjp_daToS',
-                               'm_Adjp_allToS', 'm_AdvpToS', 'm_PrpToS', 'm_VgToS', 'm_Vg_sToS', 'm_Vg_gToS', 'm_ClToS',
-                               'm_Cl_rToS', 'm_Cl_riToS', 'm_Cl_qToS', 'm_Cl_oToS', 'm_Cl_tToS', 'm_Cl_cToS', 'm_Cl_allToS']:
-                    result[text_id][feature] = features[feature[2:-3]] / features['S']
-                elif feature in ['m_SbToVerb', 'm_ObjToVerb', 'm_PnomToVerb']:
-                    result[text_id][feature] = features[feature[2:-6]] / features['Verb']
-                elif feature == 'm_CoToAp':
-                    result[text_id][feature] = features['Coord'] / features['Apos']
-                elif feature in ['m_AuxXToChar', 'm_AuxKToChar', 'm_AuxGToChar']:
-                    result[text_id][feature] = features[feature[2:-6]] / features['Char']
-                elif feature == 'm_AuxToChar':
-                    result[text_id][feature] = ( features['AuxX'] + features['AuxK'] +
-                                                 features['AuxG'] ) / features['Char']
-                else:
-                    # Unknown feature
-                    write_log('Unable to extract feature: "' + feature + '". Unknown feature, skipped.')
-            except ZeroDivisionError:
-                result[text_id][feature] = div0
-            except KeyError:
-                write_log('ERROR: cannot compute meta-feature: {0} for text: {1}. Please make sure that all features '
-                          'required for this meta-feature have also been requested.'.format(feature, text_id))
 
-    return result
+# Largest request body the extraction server accepts, in bytes
+max_request_bytes = 64 * 1024 * 1024
+
+
+class FeatureRequestHandler:
+    """
+    Handle requests to the extraction server. Mixed with http.server.BaseHTTPRequestHandler by serve, so that
+    http.server is imported only to serve.
+
+    POST: extract the features of a text. The request body is a JSON object with the text id ("text_id"), and its
+          chunk data ("chunk") and conll data ("conll") as strings. Either data may be left out, but data that is
+          not a string is rejected (400). The response is a JSON object with the text id
+          and an object of the features ("features"), in the columns of the output file. Requests without a
+          valid Content-Length are rejected (400), and so are requests larger than max_request_bytes (413).
+    GET:  get the feature columns, as a JSON object with a list of columns ("columns").
+    """
+    # Keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+    # Buffer responses, so that each response is sent at once rather than in pieces
+    wbufsize = -1
+
+    def do_GET(self):
+        self.send_json(200, {'columns': self.server.columns})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            length = -1
+        # The body of rejected requests is not read, so the connection cannot be used for another request
+        if length < 0:
+            self.close_connection = True
+            self.send_json(400, {'error': 'Bad request: missing or invalid Content-Length'})
+            return
+        if length > max_request_bytes:
+            self.close_connection = True
+            self.send_json(413, {'error': 'Request body larger than {0} bytes'.format(max_request_bytes)})
+            return
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            text_id = str(request.get('text_id', ''))
+            texts = {text_id: {}}
+            for file_extension, key in [(chunk_file_extension, 'chunk'), (conll_file_extension, 'conll')]:
+                if key in request:
+                    if not isinstance(request[key], str):
+                        raise ValueError('"{0}" data must be a string'.format(key))
+                    texts[text_id][file_extension] = request[key].encode('utf-8')
+        except (ValueError, AttributeError) as e:
+            self.send_json(400, {'error': 'Bad request: {0}'.format(e)})
+            return
+        try:
+            features = extract_text_features(text_id, MemoryCorpus(texts), self.server.feature_lists,
+                                             self.server.cache_dir)
+        except Exception as e:
+            write_log('Unable to extract features of text {0}: {1}'.format(text_id, e), logging.ERROR)
+            self.send_json(500, {'error': 'Unable to extract features: {0}'.format(e)})
+            return
+        self.send_json(200, {'text_id': text_id,
+                             'features': collections.OrderedDict((x, features.get(x, missing))
+                                                                 for x in self.server.columns)})
+
+    def send_json(self, status, response):
+        """
+        Send a JSON response.
+
+        @param status: the HTTP status code
+        @param response: the response object
+        """
+        body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of Unix sockets have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else self.server.server_address
+
+    def log_message(self, format, *args):
+        write_log('{0} - {1}'.format(self.address_string(), format % args), logging.DEBUG)
+
+
+def serve(feature_lists, host='127.0.0.1', port=8080, unix_socket=None, cache_dir=None):
+    """
+    Run the extraction server until interrupted, handling each request in a thread.
+
+    The functional words and the feature plans are loaded once, before the first request, by extracting the
+    features of an empty text exactly as the features of requested texts are extracted.
+
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @param host: the host address to listen at
+    @param port: the port to listen at
+    @param unix_socket: the path of a Unix socket to listen at instead of host and port, None to use host and port
+    @param cache_dir: the feature cache directory, None to compute all features without caching
+    """
+    # Imported here rather than with the other modules, since only the server needs them
+    import http.server
+    import socketserver
+
+    class UnixThreadingHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """
+        HTTP server on a Unix socket, handling each request in a thread.
+        """
+        daemon_threads = True
+
+    handler = type('FeatureRequestHandler', (FeatureRequestHandler, http.server.BaseHTTPRequestHandler), {})
+
+    extract_text_features('', MemoryCorpus({'': {chunk_file_extension: b'', conll_file_extension: b''}}),
+                          feature_lists)
+
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixThreadingHTTPServer(unix_socket, handler)
+        address = unix_socket
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), handler)
+        address = 'http://{0}:{1}'.format(*server.server_address[:2])
+    server.feature_lists = feature_lists
+    server.columns = feature_columns(feature_lists)
+    server.cache_dir = cache_dir
+    write_log('Extraction server listening at {0}'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+    write_log('Extraction server stopped.')
 
 
 #______________________________________________________________________________________________________
 
 if __name__ == "__main__":
     # Define default configuration file. NOTE: the file should reside in this script's path.
-    default_config_file = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'def_config.cfg')
     #Parse command-line arguments
     parser = argparse.ArgumentParser(description='Extract features from corpus')
     #config_file: settings and configuration file. Optional, use default file if not specified.
     parser.add_argument("-c", "--config_file", help="settings and configuration file")
+    #workers: number of worker processes to extract features in parallel. Optional, extract serially if not specified.
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    #log_level and quiet: control log messages. Optional.
+    parser.add_argument("--log-level", default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="lowest level of messages to log (default: INFO)")
+    parser.add_argument("-q", "--quiet", action='store_true', help="print only errors to standard output")
+    #cache_dir: directory of the feature cache. Optional, compute all features without caching if not specified.
+    parser.add_argument("--cache-dir", help="feature cache directory, to reuse features of unchanged files")
+    #profile and cprofile: time each feature and stage, and profile the whole run. Optional.
+    parser.add_argument("--profile", action='store_true',
+                        help="time each feature and processing stage, and write a report to *_profile.csv")
+    #compile: compile the corpus to a corpus store, to be read instead of the corpus. Optional.
+    parser.add_argument("--compile", metavar='FILE', help="compile the corpus to the corpus store FILE and exit. "
+                                                          "Set 'corpus store file' in the configuration file to use it")
+    #serve: run as an extraction server instead of extracting features from the corpus. Optional.
+    parser.add_argument("--serve", action='store_true', help="run as an extraction server over local HTTP: POST a "
+                                                              "JSON object of text_id, chunk and conll data to get "
+                                                              "its features as JSON")
+    parser.add_argument("--host", default='127.0.0.1', help="host address of the server (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port of the server (default: 8080)")
+    parser.add_argument("--socket", metavar='PATH', help="Unix socket of the server, instead of host and port")
+    #format: output file formats. Optional, write a CSV file if not specified.
+    parser.add_argument("--format", nargs='+', default=['csv'], choices=list(output_formats),
+                        help="output file formats: csv, npz (NumPy), parquet (needs pyarrow) (default: csv)")
+    #normalise: also write the z-scores of all features. Optional.
+    parser.add_argument("--normalise", action='store_true',
+                        help="also write the z-scores of all features over the corpus to *_all_z.csv")
+    #prefetch: read texts ahead while extracting features. Optional, read each text when it is processed if not specified.
+    parser.add_argument("--prefetch", type=int, default=0, metavar='N',
+                        help="read up to N texts ahead, in a pool of threads, while extracting features in this "
+                             "process (default: 0, do not read ahead)")
+    #window and stride: extract features of windows of sentences sliding over each text. Optional.
+    parser.add_argument("--window", type=int, metavar='K', help="extract features of every window of K sentences "
+                                                                 "of each text, one row per window, to "
+                                                                 "*_windows_all.csv")
+    parser.add_argument("--stride", type=int, metavar='S', help="start each window S sentences after the previous "
+                                                                 "one (default: K)")
+    parser.add_argument("--cprofile", metavar='FILE', help="profile the whole run with cProfile, and dump "
+                                                           "the statistics to FILE (implies --profile)")
     args = parser.parse_args()
+    if 'parquet' in args.format:
+        try:
+            importlib.import_module('pyarrow.parquet')
+        except ImportError:
+            parser.error('pyarrow is needed to write Parquet files. Please install it, or choose another format.')
+    if args.normalise and 'csv' not in args.format:
+        parser.error('--normalise needs the csv format.')
+    if args.window is not None and args.window < 1 or args.stride is not None and args.stride < 1:
+        parser.error('--window and --stride must be positive.')
+    if args.stride is not None and args.window is None:
+        parser.error('--stride needs --window.')
+    if args.prefetch < 0:
+        parser.error('--prefetch must not be negative.')
+    verbose = not args.quiet
     debug_print('Command-line arguments: "{0}"'.format(args))
     if args.config_file:
         config_file = args.config_file
@@ -1648,6 +3816,16 @@ if __name__ == "__main__":
         sys.exit('Error reading configuration file, or no features found in it: {0} . Unable to extract any features.'.\
               format(config_file))
 
+    # Get meta-feature expressions from configuration file, in addition to those of the default configuration file
+    meta_feature_expressions.update(read_meta_feature_expressions(config_file))
+    for feature in meta_features_list:
+        try:
+            if feature in meta_feature_expressions:
+                compile_meta_feature(meta_feature_expressions[feature])
+        except (SyntaxError, ValueError) as e:
+            sys.exit('Invalid expression of meta-feature {0} in configuration file {1}: {2}'.format(feature,
+                                                                                                   config_file, e))
+
     # Process Settings
     CSV_SEP = settings.get('csv separator', '\t')
     # Working path. All other paths are relative to this.
@@ -1679,50 +3857,102 @@ if __name__ == "__main__":
     lem_file_extension = paths.get('lem file extension', 'lem')
     chunk_file_extension = paths.get('chunk file extension', 'chunk')
     # debug_print('{0} {1} {2}'.format(conll_file_extension, lem_file_extension, chunk_file_extension))
-    #Define text id's by searching for connl files and removing file extension
-    text_ids = get_basenames(corpus_path, conll_file_extension)
+
+    # Write initial information to the log file
+    init_log(log_filename, getattr(logging, args.log_level), args.quiet)
+
+    #Define data files
+    functional_words_filename = os.path.join(data_path, paths.get('functional words filename', 'functional words.txt'))
+    # Features to extract
+    feature_lists = collections.OrderedDict([('grammar', grammar_features_list), ('syntax', syntax_features_list),
+                                             ('phrase', phrase_features_list), ('meta', meta_features_list)])
+
+    # Run as an extraction server, if requested, instead of extracting features from the corpus
+    if args.serve:
+        serve(feature_lists, args.host, args.port, args.socket, args.cache_dir)
+        write_log('---END OF PROGRAM---')
+        close_log()
+        sys.exit()
+
+    # Define the corpus: either a directory of data files, one per text and file extension, or corpus files
+    # holding all texts, separated by document marker lines, or a corpus store compiled from either
+    corpus_files = collections.OrderedDict()
+    for file_extension in [chunk_file_extension, conll_file_extension]:
+        if paths.get('corpus {0} file'.format(file_extension)):
+            corpus_files[file_extension] = os.path.join(working_path, paths['corpus {0} file'.format(file_extension)])
+    if paths.get('corpus store file') and not args.compile:
+        corpus_path = os.path.join(working_path, paths['corpus store file'])
+        corpus = CompiledCorpus(corpus_path)
+    elif corpus_files:
+        corpus_path = ', '.join(corpus_files.values())
+        corpus = ConcatenatedCorpus(corpus_files, paths.get('document marker', '# newdoc id ='))
+    else:
+        corpus = DirectoryCorpus(corpus_path)
+    #Define text id's by searching for connl files (or texts in the conll corpus file) and removing file extension
+    text_ids = corpus.text_ids()
     # Assure that corpus contains some texts. If not, exit.
     if text_ids ==[]:
         sys.exit('No corpus found at: {0} , or corpus does not contain any texts. Please check your corpus. Exiting...'.\
               format(corpus_path))
-    lem_datafiles = glob.glob(corpus_path + '\\*.lem')
+    lem_datafiles = glob.glob(os.path.join(corpus_path, '*.lem'))
     #debug_print(lem_datafiles)
-    #Define data files
-    functional_words_filename = data_path + '\\' + paths.get('functional words filename', 'functional words.txt')
 
-    # Write initial information to the log file
-    init_log(log_filename)
-
-    # Extract grammar features
-    results_grammar_features = extract_grammar_features(grammar_features_list, corpus_path, text_ids)
-    #write_log('Grammar features results: {0}'.format(results_grammar_features))
-    # Extract syntax features
-    results_syntax_features = extract_syntax_features(syntax_features_list, corpus_path, text_ids)
-    #write_log('Syntax features results: {0}'.format(results_syntax_features))
-    # Extract phrase features
-    results_phrase_features = extract_phrase_features(phrase_features_list, corpus_path, text_ids)
-    #debug_print('Phrase features results: {0}'.format(results_phrase_features))
-    # Merge features
-    results_merged_features = merge_dicts_ord(results_grammar_features, results_syntax_features, results_phrase_features)
-    # Compute additional meta-features
-    results_meta_features = get_meta_features(meta_features_list, results_merged_features)
-    # Merge again with meta features to produce final results
-    results_all_features = merge_dicts_ord(results_merged_features, results_meta_features)
-
-    #Write to output files
-    write_log('Writing results to files ...')
-    # write_log('Writing grammar features')
-    # write_results(output_filename_stemm + '_grammar.csv', results_grammar_features, grammar_features_list, CSV_SEP)
-    # write_log('Writing syntax features')
-    # write_results(output_filename_stemm + '_syntax.csv', results_syntax_features, syntax_features_list, CSV_SEP)
-    # write_log('Writing phrase features')
-    # write_results(output_filename_stemm + '_phrase.csv', results_phrase_features, phrase_features_list, CSV_SEP)
-    # write_log('Writing merged features')
-    # write_results(output_filename_stemm + '_merged.csv', results_merged_features, phrase_features_list, CSV_SEP)
-    # write_log('Writing additional meta features')
-    # write_results(output_filename_stemm + '_meta.csv', results_meta_features, phrase_features_list, CSV_SEP)
-    write_log('Writing all features')
-    write_results(output_filename_stemm + '_all.csv', results_all_features, phrase_features_list, CSV_SEP)
+    # Compile the corpus, if requested, instead of extracting features
+    if args.compile:
+        write_log('Compiling corpus {0} to corpus store {1}'.format(corpus_path, args.compile))
+        try:
+            compile_corpus(corpus, text_ids, args.compile)
+        except ValueError as e:
+            sys.exit('Unable to compile corpus {0}: {1}'.format(corpus_path, e))
+        write_log('---END OF PROGRAM---')
+        close_log()
+        sys.exit()
+
+    # Profile if requested
+    profiler = profile_stats = None
+    if args.profile or args.cprofile:
+        timer = FeatureTimer(cprofile=bool(args.cprofile))
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profile_stats = pstats.Stats()
+        profiler.enable()
+
+    # Extract all features, reading the data files of each text once, or the features of windows of each text
+    window = None
+    if args.window:
+        window = (args.window, args.stride or args.window)
+        output_filename_stemm += '_windows'
+        write_log('Extracting features of windows of {0} sentences, stride {1}'.format(*window))
+    #Write to output files, one row as soon as the features of each text are extracted, and compute feature statistics
+    columns = feature_columns(feature_lists)
+    with contextlib.ExitStack() as stack:
+        writers = []
+        for output_format in args.format:
+            writer_class, ending = output_formats[output_format]
+            write_log('Writing all features to file: {0}'.format(output_filename_stemm + ending))
+            writers.append(stack.enter_context(writer_class(output_filename_stemm + ending, columns, CSV_SEP)))
+        stats_writer = stack.enter_context(StatisticsWriter(output_filename_stemm + '_stats.csv', columns, CSV_SEP))
+        writers.append(stats_writer)
+        for text_id, features in extract_features(feature_lists, corpus, text_ids, args.workers,
+                                                     args.cache_dir, profile_stats, window, args.prefetch):
+            with timed('stage', 'output'):
+                for writer in writers:
+                    writer.write(text_id, features)
     write_log('  ... done')
+    write_log('Feature statistics written to file: {0}'.format(output_filename_stemm + '_stats.csv'))
+    if args.normalise:
+        write_log('Writing z-scores of all features to file: {0}'.format(output_filename_stemm + '_all_z.csv'))
+        normalise_results(output_filename_stemm + '_all.csv', output_filename_stemm + '_all_z.csv', stats_writer,
+                          CSV_SEP)
+
+    if profiler is not None:
+        profiler.disable()
+        profile_stats.add(profiler)
+        profile_stats.dump_stats(args.cprofile)
+        write_log('cProfile statistics written to file: {0}'.format(args.cprofile))
+    if timer is not None:
+        write_log('Writing feature timings to file: {0}'.format(output_filename_stemm + '_profile.csv'))
+        timer.write_report(output_filename_stemm + '_profile.csv', CSV_SEP)
     write_log('---END OF PROGRAM---')
+    close_log()
 
@@ -0,0 +1,317 @@
+"""
+Benchmark feature extraction on synthetic corpora of any size.
+
+Synthetic documents are generated from the sentences of a sample corpus (by default the test corpus): each sentence
+of a document is a sentence of the sample corpus, its chunk data and its conll data taken together, so that the
+chunk and conll data of a document are aligned, sentence by sentence and word by word. Sentence structures, tags,
+phrases and dependency trees are those of the sample corpus, while words and lemmas are drawn from a Zipf-distributed
+lexicon, so that the vocabulary keeps growing with the size of the corpus, as in real text.
+
+Documents are read through a corpus reader, as the program reads them. For each corpus size, the throughput (tokens
+and documents per second) and the peak memory of each stage of feature extraction are reported: reading the chunk
+data and the conll data of each document into the running states of their feature families (stream_text_features),
+computing the grammar, syntax, phrase and meta-features from them, and output. The whole extraction of each document
+(extract_text_features) is timed too, separately. Timings and peak memory are measured in separate passes over the
+same documents, since tracing memory allocations slows execution down.
+
+Example:    python benchmark.py --docs 10 1000 --tokens 100 10000
+"""
+
+__author__ = 'Yorgos'
+
+import os
+import argparse
+import codecs
+import collections
+import configparser
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import FeatExt
+
+stages = ['chunk data', 'conll data', 'grammar', 'syntax', 'phrase', 'meta', 'output']
+# The whole extraction of each document, timed apart from the stages, which it repeats
+end_to_end = 'extract_text_features'
+
+
+class SyntheticCorpus:
+    """
+    Generate synthetic documents, with aligned chunk and conll data, from the sentences of a sample corpus.
+    """
+
+    def __init__(self, path, seed=0, max_rank=1000000):
+        """
+        Collect the sentences and the lexicon of a sample corpus.
+
+        Only the sentences whose chunk data and conll data are aligned, i.e. whose chunk tokens are the conll
+        tokens, are kept.
+
+        @param path: path where the data files of the sample corpus reside
+        @param seed: seed of the random generator, the same seed generates the same documents
+        @param max_rank: the largest rank of a word in the lexicon of a tag
+        """
+        self.seed = seed
+        self.max_rank = max_rank
+        # Pairs of the chunk rows and the conll rows of a sentence
+        self.sentences = []
+        words = collections.defaultdict(collections.Counter)
+        corpus = FeatExt.DirectoryCorpus(path)
+        for text_id in sorted(corpus.text_ids()):
+            chunk_sentences = FeatExt.chunk_sentence_rows(
+                FeatExt.parse_tabbed_content(corpus.read(text_id, FeatExt.chunk_file_extension)), text_id)
+            conll_sentences = FeatExt.conll_sentences(
+                FeatExt.parse_tabbed_content(corpus.read(text_id, FeatExt.conll_file_extension)))
+            for chunk_rows, conll_rows in zip(chunk_sentences, conll_sentences):
+                tokens = [item for item in chunk_rows if is_token(item)]
+                if len(tokens) != len(conll_rows) or any(x[2] != y[1] for x, y in zip(tokens, conll_rows)):
+                    continue
+                self.sentences.append((chunk_rows, conll_rows))
+                for item in tokens:
+                    if item[1] == 'TOK':
+                        words[item[4]][(item[2], item[3])] += 1
+        if not self.sentences:
+            raise ValueError('No sentence of the sample corpus {0} has aligned chunk and conll data'.format(path))
+        # Lexicons (keys: chunk tags) of (word, lemma) pairs, most frequent first
+        self.lexicon = {tag: [x for x, count in counts.most_common()] for tag, counts in words.items()}
+        self.reset()
+
+    def reset(self):
+        """
+        Restart generating documents from the first one.
+        """
+        self.random = random.Random(self.seed)
+
+    def word(self, tag):
+        """
+        Draw a word and its lemma from the lexicon of a tag, with Zipf-distributed ranks.
+
+        Words beyond the words of the sample corpus are made up from them, numbered.
+
+        @param tag: the chunk tag of the word
+        @return: a (word, lemma) pair
+        """
+        words = self.lexicon[tag]
+        rank = min(int(self.random.paretovariate(1.0)), self.max_rank) - 1
+        word, lemma = words[rank % len(words)]
+        if rank < len(words):
+            return word, lemma
+        suffix = str(rank // len(words))
+        return word + suffix, lemma + suffix
+
+    def document(self, tokens):
+        """
+        Generate a document. Each word drawn is written to both its chunk data and its conll data.
+
+        @param tokens: the least number of tokens of the document
+        @return: a tuple of the chunk data and the conll data of the document, as utf-8 encoded bytes, and its
+                 number of tokens
+        """
+        chunk_lines = []
+        conll_lines = []
+        count = offset = 0
+        while count < tokens:
+            chunk_rows, conll_rows = self.random.choice(self.sentences)
+            conll_rows = iter(conll_rows)
+            for item in chunk_rows:
+                if is_token(item):
+                    conll_item = next(conll_rows)
+                    if item[1] == 'TOK':
+                        word, lemma = self.word(item[4])
+                        item = item[:2] + [word, lemma] + item[4:]
+                        conll_item = conll_item[:1] + [word, lemma] + conll_item[3:]
+                    # Chunk token ids are character offsets
+                    item = ['1\\{0}'.format(offset)] + item[1:]
+                    offset += len(item[2]) + 1
+                    count += 1
+                    conll_lines.append('\t'.join(conll_item))
+                chunk_lines.append('\t'.join(item))
+            conll_lines.append('')
+        chunk = '\n'.join(chunk_lines) + '\n'
+        conll = '\n'.join(conll_lines) + '\n'
+        return chunk.encode('utf-8'), conll.encode('utf-8'), count
+
+
+def is_token(item):
+    """
+    @param item: a chunk row
+    @return: True if the row is a token, i.e. has a conll row too
+    """
+    return item[1] not in ['SYN', '(SENT', ')SENT']
+
+
+class StageMeter:
+    """
+    Measure the time and the peak memory of the stages of feature extraction.
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        @param trace_memory: True to measure peak memory with tracemalloc, False to measure time
+        """
+        self.trace_memory = trace_memory
+        self.seconds = collections.OrderedDict((stage, 0.0) for stage in stages + [end_to_end])
+        self.peaks = collections.OrderedDict((stage, 0) for stage in stages + [end_to_end])
+
+    def run(self, stage, function, *args):
+        """
+        Call a function as part of a stage.
+
+        @param stage: the stage name
+        @param function: the function to call
+        @param args: the arguments of the function
+        @return: the result of the function
+        """
+        if self.trace_memory:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = function(*args)
+            self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1] - current)
+        else:
+            start = time.perf_counter()
+            result = function(*args)
+            self.seconds[stage] += time.perf_counter() - start
+        return result
+
+
+def extract(corpus, feature_lists, docs, tokens, meter, output_filename, corpus_path=None):
+    """
+    Generate documents and extract their features through a corpus reader, stage by stage, then all at once.
+
+    @param corpus: a SyntheticCorpus
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @param docs: number of documents
+    @param tokens: the least number of tokens of each document
+    @param meter: a StageMeter
+    @param output_filename: the name of the CSV file to write features to, with path
+    @param corpus_path: path to write the documents to, and read them from, None to read them from memory
+    @return: the number of tokens of all documents
+    """
+    corpus.reset()
+    total_tokens = 0
+    reader = FeatExt.DirectoryCorpus(corpus_path) if corpus_path is not None else None
+    with FeatExt.CsvResultsWriter(output_filename, FeatExt.feature_columns(feature_lists)) as writer:
+        for i in range(docs):
+            text_id = 'synthetic{0:06}'.format(i)
+            chunk, conll, count = corpus.document(tokens)
+            total_tokens += count
+            contents = {FeatExt.chunk_file_extension: chunk, FeatExt.conll_file_extension: conll}
+            if corpus_path is not None:
+                for file_extension, content in contents.items():
+                    with open(os.path.join(corpus_path, text_id + '.' + file_extension), 'wb') as f:
+                        f.write(content)
+            else:
+                reader = FeatExt.MemoryCorpus({text_id: contents})
+
+            states = {}
+            for stage, file_extension in [('chunk data', FeatExt.chunk_file_extension),
+                                          ('conll data', FeatExt.conll_file_extension)]:
+                states.update(meter.run(stage, stream_text, reader, text_id, file_extension, feature_lists))
+            features = collections.OrderedDict()
+            for family in ['grammar', 'syntax', 'phrase']:
+                features.update(meter.run(family, states[family], feature_lists[family]))
+            features.update(meter.run('meta', FeatExt.get_text_meta_features, feature_lists['meta'], features,
+                                      text_id))
+            meter.run('output', writer.write, text_id, features)
+
+            meter.run(end_to_end, FeatExt.extract_text_features, text_id, reader, feature_lists)
+    return total_tokens
+
+
+def stream_text(reader, text_id, file_extension, feature_lists):
+    """
+    Read the data of a document into the running states of its feature families, see stream_text_features.
+
+    @param reader: a corpus reader
+    @param text_id: the text id of the document
+    @param file_extension: the file extension of the data
+    @param feature_lists: a dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    @return: a dictionary (keys: feature families) of functions of a feature list, returning features
+    """
+    return FeatExt.stream_text_features(reader.read_rows(text_id, file_extension), file_extension, feature_lists,
+                                        text_id)
+
+
+def read_feature_lists(config_file):
+    """
+    Read the feature lists of a configuration file.
+
+    @param config_file: the configuration file name, with path
+    @return: an ordered dictionary of feature lists (keys: grammar, syntax, phrase, meta)
+    """
+    config = configparser.ConfigParser(allow_no_value=True)
+    with codecs.open(config_file, "r", "utf-8") as cfg_f:
+        config.read_file(cfg_f)
+    return collections.OrderedDict((family, config['FEATURES'][family + '_features_list'].split())
+                                   for family in ['grammar', 'syntax', 'phrase', 'meta'])
+
+
+if __name__ == "__main__":
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Benchmark feature extraction on synthetic corpora')
+    parser.add_argument("--docs", type=int, nargs='+', default=[10, 100],
+                        help="numbers of documents of the corpora (default: 10 100)")
+    parser.add_argument("--tokens", type=int, nargs='+', default=[100, 1000],
+                        help="numbers of tokens of each document of the corpora (default: 100 1000)")
+    parser.add_argument("--sample", default=os.path.join(script_path, '..', 'data', 'test_corpus'),
+                        help="sample corpus to generate documents from (default: the test corpus)")
+    parser.add_argument("-c", "--config_file", default=os.path.join(script_path, 'def_config.cfg'),
+                        help="configuration file with the feature lists (default: def_config.cfg)")
+    parser.add_argument("--functional-words", default=os.path.join(script_path, '..', 'data', 'functional words.txt'),
+                        help="functional words file (default: data/functional words.txt)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator (default: 0)")
+    parser.add_argument("--no-memory", action='store_true', help="do not measure peak memory")
+    parser.add_argument("--write", metavar='DIR', help="also write the documents of each corpus to DIR/<docs>x<tokens>")
+    parser.add_argument("--csv", metavar='FILE', help="also write the results to a CSV file")
+    args = parser.parse_args()
+
+    FeatExt.functional_words_filename = args.functional_words
+    FeatExt.chunk_file_extension = 'chunk'
+    FeatExt.conll_file_extension = 'conll'
+    feature_lists = read_feature_lists(args.config_file)
+    FeatExt.meta_feature_expressions.update(FeatExt.read_meta_feature_expressions(args.config_file))
+    temp_path = tempfile.mkdtemp()
+    FeatExt.init_log(os.path.join(temp_path, 'benchmark.log'), quiet=True)
+    corpus = SyntheticCorpus(args.sample, args.seed)
+
+    results = []
+    for docs in args.docs:
+        for tokens in args.tokens:
+            corpus_path = None
+            if args.write:
+                corpus_path = os.path.join(args.write, '{0}x{1}'.format(docs, tokens))
+                os.makedirs(corpus_path, exist_ok=True)
+            output_filename = os.path.join(temp_path, 'featext_all.csv')
+            meter = StageMeter()
+            total_tokens = extract(corpus, feature_lists, docs, tokens, meter, output_filename, corpus_path)
+            if not args.no_memory:
+                memory_meter = StageMeter(trace_memory=True)
+                tracemalloc.start()
+                extract(corpus, feature_lists, docs, tokens, memory_meter, output_filename, corpus_path)
+                tracemalloc.stop()
+                meter.peaks = memory_meter.peaks
+            print('{0} documents of {1} tokens ({2} tokens in all):'.format(docs, tokens, total_tokens))
+            print('  {0:<22}{1:>12}{2:>14}{3:>12}{4:>14}'.format('stage', 'seconds', 'tokens/sec', 'docs/sec',
+                                                                 'peak MiB'))
+            for stage in stages + ['total', end_to_end]:
+                if stage == 'total':
+                    seconds = sum(meter.seconds[x] for x in stages)
+                    peak = max(meter.peaks[x] for x in stages)
+                else:
+                    seconds, peak = meter.seconds[stage], meter.peaks[stage]
+                results.append([docs, tokens, stage, seconds, total_tokens / seconds if seconds else 0.0,
+                                docs / seconds if seconds else 0.0, peak])
+                print('  {0:<22}{1:>12.3f}{2:>14.0f}{3:>12.1f}{4:>14}'.format(
+                    stage, seconds, results[-1][4], results[-1][5],
+                    '-' if args.no_memory else '{0:.2f}'.format(peak / 1048576)))
+    FeatExt.close_log()
+    shutil.rmtree(temp_path)
+
+    if args.csv:
+        with codecs.open(args.csv, "w", "utf-8") as csv_file:
+            csv_file.write(','.join(['docs', 'tokens', 'stage', 'seconds', 'tokens_per_sec', 'docs_per_sec',
+                                     'peak_bytes']) + '\n')
+            for row in results:
+                csv_file.write(','.join(str(x) for x in row) + '\n')
@@ -0,0 +1,386 @@
+"""
+Tests of feature extraction. Run from the repository root:    python -m unittest discover tests
+"""
+
+__author__ = 'Yorgos'
+
+import configparser
+import io
+import itertools
+import math
+import os
+import statistics
+import sys
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'FeatExt'))
+import FeatExt
+
+test_corpus = os.path.join(root, 'data', 'test_corpus')
+
+
+def setUpModule():
+    # Set as the main program sets them from the default configuration
+    FeatExt.chunk_file_extension = 'chunk'
+    FeatExt.conll_file_extension = 'conll'
+    FeatExt.functional_words_filename = os.path.join(root, 'data', 'functional words.txt')
+
+
+def default_feature_lists():
+    """
+    @return: a dictionary of the feature lists of the default configuration (keys: grammar, syntax, phrase, meta)
+    """
+    config = configparser.ConfigParser(allow_no_value=True)
+    config.read(os.path.join(root, 'FeatExt', 'def_config.cfg'), encoding='utf-8')
+    return {family: config['FEATURES'][family + '_features_list'].split()
+            for family in ['grammar', 'syntax', 'phrase', 'meta']}
+
+
+class SlidingWindowsTest(unittest.TestCase):
+
+    def test_stride_dividing_the_sentences(self):
+        self.assertEqual(FeatExt.sliding_windows(10, 4, 2), [(0, 4), (2, 6), (4, 8), (6, 10)])
+
+    def test_last_sentences_covered(self):
+        self.assertEqual(FeatExt.sliding_windows(10, 4, 4), [(0, 4), (4, 8), (6, 10)])
+        self.assertEqual(FeatExt.sliding_windows(9, 4, 10), [(0, 4), (5, 9)])
+
+    def test_fewer_sentences_than_window(self):
+        self.assertEqual(FeatExt.sliding_windows(3, 5, 1), [(0, 3)])
+
+    def test_every_sentence_covered(self):
+        for count in range(1, 30):
+            for size in range(1, 8):
+                for stride in range(1, 10):
+                    windows = FeatExt.sliding_windows(count, size, stride)
+                    self.assertEqual(windows[-1][1], count)
+                    self.assertTrue(all(end - start == min(size, count) for start, end in windows))
+                    if stride <= size:
+                        covered = set(i for start, end in windows for i in range(start, end))
+                        self.assertEqual(covered, set(range(count)))
+
+
+def chunk_content(*sentences):
+    """
+    @param sentences: lists of the lemmas of the words of each sentence
+    @return: the content of a chunk file of the sentences, as bytes
+    """
+    lines = []
+    for sentence in sentences:
+        lines.append('\t(SENT\t<S>')
+        lines.extend('1\\{0}\tTOK\t{1}\t{1}\tNoCmNeSgAc'.format(i, lemma) for i, lemma in enumerate(sentence))
+        lines.append('\t)SENT\t</S>')
+    return ''.join(line + '\n' for line in lines).encode('utf-8')
+
+
+class LexicalDiversityTest(unittest.TestCase):
+
+    def test_mtld(self):
+        self.assertEqual(FeatExt.get_MTLD(['a', 'a', 'b']), 3.0)
+        # Factors of 3 words (TTR 2/3), and 2 words left whose TTR is 1
+        self.assertAlmostEqual(FeatExt.get_MTLD(['a', 'b'] * 10), 20 / 6)
+        # Only a partial factor, of TTR 3/4, in both directions
+        self.assertAlmostEqual(FeatExt.get_MTLD(['a', 'b', 'c', 'a']), 4 / (0.25 / 0.28))
+
+    def test_mtld_without_repeated_words(self):
+        self.assertEqual(FeatExt.get_MTLD(['a', 'b', 'c']), FeatExt.missing)
+
+    def test_hdd(self):
+        self.assertAlmostEqual(FeatExt.get_HDD(['a', 'a', 'b'], sample=2), (1 + 2 / 3) / 2)
+        # A sample of all the words draws every type
+        self.assertAlmostEqual(FeatExt.get_HDD(['a'] * 21 + ['b'] * 21), 2 / 42)
+
+    def test_hdd_terms(self):
+        for n, sample in [(42, 42), (50, 42), (300, 42), (1000, 10)]:
+            terms = FeatExt.hdd_terms(n, sample, n + 1)
+            for freq in range(n + 1):
+                expected = math.comb(n - freq, sample) / math.comb(n, sample)
+                self.assertTrue(math.isclose(terms[freq], expected, rel_tol=1e-9, abs_tol=1e-300), (n, freq))
+
+    def test_hdd_of_short_text(self):
+        self.assertEqual(FeatExt.get_HDD(['a'] * 41), FeatExt.missing)
+
+    def test_d(self):
+        # Roots sympy.solve gave for the TTR curve of the reference
+        for n, t, d in [(10, 7, 8.16666666666667), (100, 55, 33.6111111111111), (539, 375, 428.734756097560),
+                        (2000, 1021, 532.400919305414), (50000, 3, 9.00054003240194e-5)]:
+            self.assertTrue(math.isclose(FeatExt.solve_D(float(n), float(t)), d, rel_tol=1e-12), (n, t))
+
+    def test_d_without_solution(self):
+        # No word repeated (TTR 1), where sympy.solve found no root
+        self.assertEqual(FeatExt.solve_D(7.0, 7.0), '')
+        with self.assertRaises(ZeroDivisionError):
+            FeatExt.solve_D(0.0, 0.0)
+        self.assertEqual(FeatExt.get_grammar_features([], ['m_D']), {'m_D': FeatExt.div0})
+
+    def test_features_of_short_text(self):
+        data = FeatExt.parse_tabbed_content(chunk_content(['a', 'b'], ['c']))
+        features = FeatExt.get_grammar_features(data, ['m_MTLD', 'm_HDD', 'm_MATTR'])
+        self.assertEqual(features, {'m_MTLD': FeatExt.missing, 'm_HDD': FeatExt.missing, 'm_MATTR': 1.0})
+
+    def test_features_of_empty_text(self):
+        features = FeatExt.get_grammar_features([], ['m_MTLD', 'm_HDD'])
+        self.assertEqual(features, {'m_MTLD': FeatExt.missing, 'm_HDD': FeatExt.missing})
+
+
+class MetaFeaturesTest(unittest.TestCase):
+
+    def test_default_definitions(self):
+        self.assertEqual(FeatExt.meta_feature_expressions['m_AuxToChar'], '(AuxX + AuxK + AuxG) / Char')
+        for feature in default_feature_lists()['meta']:
+            names, function = FeatExt.compile_meta_feature(FeatExt.meta_feature_expressions[feature])
+            self.assertTrue(names)
+
+
+class FeatureCacheTest(unittest.TestCase):
+
+    def test_cache_file_of_lexical_diversity_parameters(self):
+        name = FeatExt.feature_cache_file('cache', 'grammar', '0' * 40)
+        for parameter, value in [('mattr_window', 100), ('mtld_threshold', 0.7), ('hdd_sample', 50)]:
+            default = getattr(FeatExt, parameter)
+            setattr(FeatExt, parameter, value)
+            try:
+                self.assertNotEqual(FeatExt.feature_cache_file('cache', 'grammar', '0' * 40), name, parameter)
+            finally:
+                setattr(FeatExt, parameter, default)
+        self.assertEqual(FeatExt.feature_cache_file('cache', 'grammar', '0' * 40), name)
+
+
+class CompiledCorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'corpus.store')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_rows(self):
+        corpus = FeatExt.DirectoryCorpus(test_corpus)
+        FeatExt.compile_corpus(corpus, corpus.text_ids(), self.filename)
+        store = FeatExt.CompiledCorpus(self.filename)
+        self.assertEqual(store.text_ids(), corpus.text_ids())
+        for text_id in corpus.text_ids():
+            for file_extension in ['chunk', 'conll']:
+                rows = [tuple(row) for row in corpus.read_rows(text_id, file_extension) if row]
+                self.assertEqual(list(store.read_rows(text_id, file_extension)), rows)
+                self.assertEqual(store.read_digest(text_id, file_extension),
+                                 corpus.read_digest(text_id, file_extension))
+
+    def test_too_many_fields(self):
+        content = ('\t'.join(['x'] * (FeatExt.CompiledCorpus.max_row_fields + 1)) + '\n').encode('utf-8')
+        corpus = FeatExt.MemoryCorpus({'1': {'chunk': b'', 'conll': content}})
+        with self.assertRaisesRegex(ValueError, 'text 1.conll has 65536 fields'):
+            FeatExt.compile_corpus(corpus, ['1'], self.filename)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class NormaliseResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_z_scores(self):
+        columns = ['A', 'B', 'C']
+        rows = [('1', {'A': 1, 'B': 2.5, 'C': 7}), ('2', {'A': 4, 'B': FeatExt.missing, 'C': 7}),
+                ('3', {'A': 2, 'B': -1.0, 'C': 7}), ('4', {'A': 9, 'B': 0.25, 'C': FeatExt.div0})]
+        input_filename = os.path.join(self.directory.name, 'features.csv')
+        output_filename = os.path.join(self.directory.name, 'features_z.csv')
+        with FeatExt.StatisticsWriter(os.path.join(self.directory.name, 'stats.csv'), columns) as stats_writer, \
+                open(input_filename, 'w', encoding='utf-8') as input_file:
+            input_file.write(','.join(['text_id'] + columns) + '\n')
+            for text_id, features in rows:
+                stats_writer.write(text_id, features)
+                input_file.write(','.join([text_id] + [str(features[x]) for x in columns]) + '\n')
+        FeatExt.normalise_results(input_filename, output_filename, stats_writer)
+
+        with open(output_filename, encoding='utf-8') as output_file:
+            lines = [line.rstrip('\n').split(',') for line in output_file]
+        self.assertEqual(lines[0], ['text_id'] + columns)
+        self.assertEqual([line[0] for line in lines[1:]], ['1', '2', '3', '4'])
+        for i, column in enumerate(columns, 1):
+            values = [float(line[i]) for line in lines[1:] if line[i] not in (FeatExt.missing, FeatExt.div0)]
+            if column == 'C':
+                # A constant feature has no z-scores
+                self.assertEqual([line[i] for line in lines[1:]], [FeatExt.div0] * 4)
+                continue
+            self.assertAlmostEqual(statistics.mean(values), 0)
+            self.assertAlmostEqual(statistics.stdev(values), 1)
+        # Markers are passed through
+        self.assertEqual(lines[2][2], FeatExt.missing)
+
+
+def phrase_len_list(data, phrase_id):
+    """
+    The lengths of the phrases of a phrase id, measured one phrase id at a time, as before phrase_analysis.
+
+    @param data: chunk data of text as a list
+    @param phrase_id: a lowercase phrase id
+    @return: a list of phrase lengths, in the order phrases close
+    """
+    len_list = []
+    word_counter = {0: 0}
+    into_phrase = 0
+    for item in data:
+        if item[2] == '[' + phrase_id:
+            into_phrase += 1
+            word_counter[into_phrase] = 0
+        elif item[2] == '/' + phrase_id + ']' and into_phrase:
+            len_list.append(word_counter[into_phrase])
+            word_counter[into_phrase - 1] += word_counter[into_phrase]
+            into_phrase -= 1
+        elif item[1] in ['TOK', 'ABBR', 'DIG'] and into_phrase:
+            word_counter[into_phrase] += 1
+    return len_list
+
+
+class PhraseFeaturesTest(unittest.TestCase):
+
+    def setUp(self):
+        lines = ['\t(SENT\t<S>']
+        # A clause of a noun phrase, a verb group and a noun phrase holding another, and a clause of a noun phrase
+        # holding a noun phrase of the same id
+        for marker in ['[cl', '[np_nm', 'Ο', 'άνθρωπος', '/np_nm]', '[vg', 'τρέχει', '/vg]', '[np_ac', 'το',
+                       '[np_ge', 'του', 'σπιτιού', '/np_ge]', '/np_ac]', '/cl]',
+                       '[cl', '[np_nm', '[np_nm', 'α', '/np_nm]', 'β', '/np_nm]', '/cl]']:
+            if marker[0] in '[/':
+                lines.append('\tSYN\t' + marker)
+            else:
+                lines.append('1\\{0}\tTOK\t{1}\t{1}\tNoCmMaSgNm'.format(len(lines), marker))
+        lines.append('\t)SENT\t</S>')
+        self.data = FeatExt.parse_tabbed_content(''.join(line + '\n' for line in lines).encode('utf-8'))
+
+    def test_counts_and_lengths(self):
+        features = FeatExt.get_phrase_features(self.data, ['Cl', 'Np_nm', 'Np_ac', 'Np_ge', 'Vg', 'Advp', 'Np_all',
+                                                           'L_Cl', 'L_Np_nm', 'L_Np_ac', 'L_Np_ge', 'L_Vg', 'L_Advp',
+                                                           'L_Np_all'])
+        self.assertEqual(features, {'Cl': 2, 'Np_nm': 3, 'Np_ac': 1, 'Np_ge': 1, 'Vg': 1, 'Advp': 0, 'Np_all': 5,
+                                    'L_Cl': 4, 'L_Np_nm': 5 / 3, 'L_Np_ac': 3, 'L_Np_ge': 2, 'L_Vg': 1, 'L_Advp': 0,
+                                    'L_Np_all': 2})
+
+    def test_lengths_of_each_phrase_id(self):
+        phrase_ids = ['cl', 'np_nm', 'np_ac', 'np_ge', 'vg', 'advp']
+        counts, len_lists = FeatExt.phrase_analysis(self.data)
+        for phrase_id in phrase_ids:
+            self.assertEqual(counts[phrase_id], [row[2] for row in self.data].count('[' + phrase_id), phrase_id)
+            self.assertEqual(sorted(len_lists[phrase_id]), sorted(phrase_len_list(self.data, phrase_id)), phrase_id)
+        features = FeatExt.get_phrase_features(self.data, ['L_' + phrase_id.capitalize() for phrase_id in phrase_ids])
+        for phrase_id in phrase_ids:
+            lengths = phrase_len_list(self.data, phrase_id)
+            self.assertEqual(features['L_' + phrase_id.capitalize()], statistics.mean(lengths) if lengths else 0)
+
+
+class ContentLinesTest(unittest.TestCase):
+
+    def test_same_lines_as_text_mode(self):
+        text = 'αβγ\tδ\r\nε\rζη\n\nθ\r\r\nι'
+        content = text.encode('utf-8')
+        expected = list(io.StringIO(text, newline=None))
+        for block_size in range(1, len(content) + 2):
+            self.assertEqual(list(FeatExt.iter_content_lines(content, block_size)), expected)
+            self.assertEqual(list(FeatExt.iter_content_lines(memoryview(content), block_size)), expected)
+
+
+class GrammarSummaryTest(unittest.TestCase):
+
+    def assertSameWords(self, rows):
+        sentences = FeatExt.get_sentences(rows)
+        words = [word for sentence in sentences for word in sentence]
+        summary = FeatExt.GrammarState.summarise(rows)
+        self.assertEqual(list(summary.offsets), [0] + list(itertools.accumulate(map(len, sentences))))
+        for column, item in [(summary.types, 3), (summary.lemmas, 1), (summary.tags, 2)]:
+            self.assertEqual([FeatExt.string_ids.strings[string_id] for string_id in column],
+                             [word[item] for word in words])
+        self.assertEqual(summary.chars, sum(len(word[0]) for word in words))
+
+    def test_test_corpus(self):
+        corpus = FeatExt.DirectoryCorpus(test_corpus)
+        for text_id in corpus.text_ids():
+            self.assertSameWords(FeatExt.parse_tabbed_content(corpus.read(text_id, 'chunk')))
+
+    def test_words_outside_sentences(self):
+        def word(text):
+            return ['1\\1', 'TOK', text, text.lower(), 'NoCmNeSgAc']
+        start, end = ['', '(SENT', '<S>'], ['', ')SENT', '</S>']
+        # Words before the first sentence, after a sentence, in a sentence closed twice and in an open sentence
+        self.assertSameWords([word('A'), start, word('B'), end, word('C'), start, end, word('D'), end, word('E'),
+                              start, word('F')])
+        # Words before a sentence end with no sentence start
+        self.assertSameWords([word('A'), end, word('B'), start, word('C'), end])
+        self.assertSameWords([start, end, end])
+
+
+class StreamTest(unittest.TestCase):
+    """
+    The features of texts read one batch of sentences at a time are those of texts read whole.
+    """
+
+    def setUp(self):
+        self.feature_lists = default_feature_lists()
+        self.batch_size = FeatExt.stream_batch_size
+
+    def tearDown(self):
+        FeatExt.stream_batch_size = self.batch_size
+
+    def assertSameFeatures(self, streamed, expected):
+        self.assertEqual(list(streamed), list(expected))
+        for feature, value in expected.items():
+            if isinstance(value, float):
+                self.assertTrue(math.isclose(streamed[feature], value, rel_tol=1e-9), feature)
+            else:
+                self.assertEqual(streamed[feature], value, feature)
+
+    def assertSameChunkFeatures(self, content):
+        data = FeatExt.parse_tabbed_content(content)
+        expected = FeatExt.get_grammar_features(data, self.feature_lists['grammar'])
+        expected.update(FeatExt.get_phrase_features(data, self.feature_lists['phrase']))
+        for batch_size in [1, 2, 16]:
+            FeatExt.stream_batch_size = batch_size
+            corpus = FeatExt.MemoryCorpus({'': {'chunk': content}})
+            state = FeatExt.stream_text_features(corpus.read_rows('', 'chunk'), 'chunk', self.feature_lists)
+            streamed = state['grammar'](self.feature_lists['grammar'])
+            streamed.update(state['phrase'](self.feature_lists['phrase']))
+            self.assertSameFeatures(streamed, expected)
+
+    def test_test_corpus(self):
+        corpus = FeatExt.DirectoryCorpus(test_corpus)
+        for text_id in corpus.text_ids():
+            self.assertSameChunkFeatures(corpus.read(text_id, 'chunk'))
+            data = FeatExt.parse_tabbed_content(corpus.read(text_id, 'conll'))
+            expected = FeatExt.get_syntax_features(data, self.feature_lists['syntax'])
+            state = FeatExt.stream_text_features(corpus.read_rows(text_id, 'conll'), 'conll')
+            self.assertSameFeatures(state['syntax'](self.feature_lists['syntax']), expected)
+
+    def test_rows_outside_sentences(self):
+        with open(os.path.join(test_corpus, '6109.chunk'), encoding='utf-8') as f:
+            lines = f.readlines()
+        ends = [i for i, line in enumerate(lines) if '\t)SENT\t' in line]
+        # A phrase opened in the last sentence and closed after it, a phrase opened between sentences, a phrase
+        # spanning two sentences, a word between sentences, and a word before the first sentence
+        lines.insert(ends[-1] + 1, '\tSYN\t/cl]\n')
+        lines.insert(ends[-1], '\tSYN\t[cl\n')
+        lines.insert(ends[4] + 1, '\tSYN\t[cl\n')
+        lines.insert(ends[3], '\tSYN\t/cl_r]\n')
+        lines.insert(ends[2], '\tSYN\t[cl_r\n')
+        lines.insert(ends[0] + 1, '1\\999\tTOK\tλέξη\tλέξη\tNoCmFeSgNm\n')
+        lines.insert(0, '1\\0\tTOK\tλέξη\tλέξη\tNoCmFeSgNm\n')
+        self.assertSameChunkFeatures(''.join(lines).encode('utf-8'))
+
+    def test_text_features(self):
+        corpus = FeatExt.DirectoryCorpus(test_corpus)
+        for text_id in corpus.text_ids():
+            data = FeatExt.read_text_data(corpus, text_id)
+            expected = FeatExt.get_grammar_features(data['chunk'], self.feature_lists['grammar'])
+            expected.update(FeatExt.get_syntax_features(data['conll'], self.feature_lists['syntax']))
+            expected.update(FeatExt.get_phrase_features(data['chunk'], self.feature_lists['phrase']))
+            expected.update(FeatExt.get_text_meta_features(self.feature_lists['meta'], expected, text_id))
+            self.assertSameFeatures(FeatExt.extract_text_features(text_id, corpus, self.feature_lists), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()